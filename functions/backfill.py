@@ -0,0 +1,188 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from firebase_admin import firestore
+
+from enrichment import (
+    enrichment_messages,
+    extract_user_vehicle_text,
+    open_metadata_fields,
+    parse_enrichment,
+)
+from enrichment_queue import apply_car_enrichment
+from response_formats import vehicle_enrichment_response_format
+
+logger = logging.getLogger("carllm")
+
+BACKFILL_JOBS_COLLECTION = "backfill_jobs"
+BACKFILL_PROMPT_VERSION = 1
+PAGE_SIZE = 300
+MESSAGES_PER_CALL = 25
+MAX_CHARS_PER_CALL = 12000
+CONCURRENCY = 4
+
+def _chunk_texts(texts, max_messages: int, max_chars: int):
+    chunk = []
+    size = 0
+    for text in texts:
+        if chunk and (len(chunk) >= max_messages or size + len(text) > max_chars):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(text)
+        size += len(text)
+    if chunk:
+        yield chunk
+
+
+class BackfillJob:
+    # Resumable scan of user messages that re-runs vehicle enrichment in per-car batches.
+    def __init__(
+        self,
+        db,
+        call_llm,
+        job_id: str,
+        now_ms,
+        page_size: int = PAGE_SIZE,
+        messages_per_call: int = MESSAGES_PER_CALL,
+        concurrency: int = CONCURRENCY,
+    ):
+        self._db = db
+        self._call_llm = call_llm
+        self._now_ms = now_ms
+        self._page_size = page_size
+        self._messages_per_call = messages_per_call
+        self._concurrency = concurrency
+        self._job_ref = db.collection(BACKFILL_JOBS_COLLECTION).document(job_id)
+        self._chat_cars = {}
+        self._lock = Lock()
+        self._llm_calls = 0
+
+    def _load_state(self):
+        snapshot = self._job_ref.get()
+        if snapshot.exists:
+            return snapshot.to_dict() or {}
+        state = {
+            "status": "running",
+            "cursor": None,
+            "messagesProcessed": 0,
+            "carsProcessed": 0,
+            "carsUpdated": 0,
+            "llmCalls": 0,
+            "promptVersion": BACKFILL_PROMPT_VERSION,
+            "startedAt": self._now_ms(),
+        }
+        self._job_ref.set(state)
+        return state
+
+    def _next_page(self, cursor):
+        query = (
+            self._db.collection_group("messages")
+            .where(filter=firestore.FieldFilter("role", "==", "user"))
+            .order_by("__name__")
+            .limit(self._page_size)
+        )
+        if cursor:
+            query = query.start_after({"__name__": self._db.document(cursor)})
+        return list(query.stream())
+
+    def _car_id_for_chat(self, chat_ref):
+        if chat_ref.id not in self._chat_cars:
+            snapshot = chat_ref.get()
+            data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            self._chat_cars[chat_ref.id] = data.get("carId")
+        return self._chat_cars[chat_ref.id]
+
+    def _group_by_car(self, snapshots):
+        grouped = {}
+        for snap in snapshots:
+            content = ((snap.to_dict() or {}).get("content") or "").strip()
+            if not content:
+                continue
+            car_id = self._car_id_for_chat(snap.reference.parent.parent)
+            if car_id:
+                grouped.setdefault(car_id, []).append(extract_user_vehicle_text(content))
+        return grouped
+
+    def _extract(self, car_data, texts, open_fields):
+        response = self._call_llm(
+            enrichment_messages(car_data, texts, open_fields),
+            vehicle_enrichment_response_format(open_fields),
+        )
+        with self._lock:
+            self._llm_calls += 1
+        parsed = parse_enrichment(response)
+        if parsed is None:
+            logger.info("backfill: no confident update")
+        return parsed
+
+    def _process_car(self, car_id: str, texts) -> bool:
+        car_ref = self._db.collection("cars").document(car_id)
+        snapshot = car_ref.get()
+        if not snapshot.exists:
+            return False
+        car_data = snapshot.to_dict() or {}
+        open_fields = open_metadata_fields(car_data)
+        updated = False
+        for chunk in _chunk_texts(texts, self._messages_per_call, MAX_CHARS_PER_CALL):
+            parsed = self._extract(car_data, chunk, open_fields)
+            if not parsed:
+                continue
+            write_updates = apply_car_enrichment(self._db, car_ref, parsed, open_fields, self._now_ms)
+            car_data.update(write_updates)
+            updated = updated or bool(write_updates)
+        return updated
+
+    def run(self, time_budget_seconds: float = None, max_pages: int = None) -> dict:
+        state = self._load_state()
+        started = time.perf_counter()
+        messages = cars = updated = pages = 0
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            while state.get("status") != "done":
+                if max_pages is not None and pages >= max_pages:
+                    break
+                elapsed = time.perf_counter() - started
+                if time_budget_seconds is not None and elapsed >= time_budget_seconds:
+                    break
+                page = self._next_page(state.get("cursor"))
+                if not page:
+                    state["status"] = "done"
+                    self._job_ref.update({"status": "done", "finishedAt": self._now_ms()})
+                    break
+                grouped = self._group_by_car(page)
+                calls_before = self._llm_calls
+                page_updated = sum(
+                    executor.map(lambda item: self._process_car(*item), grouped.items())
+                )
+                pages += 1
+                messages += len(page)
+                cars += len(grouped)
+                updated += page_updated
+                # Checkpoint after every page so a timeout resumes where it stopped.
+                state["cursor"] = page[-1].reference.path
+                self._job_ref.update(
+                    {
+                        "cursor": state["cursor"],
+                        "messagesProcessed": firestore.Increment(len(page)),
+                        "carsProcessed": firestore.Increment(len(grouped)),
+                        "carsUpdated": firestore.Increment(page_updated),
+                        "llmCalls": firestore.Increment(self._llm_calls - calls_before),
+                        "updatedAt": self._now_ms(),
+                    }
+                )
+        elapsed = time.perf_counter() - started
+        stats = {
+            "status": state.get("status", "running"),
+            "pages": pages,
+            "messages": messages,
+            "cars": cars,
+            "carsUpdated": updated,
+            "llmCalls": self._llm_calls,
+            "elapsedSeconds": round(elapsed, 3),
+            "messagesPerSecond": round(messages / elapsed, 2) if elapsed else 0.0,
+            "carsPerSecond": round(cars / elapsed, 2) if elapsed else 0.0,
+        }
+        logger.info("backfill: run finished", extra=stats)
+        return stats
@@ -0,0 +1,23 @@
+import time
+from contextlib import contextmanager
+
+
+class Timer:
+    def __init__(self):
+        self.elapsed = 0.0
+
+
+@contextmanager
+def timed():
+    timer = Timer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.elapsed = time.perf_counter() - start
+
+
+def report(name: str, count: int, elapsed: float, unit: str = "ops"):
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{name}: {count} {unit} in {elapsed:.3f}s ({rate:,.0f} {unit}/s)")
+    return rate
@@ -0,0 +1,30 @@
+import importlib
+import pkgutil
+import sys
+
+import benchmarks
+
+
+def main(argv):
+    names = [
+        module.name
+        for module in pkgutil.iter_modules(benchmarks.__path__)
+        if module.name.startswith("bench_")
+    ]
+    selected = [f"bench_{name}" for name in argv] or sorted(names)
+    failed = []
+    for name in selected:
+        if name not in names:
+            print(f"unknown benchmark: {name[len('bench_'):]}", file=sys.stderr)
+            return 2
+        # A benchmark returns False when it blows its budget.
+        if importlib.import_module(f"benchmarks.{name}").run() is False:
+            failed.append(name)
+    if failed:
+        print(f"over budget: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+import inspect
+import json
+import os
+import re
+
+from firebase_functions import https_fn
+
+import main
+from benchmarks import timed
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from metrics import METRICS
+from providers import Endpoint, Router
+
+# End-to-end fanout_diagnosis latency as the fan-out widens from 3 to 12 models, with a
+# single judge versus the bracket (JUDGE_GROUP_SIZE=4). Every model is served by the
+# local inference stand-in, whose time to first token grows with prompt length; lower
+# BRACKET_PREFILL_TPS to model a slower (e.g. reasoning) judge.
+WIDTHS = (3, 6, 9, 12)
+GROUP_SIZE = 4
+TTFT_MS = 150
+PREFILL_TPS = float(os.environ.get("BRACKET_PREFILL_TPS", "1500"))
+GAP_MS = 2
+UID = "bench-user"
+PARTS = ["ignition coil", "spark plug", "fuel injector", "intake gasket", "valve seal", "wiring harness"]
+
+
+def _reply(payload) -> str:
+    schema = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name")
+    if schema == "diagnosis_sufficiency":
+        return json.dumps({"is_sufficient": True, "confidence": 0.97, "followup_questions": []})
+    if schema == "diagnosis_judgement":
+        # The stand-in judge picks the first candidate it was shown.
+        prompt = payload["messages"][-1]["content"]
+        winner = re.search(r"^Model: (.+)$", prompt, re.MULTILINE).group(1)
+        return json.dumps(
+            {
+                "model_name": winner,
+                "diagnostic_answer": "Failed cylinder 2 ignition coil",
+                "justifacation": ["P0302 isolates cylinder 2", "Moisture after a car wash"],
+                "explanation": "Swap coils 2 and 3 and see whether the misfire follows the coil.",
+            }
+        )
+    index = int(payload["model"].rsplit("-", 1)[-1])
+    part = PARTS[index % len(PARTS)]
+    return json.dumps(
+        {
+            "primary_diagnosis": f"Failed cylinder 2 {part} (variant {index})",
+            "root_causes": [f"{cause} degraded by heat and moisture over time" for cause in PARTS[:4]],
+            "next_checks": [f"Swap the {part} with cylinder 3 and recheck codes", "Measure coil resistance"],
+            "confidence": 0.6,
+            "explanation": " ".join(["Misfire on cylinder 2 under load after a wash."] * 6),
+        }
+    )
+
+
+def _seed(db):
+    db.document("cars/car1").set({"userId": UID, "year": 2014, "make": "Honda", "model": "Civic"})
+    db.document("chats/chat1").set({"userId": UID, "carId": "car1", "status": "open", "awaitingResponse": True})
+    messages = db.collection("chats").document("chat1").collection("messages")
+    messages.document("m1").set(
+        {
+            "role": "user",
+            "promptType": "intake",
+            "content": "Rough idle when warm, flashing check engine light, P0302 after a car wash.",
+            "metadata": {"intakeStage": "initial"},
+            "createdAt": 1,
+        }
+    )
+    messages.document("m2").set(
+        {
+            "role": "user",
+            "promptType": "intake",
+            "content": json.dumps({"answers": ["A week ago", "Worse under load"]}),
+            "metadata": {"intakeStage": "followup_answer"},
+            "createdAt": 2,
+        }
+    )
+
+
+def _diagnose(width: int, group_size: int):
+    db = LocalFirestore()
+    _seed(db)
+    main._get_db = lambda: db
+    main.FANOUT_MODELS = [f"bench/model-{index}" for index in range(width)]
+    main.JUDGE_GROUP_SIZE = group_size
+    METRICS.reset()
+    request = https_fn.CallableRequest(
+        data={"chatId": "chat1", "messageId": "m2"},
+        raw_request=None,
+        auth=https_fn.AuthData(uid=UID, token={}),
+    )
+    with timed() as timer:
+        inspect.unwrap(main.fanout_diagnosis)(request)
+    aggregation = next(
+        data for path, data in db.docs.items() if path.startswith("chats/chat1/aggregations/")
+    )
+    summaries = METRICS.snapshot()["summaries"]
+    return {
+        "ms": timer.elapsed * 1000,
+        "strategy": aggregation["strategy"],
+        "judgeTokens": summaries["judge.prompt_tokens"]["max"],
+        "judgeMs": summaries["judge.latency_ms"]["max"],
+    }
+
+
+def run():
+    saved = {
+        name: getattr(main, name)
+        for name in ("_get_db", "_provider_router", "_cassette", "FANOUT_MODELS", "JUDGE_GROUP_SIZE", "CONSENSUS_ENABLED")
+    }
+    with LocalInferenceServer(_reply, ttft_ms=TTFT_MS, gap_ms=GAP_MS, prefill_tps=PREFILL_TPS) as server:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        main._provider_router = lambda: router
+        main._cassette = lambda: None
+        main.CONSENSUS_ENABLED = False
+        os.environ.setdefault("OPENROUTER_API_KEY", "local")
+        try:
+            for width in WIDTHS:
+                single = _diagnose(width, group_size=width)
+                bracket = _diagnose(width, group_size=GROUP_SIZE)
+                print(
+                    f"bracket.width_{width}: single judge {single['ms']:,.0f} ms "
+                    f"(final judge {single['judgeTokens']:,.0f} tokens, {single['judgeMs']:,.0f} ms) | "
+                    f"{bracket['strategy']} {bracket['ms']:,.0f} ms "
+                    f"(final judge {bracket['judgeTokens']:,.0f} tokens, {bracket['judgeMs']:,.0f} ms)"
+                )
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
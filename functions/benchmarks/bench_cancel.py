@@ -0,0 +1,125 @@
+import inspect
+import json
+import os
+import threading
+import time
+
+from firebase_functions import https_fn
+
+import main
+from benchmarks import timed
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from metrics import METRICS
+from providers import Endpoint, Router
+
+# Time from cancel to resource release for a fanout_diagnosis whose fan-out models are
+# mid-stream on the local inference stand-in: until the callable returns (its instance
+# slot is free) and until the stand-in has no streams left open (upstream compute
+# stops). "local" cancels through cancel_generation on the same instance; "remote" only
+# stamps the chat, as a cancel landing on another instance would, and relies on polling
+# every CANCEL_POLL_SECONDS. "uncancelled" is what the user paid before.
+FANOUT_WIDTH = 3
+REPLY_WORDS = 2000
+GAP_MS = 2
+CANCEL_AFTER_MS = 500
+# Over budget when release takes longer than this past the poll interval (none for "local").
+RELEASE_SLACK_MS = 250
+UID = "bench-user"
+
+
+def _reply(payload) -> str:
+    schema = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name")
+    if schema == "diagnosis_sufficiency":
+        return json.dumps({"is_sufficient": True, "confidence": 0.97, "followup_questions": []})
+    return " ".join(["misfire"] * REPLY_WORDS)
+
+
+def _seed(db):
+    db.document("cars/car1").set({"userId": UID, "year": 2014, "make": "Honda", "model": "Civic"})
+    db.document("chats/chat1").set(
+        {"userId": UID, "carId": "car1", "status": "open", "awaitingResponse": True, "latestMessageId": "m2"}
+    )
+    messages = db.collection("chats").document("chat1").collection("messages")
+    messages.document("m1").set(
+        {
+            "role": "user",
+            "promptType": "intake",
+            "content": "Rough idle when warm, flashing check engine light, P0302 after a car wash.",
+            "metadata": {"intakeStage": "initial"},
+            "createdAt": 1,
+        }
+    )
+    messages.document("m2").set(
+        {
+            "role": "user",
+            "promptType": "intake",
+            "content": json.dumps({"answers": ["A week ago", "Worse under load"]}),
+            "metadata": {"intakeStage": "followup_answer"},
+            "createdAt": 2,
+        }
+    )
+
+
+def _request(data):
+    return https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid=UID, token={}))
+
+
+def _diagnose(server, mode: str):
+    db = LocalFirestore()
+    _seed(db)
+    main._get_db = lambda: db
+    METRICS.reset()
+    server.requests.clear()
+    result = {}
+    worker = threading.Thread(
+        target=lambda: result.update(
+            inspect.unwrap(main.fanout_diagnosis)(_request({"chatId": "chat1", "messageId": "m2"}))
+        )
+    )
+    with timed() as total:
+        worker.start()
+        if mode != "uncancelled":
+            # Sufficiency call plus every fan-out stream.
+            while len(server.requests) < 1 + FANOUT_WIDTH:
+                time.sleep(0.005)
+            time.sleep(CANCEL_AFTER_MS / 1000)
+            cancelled = time.perf_counter()
+            if mode == "local":
+                inspect.unwrap(main.cancel_generation)(_request({"chatId": "chat1"}))
+            else:
+                db.document("chats/chat1").update({"cancelledMessageId": "m2", "cancelRequestedAt": main._now_ms()})
+        worker.join()
+    if mode == "uncancelled":
+        print(f"cancel.uncancelled: fanout_diagnosis {total.elapsed * 1000:,.0f} ms ({result.get('status')})")
+        return 0
+    returned = time.perf_counter()
+    while server.active_streams:
+        time.sleep(0.001)
+    drained = time.perf_counter()
+    runs = [data["status"] for path, data in db.docs.items() if "/llm_runs/" in path]
+    print(
+        f"cancel.{mode}: callable released {(returned - cancelled) * 1000:,.0f} ms after cancel, "
+        f"upstream streams closed at {(drained - cancelled) * 1000:,.0f} ms "
+        f"({result.get('status')}, runs {','.join(sorted(runs))}, "
+        f"awaitingResponse={db.docs['chats/chat1'].get('awaitingResponse')})"
+    )
+    return (drained - cancelled) * 1000
+
+
+def run():
+    saved = {name: getattr(main, name) for name in ("_get_db", "_provider_router", "_cassette", "FANOUT_MODELS")}
+    with LocalInferenceServer(_reply, gap_ms=GAP_MS) as server:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        main._provider_router = lambda: router
+        main._cassette = lambda: None
+        main.FANOUT_MODELS = [f"bench/model-{index}" for index in range(FANOUT_WIDTH)]
+        os.environ.setdefault("OPENROUTER_API_KEY", "local")
+        try:
+            _diagnose(server, "uncancelled")
+            local_ms = _diagnose(server, "local")
+            remote_ms = _diagnose(server, "remote")
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
+    return local_ms <= RELEASE_SLACK_MS and remote_ms <= main.CANCEL_POLL_SECONDS * 1000 + RELEASE_SLACK_MS
@@ -0,0 +1,84 @@
+import json
+import random
+import time
+
+import main
+from benchmarks import report, timed
+from case_history import MAX_CASES, apply_case, case_record, search
+from local_firestore import LocalFirestore
+
+# Prior-case retrieval on a full per-car index (MAX_CASES cases). "update" is the
+# incremental add done for every aggregation, against rebuilding the index from all
+# cases; "search" is BM25 scoring alone; "lookup" is _prior_cases end to end (doc read on
+# the local Firestore stand-in, scoring, and the executor hop that enforces the budget).
+# Over budget when the lookup p99 exceeds this share of CASE_RETRIEVAL_BUDGET_MS, which
+# leaves the rest for the Firestore round trip.
+SCORING_SHARE = 0.1
+QUERIES = 2000
+_PARTS = ["ignition coil", "spark plug", "water pump", "thermostat", "brake pads", "wheel bearing",
+          "alternator", "starter motor", "oxygen sensor", "catalytic converter", "fuel pump", "serpentine belt"]
+_SYMPTOMS = ["misfire", "rough idle", "overheating", "brake noise", "vibration", "no start", "check engine light"]
+
+
+def _aggregation(rng, number):
+    part = rng.choice(_PARTS)
+    verdict = {
+        "diagnostic_answer": f"Failed {part}",
+        "justifacation": [f"Symptoms match a worn {part}", f"Code P0{rng.randint(100, 999)}"],
+        "explanation": f"Replace the {part} and clear codes; recheck after a test drive of {number} miles.",
+    }
+    diagnostic = {
+        "symptoms": rng.sample(_SYMPTOMS, 2),
+        "dtcCodes": [f"P0{rng.randint(100, 999)}"],
+        "intakeAnswers": {"initial": f"Car shows {rng.choice(_SYMPTOMS)} since last week, worse when cold."},
+    }
+    return {"combinedOutput": json.dumps(verdict), "createdAt": number}, diagnostic
+
+
+def _percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def run():
+    rng = random.Random(3)
+    cases = [case_record(f"chat{n}", f"d{n}", *_aggregation(rng, n)) for n in range(MAX_CASES * 2)]
+
+    index = None
+    with timed() as incremental:
+        for case in cases:
+            index = apply_case(index, case)
+    report("case_history.update", len(cases), incremental.elapsed, "cases")
+    with timed() as rebuild:
+        for count in range(1, len(cases) + 1):
+            rebuilt = None
+            for case in cases[max(0, count - MAX_CASES):count]:
+                rebuilt = apply_case(rebuilt, case)
+    report("case_history.rebuild", len(cases), rebuild.elapsed, "cases")
+    assert rebuilt == index
+    print(f"case_history.index: {len(json.dumps(index)):,} bytes for {len(index['cases'])} cases")
+
+    queries = [f"{rng.choice(_SYMPTOMS)} again, maybe the {rng.choice(_PARTS)}" for _ in range(QUERIES)]
+    scoring = []
+    for query in queries:
+        started = time.perf_counter()
+        search(index, query, main.CASE_RETRIEVAL_TOP_K, replacements=_PARTS[:4])
+        scoring.append((time.perf_counter() - started) * 1000)
+
+    db = LocalFirestore({"case_index/car1": index})
+    saved = main._get_db
+    main._get_db = lambda: db
+    lookups = []
+    try:
+        for query in queries:
+            started = time.perf_counter()
+            main._prior_cases("car1", {"Replacements": _PARTS[:4]}, query, "chat-new")
+            lookups.append((time.perf_counter() - started) * 1000)
+    finally:
+        main._get_db = saved
+    for name, values in (("search", scoring), ("lookup", lookups)):
+        print(
+            f"case_history.{name}: p50 {_percentile(values, 0.5):.3f} ms, "
+            f"p99 {_percentile(values, 0.99):.3f} ms over {len(values)} queries"
+        )
+    return _percentile(lookups, 0.99) <= main.CASE_RETRIEVAL_BUDGET_MS * SCORING_SHARE
@@ -0,0 +1,65 @@
+import csv
+import os
+import random
+import tempfile
+
+from benchmarks import report
+from catalog_import import CatalogImport, read_rows
+from local_firestore import LocalFirestore
+
+# Catalog import rate on the local Firestore stand-in, each commit COMMIT_RTT_MS away.
+# The dump is a CSV of YEARS x MAKES x MODELS x SUBMODELS x ENGINES rows (about 49k
+# nodes). "single" writes one node per commit, the way a naive loader would, on a slice of
+# the dump; "initial" imports the full dump into an empty catalog; "unchanged" re-imports
+# it (diff only, no writes); "delta" re-imports it with CHANGED_SHARE of engines edited.
+YEARS = 30
+MAKES = 20
+MODELS = 8
+SUBMODELS = 3
+ENGINES = 2
+SINGLE_ROWS = 150
+CHANGED_SHARE = 0.01
+COMMIT_RTT_MS = 20
+# Over budget when the initial import runs below this.
+MIN_NODES_PER_SECOND = 5000
+
+
+def _write_dump(path, rng, changed_share=0.0):
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["year", "make", "model", "trim", "engine", "cylinders", "fuelType"])
+        for year in range(1995, 1995 + YEARS):
+            for make in range(MAKES):
+                for model in range(MODELS):
+                    for submodel in ("Base", "Sport", "Limited")[:SUBMODELS]:
+                        for engine in range(ENGINES):
+                            fuel = "diesel" if rng.random() < changed_share else "gasoline"
+                            writer.writerow(
+                                [year, f"Make {make}", f"Model {make}-{model}", submodel,
+                                 f"{1.5 + engine:.1f}L I{4 + engine * 2}", 4 + engine * 2, fuel]
+                            )
+
+
+def run():
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as directory:
+        dump = os.path.join(directory, "catalog.csv")
+        delta = os.path.join(directory, "catalog_delta.csv")
+        _write_dump(dump, rng)
+        _write_dump(delta, rng, CHANGED_SHARE)
+
+        single_db = LocalFirestore(latency_ms=COMMIT_RTT_MS)
+        rows = (row for index, row in enumerate(read_rows(dump)) if index < SINGLE_ROWS)
+        stats = CatalogImport(single_db, now_ms=lambda: 1, batch_size=1, concurrency=1).run(rows)
+        report("catalog_import.single", stats["nodes"], stats["elapsedSeconds"], "nodes")
+
+        db = LocalFirestore(latency_ms=COMMIT_RTT_MS)
+        rates = {}
+        for name, path in (("initial", dump), ("unchanged", dump), ("delta", delta)):
+            stats = CatalogImport(db, now_ms=lambda: 2).run(read_rows(path))
+            rates[name] = report(f"catalog_import.{name}", stats["nodes"], stats["elapsedSeconds"], "nodes")
+            print(
+                f"catalog_import.{name}: {stats['created']:,} created, {stats['updated']:,} updated, "
+                f"{stats['batches']} batches"
+            )
+    return rates["initial"] >= MIN_NODES_PER_SECOND
@@ -0,0 +1,86 @@
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNS = 5
+COLD_START_BUDGET_S = 1.5
+FIRST_REQUEST_BUDGET_S = 0.05
+PROFILE_TOP = 10
+
+# Runs in a fresh interpreter: import main, then serve the first request on the
+# hot path that needs no network (health check plus prompt/format assembly).
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from flask import Flask, request
+app = Flask("probe")
+with app.test_request_context("/"):
+    main.hello(request)
+json.dumps({
+    "messages": [
+        {"role": "system", "content": main.QUESTION_SYSTEM_PROMPT},
+        {"role": "user", "content": main._car_context_lines({"year": 2019})},
+    ],
+    "response_format": main.INTAKE_QUESTIONS_FORMAT,
+})
+json.dumps(main.SUFFICIENCY_FORMAT)
+json.dumps(main.JUDGEMENT_FORMAT)
+done = time.perf_counter()
+print(imported - start, done - imported)
+"""
+
+
+def _probe():
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=FUNCTIONS_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(output[0]), float(output[1])
+
+
+def import_profile(module: str = "main"):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=FUNCTIONS_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Only direct imports of the probed module (one nesting level) are actionable.
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth != 1:
+            continue
+        rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)
+
+
+def run():
+    print("cold_start.import_profile (direct imports, cumulative):")
+    for seconds, name in import_profile()[:PROFILE_TOP]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    samples = [_probe() for _ in range(RUNS)]
+    cold_start = statistics.median(sample[0] for sample in samples)
+    first_request = statistics.median(sample[1] for sample in samples)
+    print(f"cold_start.import: {cold_start * 1000:.1f} ms (budget {COLD_START_BUDGET_S * 1000:.0f} ms)")
+    print(
+        f"cold_start.first_request: {first_request * 1000:.1f} ms "
+        f"(budget {FIRST_REQUEST_BUDGET_S * 1000:.0f} ms)"
+    )
+    within_budget = cold_start <= COLD_START_BUDGET_S and first_request <= FIRST_REQUEST_BUDGET_S
+    if not within_budget:
+        print("cold_start: OVER BUDGET")
+    return within_budget
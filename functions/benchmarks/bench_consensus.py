@@ -0,0 +1,36 @@
+import json
+import os
+
+from benchmarks import report, timed
+from consensus import build_judgement, diagnosis_tokens, find_consensus, similarity
+
+# One JSON object per line: {"candidates": [{"model", "output"}], "judge": {"diagnostic_answer"}}.
+# Point CONSENSUS_REPLAY_PATH at an export of llm_runs/aggregations to replay real traffic.
+DEFAULT_REPLAY_PATH = os.path.join(os.path.dirname(__file__), "data", "consensus_replay.jsonl")
+
+
+def load_cases(path: str):
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def run():
+    path = os.environ.get("CONSENSUS_REPLAY_PATH", DEFAULT_REPLAY_PATH)
+    cases = load_cases(path)
+    skipped = 0
+    agreed = 0
+    with timed() as timer:
+        for case in cases:
+            consensus = find_consensus(case["candidates"])
+            if not consensus:
+                continue
+            skipped += 1
+            local = build_judgement(consensus)["diagnostic_answer"]
+            judge = (case.get("judge") or {}).get("diagnostic_answer", "")
+            if similarity(diagnosis_tokens(local), diagnosis_tokens(judge)) >= 0.5:
+                agreed += 1
+    report("consensus.replay", len(cases), timer.elapsed, "cases")
+    skip_rate = skipped / len(cases) if cases else 0.0
+    agreement = agreed / skipped if skipped else 0.0
+    print(f"consensus.skip_rate: {skip_rate:.1%} ({skipped}/{len(cases)} judge calls skipped)")
+    print(f"consensus.agreement_with_judge: {agreement:.1%} ({agreed}/{skipped})")
@@ -0,0 +1,112 @@
+import inspect
+import json
+import os
+
+from firebase_functions import https_fn
+
+import main
+from benchmarks import timed
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from providers import Endpoint, Router
+
+# Fleet throughput in diagnoses/minute: one full-size batch_diagnose (ITEMS items) across
+# VEHICLES vehicles, on the local inference stand-in with prefill cost and a prefix cache.
+# "sequential" is BATCH_CONCURRENCY=1, the interactive flow run item by item; "batched" is
+# the configured concurrency. The cached share of prompt tokens shows how much prefill the
+# vehicle-grouped ordering saves.
+ITEMS = main.BATCH_MAX_ITEMS
+VEHICLES = 4
+FANOUT_WIDTH = 3
+TTFT_MS = 40
+PREFILL_TPS = 2000
+PREFIX_CACHE_BLOCKS = 4096
+# Over budget when batching gains less than this over the sequential run.
+MIN_SPEEDUP = 2.0
+UID = "bench-user"
+_VEHICLES = [(2014, "Honda", "Civic"), (2018, "Ford", "F-150"), (2016, "Toyota", "Camry"), (2012, "BMW", "328i")]
+
+
+def _reply(payload) -> str:
+    schema = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name")
+    if schema == "diagnosis_sufficiency":
+        return json.dumps({"is_sufficient": True, "confidence": 0.97, "followup_questions": []})
+    if schema == "diagnosis_judgement":
+        return json.dumps(
+            {
+                "model_name": "bench/model-0",
+                "diagnostic_answer": "Failed ignition coil",
+                "justifacation": ["P0302"],
+                "explanation": "Swap coils.",
+            }
+        )
+    return json.dumps(
+        {
+            "primary_diagnosis": "Failed ignition coil",
+            "root_causes": ["coil"],
+            "next_checks": ["swap coils"],
+            "confidence": 0.7,
+            "explanation": "Misfire on one cylinder.",
+        }
+    )
+
+
+def _seed(db):
+    for index in range(VEHICLES):
+        year, make, model = _VEHICLES[index % len(_VEHICLES)]
+        db.document(f"cars/car{index}").set({"userId": UID, "year": year, "make": make, "model": model})
+    return [
+        {
+            "carId": f"car{index % VEHICLES}",
+            "report": f"Rough idle and flashing check engine light, P030{index % 6 + 1}, unit {index}.",
+            "answers": ["A week ago", "Worse under load"],
+        }
+        for index in range(ITEMS)
+    ]
+
+
+def _request(data):
+    return https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid=UID, token={}))
+
+
+def _batch(concurrency: int, mode: str) -> float:
+    db = LocalFirestore()
+    items = _seed(db)
+    main._get_db = lambda: db
+    main.BATCH_CONCURRENCY = concurrency
+    main._batch_executor.cache_clear()
+    with LocalInferenceServer(
+        _reply, ttft_ms=TTFT_MS, prefill_tps=PREFILL_TPS, prefix_cache_blocks=PREFIX_CACHE_BLOCKS
+    ) as server:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        main._provider_router = lambda: router
+        with timed() as timer:
+            result = inspect.unwrap(main.batch_diagnose)(_request({"items": items}))
+        cached_share = server.cached_tokens / server.prompt_tokens if server.prompt_tokens else 0.0
+    statuses = {item["status"] for item in result["results"]}
+    per_minute = ITEMS / timer.elapsed * 60
+    print(
+        f"fleet.{mode}: {ITEMS} items over {VEHICLES} vehicles, concurrency {concurrency}, "
+        f"{timer.elapsed:.2f}s ({per_minute:,.0f} diagnoses/min), "
+        f"{cached_share:.0%} of prompt tokens prefix-cached, statuses {','.join(sorted(statuses))}"
+    )
+    return per_minute
+
+
+def run():
+    saved = {
+        name: getattr(main, name)
+        for name in ("_get_db", "_provider_router", "_cassette", "FANOUT_MODELS", "BATCH_CONCURRENCY")
+    }
+    main._cassette = lambda: None
+    main.FANOUT_MODELS = [f"bench/model-{index}" for index in range(FANOUT_WIDTH)]
+    os.environ.setdefault("OPENROUTER_API_KEY", "local")
+    try:
+        sequential = _batch(1, "sequential")
+        batched = _batch(saved["BATCH_CONCURRENCY"], "batched")
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+        main._batch_executor.cache_clear()
+    print(f"fleet.speedup: {batched / sequential:.1f}x")
+    return batched >= sequential * MIN_SPEEDUP
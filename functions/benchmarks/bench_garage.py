@@ -0,0 +1,140 @@
+import inspect
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from firebase_functions import https_fn
+
+import main
+from benchmarks import report
+from local_firestore import LocalFirestore
+
+# Time to first paint of the garage for a user with CARS cars and DIAGNOSTICS_PER_CAR
+# diagnostics each, on the local Firestore stand-in with simulated network costs.
+# "listeners" is what src/App.vue does: the cars query, then a diagnostics query per car,
+# then the chat of each shown diagnostic, each wave a client round trip away and fetching
+# full documents. "callable" is list_garage: one client round trip to the function, whose
+# own waves are server round trips away, returning projected fields. "cached" is a repeat
+# open with "fresh": false, served from the per-user cache. Transfer time is bytes over CLIENT_BYTES_PER_SEC.
+CARS = 20
+DIAGNOSTICS_PER_CAR = 8
+SHOWN_PER_CAR = 3
+RUNS = 5
+CLIENT_RTT_MS = 60
+SERVER_RTT_MS = 8
+CLIENT_BYTES_PER_SEC = 1_500_000
+
+
+def _docs():
+    rng = random.Random(4)
+
+    def filler(size):
+        return "".join(rng.choice("abcdefghij ") for _ in range(size))
+
+    docs = {}
+    for car in range(CARS):
+        docs[f"cars/car{car:02d}"] = {
+            "userId": "u1",
+            "name": f"Car {car}",
+            "year": 2005 + car % 18,
+            "make": "Honda",
+            "model": "Civic",
+            "mileage": 90000 + car,
+            "createdAt": 1_700_000_000_000 + car,
+            "Replacements": [{"part": filler(40), "notes": filler(400)} for _ in range(6)],
+        }
+        for number in range(DIAGNOSTICS_PER_CAR):
+            diagnostic_id = f"d{car:02d}{number}"
+            docs[f"diagnostics/{diagnostic_id}"] = {
+                "userId": "u1",
+                "carId": f"car{car:02d}",
+                "title": filler(30),
+                "summary": filler(1200),
+                "status": "open",
+                "intakeAnswers": {f"q{question}": filler(300) for question in range(8)},
+                "createdAt": number,
+            }
+            docs[f"chats/chat{car:02d}{number}"] = {
+                "userId": "u1",
+                "carId": f"car{car:02d}",
+                "diagnosticId": diagnostic_id,
+                "status": "open",
+                "phase": "normal",
+                "summary": filler(2000),
+                "updatedAt": number,
+            }
+    return docs
+
+
+def _bytes(snapshots):
+    return sum(len(json.dumps(snapshot.to_dict(), default=str)) for snapshot in snapshots)
+
+
+def _eq(field, value):
+    return firestore.FieldFilter(field, "==", value)
+
+
+def _listeners(db, pool):
+    cars = list(db.collection("cars").where(filter=_eq("userId", "u1")).stream())
+    size = _bytes(cars)
+
+    def diagnostics(car):
+        query = db.collection("diagnostics").where(filter=_eq("carId", car.id)).where(filter=_eq("userId", "u1"))
+        return list(query.stream())
+
+    shown = []
+    for snapshots in pool.map(diagnostics, cars):
+        size += _bytes(snapshots)
+        shown += sorted(snapshots, key=lambda snapshot: -snapshot.get("createdAt"))[:SHOWN_PER_CAR]
+
+    def chat(diagnostic):
+        query = db.collection("chats").where(filter=_eq("diagnosticId", diagnostic.id)).where(filter=_eq("userId", "u1"))
+        return list(query.stream())
+
+    for snapshots in pool.map(chat, shown):
+        size += _bytes(snapshots)
+    return size
+
+
+def _callable(list_garage, data):
+    time.sleep(CLIENT_RTT_MS / 1000)
+    request = https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid="u1", token={}))
+    return len(json.dumps(list_garage(request), default=str))
+
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def run():
+    docs = _docs()
+    client_db = LocalFirestore(docs, latency_ms=CLIENT_RTT_MS)
+    server_db = LocalFirestore(docs, latency_ms=SERVER_RTT_MS)
+    list_garage = inspect.unwrap(main.list_garage)
+    data = {"limit": CARS, "diagnosticsPerCar": SHOWN_PER_CAR}
+    saved = main._get_db
+    main._get_db = lambda: server_db
+    main._garage_cache.clear()
+    timings = {"listeners": [], "callable": [], "cached": []}
+    sizes = {}
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            for _ in range(RUNS):
+                for mode, load in (
+                    ("listeners", lambda: _listeners(client_db, pool)),
+                    ("callable", lambda: _callable(list_garage, data)),
+                    ("cached", lambda: _callable(list_garage, {**data, "fresh": False})),
+                ):
+                    started = time.perf_counter()
+                    sizes[mode] = load()
+                    transfer = sizes[mode] / CLIENT_BYTES_PER_SEC
+                    timings[mode].append(time.perf_counter() - started + transfer)
+    finally:
+        main._get_db = saved
+        main._garage_cache.clear()
+    for mode, values in timings.items():
+        print(f"garage.ttfp.{mode}: {_median(values) * 1000:.0f} ms median, {sizes[mode]:,} bytes")
+    report("garage.callable", RUNS, sum(timings["callable"]), "pages")
+    return _median(timings["callable"]) < _median(timings["listeners"])
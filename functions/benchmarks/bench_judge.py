@@ -0,0 +1,91 @@
+import json
+import os
+import random
+
+from benchmarks import timed
+from benchmarks.bench_consensus import DEFAULT_REPLAY_PATH, load_cases
+from consensus import candidate_record
+from judge_input import CANDIDATE_TOKEN_CAP, build_judge_prompt, estimate_tokens
+from main import JUDGE_SYSTEM_PROMPT
+
+# Judge prompt size before (verbatim prose per candidate) and after (compact records
+# capped at JUDGE_CANDIDATE_TOKEN_CAP) for the replay cases and for synthetic answers as
+# verbose as the fan-out models tend to be, at several fan-out widths. Latency is an
+# estimate: fixed overhead plus prefill at JUDGE_PREFILL_TPS tokens/s; the live numbers
+# are the judge.prompt_tokens / judge.latency_ms metrics.
+PREFILL_TPS = float(os.environ.get("JUDGE_PREFILL_TPS", "2500"))
+BASE_LATENCY_MS = float(os.environ.get("JUDGE_BASE_LATENCY_MS", "900"))
+WIDTHS = (3, 6, 12)
+INTAKE_TEXT = (
+    "Vehicle context:\n2014 Honda Civic, 1.8L I4, 98,000 miles\nInitial report:\n"
+    "Rough idle when warm, flashing check engine light, P0302 after a car wash.\n\n"
+    "Follow-up questions:\nWhen did it start?\nWorse under load?\n\n"
+    "User answers:\nA week ago\nYes, mostly uphill"
+)
+PARTS = ["ignition coil", "spark plug", "fuel injector", "intake gasket", "valve seal", "wiring harness"]
+
+
+def _sentence(rng, words: int) -> str:
+    vocabulary = "the misfire cylinder load moisture boot resistance voltage test swap confirm idle".split()
+    return " ".join(rng.choice(vocabulary) for _ in range(words)).capitalize() + "."
+
+
+def _verbose_answer(rng):
+    causes = rng.sample(PARTS, 5)
+    structured = {
+        "primary_diagnosis": f"Failed cylinder 2 {causes[0]}",
+        "root_causes": [f"{cause}: {_sentence(rng, 18)}" for cause in causes],
+        "next_checks": [_sentence(rng, 22) for _ in range(3)],
+        "confidence": round(rng.uniform(0.5, 0.9), 2),
+        "explanation": " ".join(_sentence(rng, 16) for _ in range(4)),
+    }
+    prose = "\n\n".join(
+        [
+            f"Primary diagnosis: {structured['primary_diagnosis']}",
+            " ".join(_sentence(rng, 20) for _ in range(8)),
+            "Likely root causes:\n" + "\n".join(f"- {cause}" for cause in structured["root_causes"]),
+            "Next checks:\n" + "\n".join(f"{i}. {check}" for i, check in enumerate(structured["next_checks"], 1)),
+            structured["explanation"],
+        ]
+    )
+    return prose, json.dumps(structured)
+
+
+def _before(candidates) -> str:
+    sections = [f"Model: {c['model']}\nResponse:\n{c['output'] or 'No response.'}" for c in candidates]
+    return f"{INTAKE_TEXT}\n\nCandidate diagnoses:\n\n" + "\n\n".join(sections)
+
+
+def _after(candidates) -> str:
+    records = [{"model": c["model"], "record": candidate_record(c["output"])} for c in candidates]
+    return build_judge_prompt(INTAKE_TEXT, records, CANDIDATE_TOKEN_CAP)
+
+
+def _report(label: str, before_prompts, after_prompts):
+    system = estimate_tokens(JUDGE_SYSTEM_PROMPT)
+    before = sum(estimate_tokens(prompt) + system for prompt in before_prompts) / len(before_prompts)
+    after = sum(estimate_tokens(prompt) + system for prompt in after_prompts) / len(after_prompts)
+    before_ms = BASE_LATENCY_MS + before / PREFILL_TPS * 1000
+    after_ms = BASE_LATENCY_MS + after / PREFILL_TPS * 1000
+    print(
+        f"judge.{label}: prompt {before:,.0f} -> {after:,.0f} tokens ({after / before - 1:+.0%}), "
+        f"est. latency {before_ms:,.0f} -> {after_ms:,.0f} ms"
+    )
+
+
+def run():
+    cases = load_cases(os.environ.get("CONSENSUS_REPLAY_PATH", DEFAULT_REPLAY_PATH))
+    _report(
+        "replay",
+        [_before(case["candidates"]) for case in cases],
+        [_after(case["candidates"]) for case in cases],
+    )
+    rng = random.Random(7)
+    for width in WIDTHS:
+        answers = [_verbose_answer(rng) for _ in range(width)]
+        prose = [{"model": f"model-{i}", "output": text} for i, (text, _) in enumerate(answers)]
+        structured = [{"model": f"model-{i}", "output": data} for i, (_, data) in enumerate(answers)]
+        with timed() as timer:
+            after = _after(structured)
+        _report(f"verbose_x{width}", [_before(prose)], [after])
+        print(f"judge.verbose_x{width}.build: {timer.elapsed * 1000:.2f} ms")
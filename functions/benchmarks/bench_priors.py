@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import main
+from benchmarks import report, timed
+from local_firestore import LocalFirestore
+from priors import TITLE_SYNONYMS, apply_prior, normalize_title, prior_doc_ids, top_priors, vehicle_group
+
+# Failure priors at fleet scale: PRIORS_CASES (default 2,000,000) diagnoses spread over
+# GROUPS vehicle groups with a skewed (Zipf-like) popularity, each a synonym phrasing of a
+# common failure or a long-tail title. "update" is the per-aggregation counter change for
+# both group levels; "normalize" is title normalization; the summary of the hottest group
+# is checked against exact counts. "lookup" is _failure_priors on the local Firestore
+# stand-in, cold (doc read) and warm (process cache).
+CASES = int(os.environ.get("PRIORS_CASES", "2000000"))
+GROUPS = 2000
+LONG_TAIL = 20000
+LONG_TAIL_SHARE = 0.3
+LOOKUPS = 5000
+# Over budget when a cold lookup's p99 exceeds this.
+COLD_LOOKUP_BUDGET_MS = 5.0
+_MAKES = [("Honda", "Civic"), ("Ford", "F-150"), ("Toyota", "Camry"), ("Chevrolet", "Silverado"), ("BMW", "328i")]
+_ENGINES = ["1.8L I4", "2.0L I4", "3.5L V6", "5.0L V8"]
+
+
+def _cars():
+    rng = random.Random(1)
+    cars = []
+    for number in range(GROUPS):
+        make, model = _MAKES[number % len(_MAKES)]
+        cars.append(
+            {"year": 1995 + rng.randrange(30), "make": make, "model": f"{model} {number // 50}",
+             "engine": rng.choice(_ENGINES)}
+        )
+    return cars
+
+
+def _titles(rng, count):
+    # Common failures are Zipf over the canonical titles, phrased as any of their synonyms;
+    # LONG_TAIL_SHARE of cases are one-off titles.
+    raw, weights = [], []
+    for rank, phrases in enumerate(TITLE_SYNONYMS.values()):
+        for phrase in phrases:
+            raw.append(f"Failed {phrase}")
+            weights.append(1 / (rank + 1) / len(phrases))
+    common = sum(weights)
+    weights = [weight / common * (1 - LONG_TAIL_SHARE) for weight in weights]
+    raw += [f"Worn custom part {number}" for number in range(LONG_TAIL)]
+    weights += [LONG_TAIL_SHARE / LONG_TAIL] * LONG_TAIL
+    return rng.choices(raw, weights=weights, k=count)
+
+
+def _percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def run():
+    rng = random.Random(9)
+    cars = _cars()
+    groups = [(vehicle_group(car), prior_doc_ids(vehicle_group(car))) for car in cars]
+    popularity = [1 / (rank + 1) for rank in range(GROUPS)]
+
+    sample = _titles(rng, 100_000)
+    with timed() as normalizing:
+        normalized_sample = [normalize_title(title) for title in sample]
+    report("priors.normalize", len(sample), normalizing.elapsed, "titles")
+    # Titles repeat heavily, so the stream reuses normalized ones instead of re-normalizing 2M.
+    picks = rng.choices(range(GROUPS), weights=popularity, k=CASES)
+    titles = [normalized_sample[rng.randrange(len(normalized_sample))] for _ in range(CASES)]
+
+    docs = {}
+    exact = Counter()
+    with timed() as updating:
+        for group_index, title in zip(picks, titles):
+            group, doc_ids = groups[group_index]
+            for doc_id in doc_ids:
+                docs[doc_id] = apply_prior(docs.get(doc_id), "", title, group, doc_id.rsplit("|", 1)[1])
+    report("priors.update", CASES, updating.elapsed, "cases")
+    largest = max(len(json.dumps(doc)) for doc in docs.values())
+    print(f"priors.docs: {len(docs):,} docs, largest {largest:,} bytes")
+
+    hot_id = max(docs, key=lambda doc_id: docs[doc_id]["total"])
+    hot = docs[hot_id]
+    for group_index, title in zip(picks, titles):
+        if hot_id in groups[group_index][1]:
+            exact[title] += 1
+    summary = [prior["title"] for prior in top_priors([hot], 5)["priors"]]
+    truth = [title for title, _ in sorted(exact.items(), key=lambda item: (-item[1], item[0]))[:5]]
+    print(f"priors.accuracy: hottest group {hot['total']:,} cases, top-5 overlap {len(set(summary) & set(truth))}/5")
+
+    db = LocalFirestore({f"failure_priors/{doc_id}": doc for doc_id, doc in docs.items()})
+    saved = main._get_db
+    main._get_db = lambda: db
+    timings = {"cold": [], "warm": []}
+    try:
+        for _ in range(LOOKUPS):
+            car = cars[rng.choices(range(GROUPS), weights=popularity)[0]]
+            main._priors_cache.clear()
+            for mode in ("cold", "warm"):
+                started = time.perf_counter()
+                main._failure_priors(car)
+                timings[mode].append((time.perf_counter() - started) * 1000)
+    finally:
+        main._get_db = saved
+        main._priors_cache.clear()
+    for mode, values in timings.items():
+        print(
+            f"priors.lookup.{mode}: p50 {_percentile(values, 0.5):.3f} ms, "
+            f"p99 {_percentile(values, 0.99):.3f} ms over {len(values)} lookups"
+        )
+    return _percentile(timings["cold"], 0.99) <= COLD_LOOKUP_BUDGET_MS
@@ -0,0 +1,90 @@
+import inspect
+import os
+import tempfile
+
+from firebase_functions import https_fn
+
+import main
+from benchmarks import timed
+from benchmarks.bench_bracket import UID, _reply, _seed
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from profiling import ProfileStore, carry
+from providers import Endpoint, Router
+
+# Cost of the profiling hook. Disabled, it must add nothing measurable per call: the
+# wrapper is timed against the bare handler over many calls. Enabled, a fanout_diagnosis
+# runs on the local inference stand-in with and without a profile, and the artifact is
+# summarised by thread.
+CALLS = 200_000
+FANOUT_WIDTH = 6
+
+
+def _request(data, admin=False):
+    return https_fn.CallableRequest(
+        data=data, raw_request=None, auth=https_fn.AuthData(uid=UID, token={"admin": admin})
+    )
+
+
+def _disabled_overhead():
+    def handler(request):
+        return carry(handler)
+
+    wrapped = main._profiled(handler)
+    request = _request({"chatId": "chat1"})
+    with timed() as bare:
+        for _ in range(CALLS):
+            handler(request)
+    with timed() as hooked:
+        for _ in range(CALLS):
+            wrapped(request)
+    per_call_ns = (hooked.elapsed - bare.elapsed) / CALLS * 1e9
+    print(
+        f"profile.disabled: {bare.elapsed / CALLS * 1e9:,.0f} ns bare, "
+        f"{hooked.elapsed / CALLS * 1e9:,.0f} ns through the hook ({per_call_ns:+,.0f} ns/call)"
+    )
+
+
+def _diagnose(profile: bool) -> float:
+    db = LocalFirestore()
+    _seed(db)
+    main._get_db = lambda: db
+    with timed() as timer:
+        inspect.unwrap(main.fanout_diagnosis)(
+            _request({"chatId": "chat1", "messageId": "m2", "profile": profile}, admin=True)
+        )
+    return timer.elapsed * 1000
+
+
+def run():
+    _disabled_overhead()
+    saved = {
+        name: getattr(main, name)
+        for name in ("_get_db", "_provider_router", "_cassette", "_profile_store", "FANOUT_MODELS")
+    }
+    with LocalInferenceServer(_reply, ttft_ms=150, gap_ms=2) as server, tempfile.TemporaryDirectory() as root:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        main._provider_router = lambda: router
+        main._cassette = lambda: None
+        main._profile_store = lambda: ProfileStore(root)
+        main.FANOUT_MODELS = [f"bench/model-{index}" for index in range(FANOUT_WIDTH)]
+        os.environ.setdefault("OPENROUTER_API_KEY", "local")
+        try:
+            plain_ms = _diagnose(profile=False)
+            profiled_ms = _diagnose(profile=True)
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
+        (path,) = [os.path.join(d, f) for d, _, files in os.walk(root) for f in files if f.endswith(".collapsed")]
+        threads = {}
+        with open(path, encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            thread = stack.split(";")[1]
+            threads[thread] = threads.get(thread, 0) + int(count)
+        print(
+            f"profile.enabled: fanout_diagnosis {plain_ms:,.0f} ms plain, {profiled_ms:,.0f} ms profiled; "
+            f"{len(lines)} collapsed stacks ({os.path.getsize(path):,} bytes), samples by thread "
+            + ", ".join(f"{name}={count}" for name, count in sorted(threads.items()))
+        )
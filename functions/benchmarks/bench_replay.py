@@ -0,0 +1,130 @@
+import inspect
+import json
+import os
+import time
+
+from firebase_functions import https_fn
+
+import main
+from benchmarks import timed
+from cassettes import Cassette
+from local_firestore import LocalFirestore
+
+# Replays a recorded session (data/replay_scenario.json + data/replay_cassette.jsonl) through
+# the real callables against LocalFirestore, reporting latency and Firestore ops per call.
+# Record a new cassette against OpenRouter with REPLAY_RECORD=1 and OPENROUTER_API_KEY set.
+# REPLAY_RESULTS=path writes the run as JSON; REPLAY_BASELINE=path compares against one.
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DEFAULT_SCENARIO = os.path.join(DATA_DIR, "replay_scenario.json")
+DEFAULT_CASSETTE = os.path.join(DATA_DIR, "replay_cassette.jsonl")
+MAX_REGRESSION = float(os.environ.get("REPLAY_MAX_REGRESSION", "0.2"))
+
+
+class _WatchedFirestore(LocalFirestore):
+    # Notes when assistant content first lands, i.e. what a listening client would see.
+    def __init__(self):
+        super().__init__()
+        self.first_content_at = None
+
+    def _write(self, method, reference, data, merge=False):
+        super()._write(method, reference, data, merge)
+        if self.first_content_at is not None or not data or not data.get("content"):
+            return
+        if (self.docs.get(reference.path) or {}).get("role") == "assistant":
+            self.first_content_at = time.perf_counter()
+
+
+def _request(uid: str, data) -> https_fn.CallableRequest:
+    return https_fn.CallableRequest(
+        data=data, raw_request=None, auth=https_fn.AuthData(uid=uid, token={})
+    )
+
+
+def run_scenario(scenario, db) -> list:
+    for path, data in scenario["docs"].items():
+        db.document(path).set(data)
+    chat_ref = db.collection("chats").document(scenario.get("chatId", "chat-replay"))
+    results = []
+    for step in scenario["steps"]:
+        if "message" in step:
+            message = dict(step["message"])
+            message_id = message.pop("id")
+            message["createdAt"] = int(time.time() * 1000)
+            chat_ref.collection("messages").document(message_id).set(message)
+            continue
+        before = dict(db.ops)
+        handler = inspect.unwrap(getattr(main, step["call"]))
+        db.first_content_at = None
+        started = time.perf_counter()
+        with timed() as timer:
+            handler(_request(scenario["uid"], {"chatId": chat_ref.id, "messageId": step["messageId"]}))
+        first_content = (db.first_content_at or time.perf_counter()) - started
+        results.append(
+            {
+                "call": step["call"],
+                "ms": round(timer.elapsed * 1000, 1),
+                "firstContentMs": round(first_content * 1000, 1),
+                **{op: db.ops[op] - before.get(op, 0) for op in ("reads", "writes", "deletes")},
+            }
+        )
+    return results
+
+
+def _compare(results, baseline) -> bool:
+    ok = True
+    previous = {item["call"]: item for item in baseline}
+    for item in results:
+        base = previous.get(item["call"])
+        if not base:
+            continue
+        base.setdefault("firstContentMs", 0)
+        for field in ("ms", "firstContentMs", "reads", "writes"):
+            if not base[field]:
+                continue
+            change = (item[field] - base[field]) / base[field]
+            flag = ""
+            if change > MAX_REGRESSION:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"  {item['call']}.{field}: {base[field]} -> {item[field]} ({change:+.0%}){flag}")
+    return ok
+
+
+def run():
+    with open(os.environ.get("REPLAY_SCENARIO", DEFAULT_SCENARIO), encoding="utf-8") as handle:
+        scenario = json.load(handle)
+    cassette_path = os.environ.get("REPLAY_CASSETTE", DEFAULT_CASSETTE)
+    recording = os.environ.get("REPLAY_RECORD") == "1"
+    if recording:
+        open(cassette_path, "w").close()
+    else:
+        os.environ.setdefault("OPENROUTER_API_KEY", "replay")
+    cassette = Cassette(
+        cassette_path,
+        "record" if recording else "replay",
+        float(os.environ.get("OPENROUTER_REPLAY_SPEED", "1.0")),
+    )
+    db = _WatchedFirestore()
+    original_db, original_cassette = main._get_db, main._cassette
+    main._get_db, main._cassette = (lambda: db), (lambda: cassette)
+    try:
+        results = run_scenario(scenario, db)
+    finally:
+        main._get_db, main._cassette = original_db, original_cassette
+
+    for item in results:
+        print(
+            f"replay.{item['call']}: {item['ms']:.1f} ms, "
+            f"first content at {item['firstContentMs']:.1f} ms, "
+            f"{item['reads']} reads, {item['writes']} writes, {item['deletes']} deletes"
+        )
+    print(f"replay.cassette: {cassette.stats}")
+    results_path = os.environ.get("REPLAY_RESULTS")
+    if results_path:
+        with open(results_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    baseline_path = os.environ.get("REPLAY_BASELINE")
+    if baseline_path and not recording:
+        with open(baseline_path, encoding="utf-8") as handle:
+            return _compare(results, json.load(handle))
+    return True
@@ -0,0 +1,61 @@
+import json
+import random
+
+from benchmarks import report, timed
+from transcripts import decode_chunk, encode_records
+
+MESSAGES = 600
+RUNS = 120
+# Reading one chunk replaces a per-document stream; the budget covers a full reload.
+RELOAD_BUDGET_SECONDS = 0.05
+
+_WORDS = (
+    "engine misfire coolant thermostat idle rough cylinder coil plug sensor oxygen "
+    "check light stall cold start noise brake pedal vibration highway leak smell"
+).split()
+
+
+def _chat(seed: int = 11):
+    rng = random.Random(seed)
+    records = []
+    for index in range(MESSAGES):
+        records.append(
+            {
+                "id": f"msg{index:05d}",
+                "role": "user" if index % 2 == 0 else "assistant",
+                "promptType": "normal",
+                "content": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 220))),
+                "createdAt": 1_700_000_000_000 + index * 1000,
+                "source": "user" if index % 2 == 0 else "llm",
+                "metadata": {"model": "openai/gpt-4.1-mini"},
+            }
+        )
+    for index in range(RUNS):
+        records.append(
+            {
+                "id": f"run{index:05d}",
+                "model": rng.choice(["openai/gpt-4.1", "anthropic/claude-sonnet-4", "google/gemini-2.5-pro"]),
+                "status": "completed",
+                "output": " ".join(rng.choice(_WORDS) for _ in range(600)),
+                "createdAt": 1_700_000_000_000 + index * 5000,
+            }
+        )
+    return records
+
+
+def run():
+    records = _chat()
+    raw_bytes = len(json.dumps(records, separators=(",", ":")).encode("utf-8"))
+    with timed() as encode:
+        blobs = encode_records(records)
+    stored = sum(len(blob) for _, blob in blobs)
+    report("transcripts.encode", len(records), encode.elapsed, "records")
+    print(
+        f"transcripts.compression: {raw_bytes:,} -> {stored:,} bytes "
+        f"({raw_bytes / stored:.1f}x) in {len(blobs)} chunk(s) vs {len(records)} docs"
+    )
+    with timed() as reload:
+        decoded = [record for _, blob in blobs for record in decode_chunk(blob)]
+    assert len(decoded) == len(records)
+    report("transcripts.reload", len(decoded), reload.elapsed, "records")
+    return reload.elapsed <= RELOAD_BUDGET_SECONDS
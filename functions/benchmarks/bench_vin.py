@@ -0,0 +1,34 @@
+import random
+
+from benchmarks import report, timed
+from vin_decoder import _YEAR_CODES, WMI_MANUFACTURERS, compute_check_digit, decode_vins
+
+FLEET_SIZE = 100_000
+_VIN_CHARS = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+
+
+def _fleet(size: int, seed: int = 7):
+    rng = random.Random(seed)
+    wmis = sorted(WMI_MANUFACTURERS)
+    vins = []
+    for _ in range(size):
+        body = (
+            rng.choice(wmis)
+            + "".join(rng.choice(_VIN_CHARS) for _ in range(5))
+            + "0"
+            + rng.choice(_YEAR_CODES)
+            + "".join(rng.choice(_VIN_CHARS) for _ in range(7))
+        )
+        vins.append(body[:8] + compute_check_digit(body) + body[9:])
+    return vins
+
+
+def run():
+    vins = _fleet(FLEET_SIZE)
+    with timed() as cold:
+        results = decode_vins(vins)
+    assert all(result["checkDigitValid"] for result in results)
+    report("vin.decode_batch.cold", len(vins), cold.elapsed, "vins")
+    with timed() as warm:
+        decode_vins(vins[-4096:])
+    report("vin.decode_batch.cached", 4096, warm.elapsed, "vins")
@@ -0,0 +1,44 @@
+import math
+
+# Tournament aggregation for wide fan-outs: while more than group_size candidates are
+# left, split them into balanced groups, judge the groups in parallel and advance each
+# group's winner. The final judge then only ever sees group_size candidates or fewer.
+
+
+def plan_groups(candidates, group_size: int):
+    count = math.ceil(len(candidates) / group_size)
+    base, extra = divmod(len(candidates), count)
+    groups = []
+    start = 0
+    for index in range(count):
+        size = base + (1 if index < extra else 0)
+        groups.append(candidates[start : start + size])
+        start += size
+    return groups
+
+
+def run_bracket(candidates, group_size: int, judge_group, executor):
+    # judge_group(group) -> (winner, details) runs on the executor; details is stored
+    # with the match. Returns the finalists and the rounds, shaped for Firestore (no
+    # directly nested arrays).
+    group_size = max(2, group_size)
+    rounds = []
+    while len(candidates) > group_size:
+        groups = plan_groups(candidates, group_size)
+        futures = [executor.submit(judge_group, group) if len(group) > 1 else None for group in groups]
+        matches = []
+        winners = []
+        for group, future in zip(groups, futures):
+            winner, details = future.result() if future is not None else (group[0], {"bye": True})
+            winners.append(winner)
+            matches.append(
+                {
+                    "runIds": [candidate["id"] for candidate in group],
+                    "winnerRunId": winner["id"],
+                    "winnerModel": winner["model"],
+                    **details,
+                }
+            )
+        rounds.append({"round": len(rounds) + 1, "matches": matches})
+        candidates = winners
+    return candidates, rounds
@@ -0,0 +1,126 @@
+import logging
+import socket
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Cooperative cancellation of in-flight LLM work. The cancel_generation callable stamps
+# the chat with the user message being answered (cancelledMessageId) and when
+# (cancelRequestedAt). Each running invocation holds a CancellationToken for its message
+# that notices the stamp (at once when the cancel lands on the same instance, otherwise
+# on its next poll of the chat doc), shuts down the upstream streams it tracks so
+# blocked reads return, and lets queued fan-out work skip its call. Polling costs one
+# masked read per interval per running invocation; a listener would hold a gRPC stream.
+
+_active = {}
+_active_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    pass
+
+
+def interrupt(response):
+    # close() alone only wakes a reader blocked in recv once the next byte arrives;
+    # shutting the socket down makes it return immediately.
+    sock = getattr(getattr(getattr(response, "raw", None), "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class CancellationToken:
+    def __init__(self, chat_ref, message_id: str, poll_interval: float):
+        self._chat_ref = chat_ref
+        self.message_id = message_id
+        self._poll_interval = poll_interval
+        self._event = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = set()
+        self._watcher = None
+        self.requested_ms = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled("Generation cancelled")
+
+    def cancel(self, requested_ms: int):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.requested_ms = requested_ms
+            self._event.set()
+            responses = list(self._responses)
+            self._responses.clear()
+        for response in responses:
+            interrupt(response)
+
+    def attach(self, response):
+        # Tracks an open upstream stream; closes it straight away if already cancelled.
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.add(response)
+                return
+        interrupt(response)
+        raise Cancelled("Generation cancelled")
+
+    def detach(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def watch(self):
+        self._watcher = threading.Thread(target=self._poll, name="cancel-watch", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _poll(self):
+        # Checks once straight away, so a cancel sent during a cold start is not missed.
+        while not self._event.is_set():
+            try:
+                snapshot = self._chat_ref.get(field_paths=["cancelledMessageId", "cancelRequestedAt"])
+                data = snapshot.to_dict() or {}
+            except Exception:
+                logger.warning("cancel: poll failed", exc_info=True)
+                data = {}
+            if data.get("cancelledMessageId") == self.message_id:
+                self.cancel(data.get("cancelRequestedAt") or 0)
+                return
+            if self._stopped.wait(self._poll_interval):
+                return
+
+
+@contextmanager
+def cancellation_scope(chat_id: str, chat_ref, message_id: str, poll_interval: float):
+    token = CancellationToken(chat_ref, message_id, poll_interval)
+    with _active_lock:
+        _active.setdefault(chat_id, set()).add(token)
+    token.watch()
+    try:
+        yield token
+    finally:
+        token.stop()
+        with _active_lock:
+            tokens = _active.get(chat_id)
+            tokens.discard(token)
+            if not tokens:
+                del _active[chat_id]
+
+
+def cancel_local(chat_id: str, message_id: str, requested_ms: int) -> int:
+    # Cancels invocations answering message_id that run in this process; returns how many.
+    with _active_lock:
+        tokens = [token for token in _active.get(chat_id) or () if token.message_id == message_id]
+    for token in tokens:
+        token.cancel(requested_ms)
+    return len(tokens)
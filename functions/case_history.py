@@ -0,0 +1,156 @@
+import datetime
+import math
+import re
+from collections import Counter
+
+from stream_json import parse_json_content
+
+# Per-car retrieval over earlier diagnoses. Each car has one case_index/{carId} doc holding
+# its most recent cases (one per chat: the latest aggregation wins) with their term
+# frequencies, plus document frequencies and total length, so adding a case is a single
+# read-modify-write and a lookup is a single read. Lookups rank cases, and the car's
+# Replacements, with BM25 against the current intake.
+
+CASE_INDEX_COLLECTION = "case_index"
+MAX_CASES = 50
+MAX_TERMS_PER_CASE = 120
+MAX_REPORT_CHARS = 300
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by car for from has have in is it its my of on or so that the "
+    "then there this to was when with".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN_PATTERN.findall(str(text or "").lower()) if token not in _STOPWORDS]
+
+
+def case_record(chat_id: str, diagnostic_id: str, aggregation, diagnostic) -> dict:
+    # The searchable record for one aggregation, or None when it carries no diagnosis.
+    verdict = parse_json_content(aggregation.get("combinedOutput") or "")
+    verdict = verdict if isinstance(verdict, dict) else {}
+    diagnosis = str(verdict.get("diagnostic_answer") or verdict.get("primary_diagnosis") or "").strip()
+    if not diagnosis:
+        return None
+    reasons = verdict.get("justifacation") or verdict.get("root_causes") or []
+    reasons = [str(reason) for reason in reasons] if isinstance(reasons, list) else [str(reasons)]
+    symptoms = [str(symptom) for symptom in diagnostic.get("symptoms") or []]
+    codes = [str(code) for code in diagnostic.get("dtcCodes") or []]
+    report = str((diagnostic.get("intakeAnswers") or {}).get("initial") or diagnostic.get("summary") or "")
+    terms = Counter(
+        tokenize(" ".join([diagnosis, str(verdict.get("explanation") or ""), report, *reasons, *symptoms, *codes]))
+    )
+    # Diagnosis, symptoms and codes are what recurs across visits; weight them over prose.
+    for token in tokenize(" ".join([diagnosis, *symptoms, *codes])):
+        terms[token] += 1
+    terms = dict(terms.most_common(MAX_TERMS_PER_CASE))
+    return {
+        "chatId": chat_id,
+        "diagnosticId": diagnostic_id,
+        "diagnosis": diagnosis,
+        "symptoms": symptoms,
+        "dtcCodes": codes,
+        "report": report[:MAX_REPORT_CHARS],
+        "createdAt": aggregation.get("createdAt") or 0,
+        "terms": terms,
+        "length": sum(terms.values()),
+    }
+
+
+def _remove(cases, df, case_id: str) -> int:
+    case = cases.pop(case_id, None)
+    if case is None:
+        return 0
+    for term in case.get("terms") or {}:
+        df[term] -= 1
+        if df[term] <= 0:
+            del df[term]
+    return case.get("length") or 0
+
+
+def apply_case(index_data, case) -> dict:
+    # Returns the new index doc with case added (replacing the chat's earlier case, and
+    # dropping the oldest beyond MAX_CASES), or None when it is already indexed.
+    index_data = index_data or {}
+    cases = dict(index_data.get("cases") or {})
+    if cases.get(case["chatId"]) == case:
+        return None
+    df = Counter(index_data.get("df") or {})
+    total_length = (index_data.get("totalLength") or 0) - _remove(cases, df, case["chatId"])
+    cases[case["chatId"]] = case
+    df.update(case["terms"].keys())
+    total_length += case["length"]
+    while len(cases) > MAX_CASES:
+        oldest = min(cases, key=lambda case_id: (cases[case_id].get("createdAt") or 0, case_id))
+        total_length -= _remove(cases, df, oldest)
+    return {"cases": cases, "df": dict(df), "totalLength": total_length}
+
+
+def search(index_data, query: str, k: int, replacements=(), exclude=()) -> list:
+    # Top-k BM25 hits over the indexed cases and the car's Replacements, best first.
+    index_data = index_data or {}
+    query_terms = set(tokenize(query))
+    if not query_terms or k <= 0:
+        return []
+    documents = [
+        (case, case.get("terms") or {}, case.get("length") or 0)
+        for case_id, case in (index_data.get("cases") or {}).items()
+        if case_id not in exclude
+    ]
+    total_length = sum(length for _, _, length in documents)
+    for replacement in replacements:
+        terms = Counter(tokenize(replacement))
+        if terms:
+            documents.append(({"replacement": str(replacement)}, terms, sum(terms.values())))
+            total_length += sum(terms.values())
+    if not documents:
+        return []
+    count = len(documents)
+    average_length = total_length / count or 1
+    df = Counter()
+    for _, terms, _ in documents:
+        df.update(term for term in query_terms if term in terms)
+    idf = {term: math.log(1 + (count - df[term] + 0.5) / (df[term] + 0.5)) for term in df}
+    hits = []
+    for document, terms, length in documents:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        score = 0.0
+        for term, weight in idf.items():
+            frequency = terms.get(term, 0)
+            if frequency:
+                score += weight * frequency * (BM25_K1 + 1) / (frequency + norm)
+        if score > 0:
+            hits.append((score, document))
+    hits.sort(key=lambda hit: (-hit[0], -(hit[1].get("createdAt") or 0)))
+    return [
+        {
+            **{key: value for key, value in document.items() if key not in ("terms", "length")},
+            "score": round(score, 3),
+        }
+        for score, document in hits[:k]
+    ]
+
+
+def format_cases(hits) -> str:
+    lines = []
+    for hit in hits:
+        if "replacement" in hit:
+            lines.append(f"- Replacement on record: {hit['replacement']}")
+            continue
+        when = datetime.datetime.fromtimestamp((hit.get("createdAt") or 0) / 1000, datetime.timezone.utc)
+        details = []
+        if hit.get("symptoms"):
+            details.append(f"symptoms: {', '.join(hit['symptoms'])}")
+        if hit.get("dtcCodes"):
+            details.append(f"codes: {', '.join(hit['dtcCodes'])}")
+        line = f"- {when:%Y-%m-%d}: {hit['diagnosis']}"
+        if details:
+            line += f" ({'; '.join(details)})"
+        if hit.get("report"):
+            line += f". Reported: {hit['report']}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from threading import Lock
+
+import requests
+
+# Record/replay of OpenRouter traffic. A cassette is a JSONL file with one interaction per
+# line: {"key", "model", "stream", "request", "status", "events": [[ms, line], ...]} for
+# streamed calls or {"body": {...}, "elapsedMs"} for plain ones. Event offsets are
+# measured from the moment the request was sent, so replay reproduces TTFT as well as
+# inter-chunk gaps.
+
+MODE_ENV = "OPENROUTER_CASSETTE_MODE"
+PATH_ENV = "OPENROUTER_CASSETTE"
+SPEED_ENV = "OPENROUTER_REPLAY_SPEED"
+
+
+class CassetteMiss(requests.ConnectionError):
+    pass
+
+
+def request_key(payload) -> str:
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class _RecordingResponse:
+    def __init__(self, cassette, interaction, response, started):
+        self._cassette = cassette
+        self._interaction = interaction
+        self._response = response
+        self._started = started
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def _elapsed_ms(self) -> int:
+        return int((time.perf_counter() - self._started) * 1000)
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+    def json(self):
+        body = self._response.json()
+        self._cassette._append({**self._interaction, "body": body, "elapsedMs": self._elapsed_ms()})
+        return body
+
+    def iter_lines(self, decode_unicode=False):
+        events = []
+        try:
+            for line in self._response.iter_lines(decode_unicode=decode_unicode):
+                events.append([self._elapsed_ms(), line])
+                yield line
+        finally:
+            # Also runs when the caller stops at [DONE] and closes the generator.
+            self._cassette._append({**self._interaction, "events": events})
+
+    def close(self):
+        self._response.close()
+
+
+class _ReplayResponse:
+    def __init__(self, interaction, speed: float):
+        self._interaction = interaction
+        self._speed = speed
+        self.status_code = interaction.get("status", 200)
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def _wait_until(self, started: float, offset_ms: float):
+        if self._speed <= 0:
+            return
+        delay = started + offset_ms / 1000 / self._speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def json(self):
+        self._wait_until(time.perf_counter(), self._interaction.get("elapsedMs", 0))
+        return self._interaction["body"]
+
+    def iter_lines(self, decode_unicode=False):
+        started = time.perf_counter()
+        for offset_ms, line in self._interaction.get("events") or []:
+            self._wait_until(started, offset_ms)
+            yield line
+
+    def close(self):
+        pass
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = Lock()
+        self._exact = defaultdict(list)
+        self._by_model = defaultdict(list)
+        self._positions = defaultdict(int)
+        self.stats = {"recorded": 0, "exact": 0, "loose": 0}
+        if mode == "replay":
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                self._exact[interaction["key"]].append(interaction)
+                self._by_model[(interaction["model"], interaction["stream"])].append(interaction)
+
+    def _append(self, interaction):
+        line = json.dumps(interaction, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+            self.stats["recorded"] += 1
+
+    def _next(self, bucket, candidates):
+        # Repeated identical requests replay their recordings in order, then cycle.
+        with self._lock:
+            position = self._positions[bucket]
+            self._positions[bucket] = position + 1
+            return candidates[position % len(candidates)]
+
+    def record(self, payload, response, started: float):
+        interaction = {
+            "key": request_key(payload),
+            "model": payload.get("model"),
+            "stream": bool(payload.get("stream")),
+            "request": payload,
+            "status": response.status_code,
+            "recordedAt": int(time.time() * 1000),
+        }
+        return _RecordingResponse(self, interaction, response, started)
+
+    def replay(self, payload, stream: bool = False):
+        key = request_key(payload)
+        if self._exact.get(key):
+            self.stats["exact"] += 1
+            return _ReplayResponse(self._next(("exact", key), self._exact[key]), self.speed)
+        # Prompt changes alter the key; fall back to the model's recordings in order so
+        # pipeline edits can still be exercised offline.
+        bucket = (payload.get("model"), bool(stream))
+        candidates = self._by_model.get(bucket)
+        if not candidates:
+            raise CassetteMiss(f"No recorded interaction for {bucket[0]} (stream={stream})")
+        self.stats["loose"] += 1
+        return _ReplayResponse(self._next(("model",) + bucket, candidates), self.speed)
+
+
+def cassette_from_env():
+    mode = os.environ.get(MODE_ENV)
+    if not mode:
+        return None
+    path = os.environ.get(PATH_ENV)
+    if not path:
+        raise ValueError(f"{PATH_ENV} must be set when {MODE_ENV} is {mode!r}")
+    return Cassette(path, mode, float(os.environ.get(SPEED_ENV, "1.0")))
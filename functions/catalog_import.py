@@ -0,0 +1,290 @@
+import argparse
+import csv
+import json
+import logging
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from firebase_admin import firestore, initialize_app
+from google.api_core import exceptions
+
+from vehicle_index import CATALOG_LEVELS, ENGINE_FIELDS, catalog_key_from_path
+
+logger = logging.getLogger("carllm")
+
+# Catalog importer: streams a CSV or JSONL dump of year/make/model/submodel/engine rows into
+# the vehicle_catalog hierarchy. Rows are read one at a time and folded into one entry per
+# node, so memory follows the catalog's size, not the dump's. Slugs, sortOrder and the
+# per-level counts are derived from the merged catalog (existing nodes plus the dump) in
+# one pass, and only nodes whose fields differ from Firestore are written, in parallel
+# batches that are retried on transient errors. Writes bump updatedAt, which is how
+# vehicle_catalog_lookup picks them up.
+
+CATALOG_ROOT = "vehicle_catalog/root"
+ID_FIELDS = {"makes": "makeId", "models": "modelId", "submodels": "submodelId", "engines": "engineId"}
+COUNT_FIELDS = {
+    "years": "makesCount",
+    "makes": "modelsCount",
+    "models": "submodelsCount",
+    "submodels": "enginesCount",
+}
+# Dump columns per level; "trim" is accepted for submodel.
+ROW_COLUMNS = (("year",), ("make",), ("model",), ("submodel", "trim"), ("engine",))
+BATCH_LIMIT = 400
+CONCURRENCY = 8
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 0.2
+MAX_BACKOFF_SECONDS = 5.0
+RETRYABLE_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+
+def slugify(value) -> str:
+    # "Mercedes-Benz" -> "mercedes-benz", "3.5L V6 EcoBoost" -> "3-5l-v6-ecoboost".
+    return re.sub(r"[^a-z0-9]+", "-", str(value or "").strip().lower()).strip("-")
+
+
+def read_rows(path: str, fmt: str = None):
+    # Yields one dict per row; fmt is "csv" or "jsonl", by default from the file extension.
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+    with open(path, newline="", encoding="utf-8") as handle:
+        if fmt == "csv":
+            yield from csv.DictReader(handle)
+            return
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _number(value, kind):
+    if value is None or value == "":
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _engine_fields(row) -> dict:
+    fields = {
+        "displacementLiters": _number(row.get("displacementLiters"), float),
+        "cylinders": _number(row.get("cylinders"), int),
+        "fuelType": str(row.get("fuelType") or "").strip().lower() or None,
+        "aspiration": str(row.get("aspiration") or "").strip().lower() or None,
+    }
+    return {field: value for field, value in fields.items() if value is not None}
+
+
+def row_path(row):
+    # [(slug, name), ...] from the year down to the deepest level the row fills, or None
+    # when the row has no usable year.
+    row = {str(column).strip(): value for column, value in row.items() if column is not None}
+    year = _number(str(row.get("year") or "").strip(), int)
+    if year is None:
+        return None
+    path = [(str(year), str(year))]
+    for aliases in ROW_COLUMNS[1:]:
+        name = next((str(row[alias]).strip() for alias in aliases if row.get(alias)), "")
+        slug = slugify(name)
+        if not slug:
+            break
+        path.append((slug, " ".join(name.split())))
+    return path
+
+
+def node_path(key) -> str:
+    segments = [CATALOG_ROOT]
+    for level, node_id in zip(CATALOG_LEVELS, key):
+        segments += [level, node_id]
+    return "/".join(segments)
+
+
+def _node_doc(key, name, engine_fields, sort_order, count) -> dict:
+    level = CATALOG_LEVELS[len(key) - 1]
+    if level == "years":
+        doc = {"year": int(key[0]), "label": name}
+    else:
+        doc = {ID_FIELDS[level]: key[-1], "name": name}
+    doc["sortOrder"] = sort_order
+    if level in COUNT_FIELDS:
+        doc[COUNT_FIELDS[level]] = count
+    doc.update(engine_fields)
+    return doc
+
+
+def _sort_key(key, name):
+    if len(key) == 1:
+        return (int(key[0]), "")
+    return (0, name.casefold())
+
+
+class CatalogImport:
+    # One import run: read the dump, load the existing catalog, diff, write.
+    def __init__(
+        self,
+        db,
+        now_ms,
+        prune: bool = False,
+        batch_size: int = BATCH_LIMIT,
+        concurrency: int = CONCURRENCY,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self._db = db
+        self._now_ms = now_ms
+        # With prune, nodes missing from the dump are deleted; otherwise they are kept.
+        self._prune = prune
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._lock = Lock()
+        self.retries = 0
+
+    def _read_dump(self, rows):
+        # key -> [name, engine fields]; the first spelling of a slug names the node.
+        nodes = {}
+        count = skipped = 0
+        for row in rows:
+            count += 1
+            path = row_path(row) if isinstance(row, dict) else None
+            if not path:
+                skipped += 1
+                continue
+            key = ()
+            for slug, name in path:
+                key += (slug,)
+                node = nodes.setdefault(key, [name, {}])
+            if len(key) == len(CATALOG_LEVELS):
+                for field, value in _engine_fields(row).items():
+                    node[1].setdefault(field, value)
+        return nodes, count, skipped
+
+    def _load_existing(self):
+        existing = {}
+        for level in CATALOG_LEVELS:
+            for snapshot in self._db.collection_group(level).stream():
+                if not snapshot.reference.path.startswith(CATALOG_ROOT + "/"):
+                    continue
+                key = catalog_key_from_path(snapshot.reference.path)
+                # Year ids are years; anything else under the root is not ours to number.
+                if key and key[0].isdigit():
+                    existing[key] = snapshot.to_dict() or {}
+        return existing
+
+    def _desired(self, imported, existing):
+        # One pass over the merged catalog: group siblings, then number them and count them.
+        nodes = dict(imported)
+        if not self._prune:
+            for key, data in existing.items():
+                if key not in nodes:
+                    name = str(data.get("name") or data.get("label") or data.get("year") or key[-1])
+                    fields = {field: data[field] for field in ENGINE_FIELDS if data.get(field) is not None}
+                    nodes[key] = [name, fields]
+        children = {}
+        for key in nodes:
+            children.setdefault(key[:-1], []).append(key)
+        desired = {}
+        for siblings in children.values():
+            siblings.sort(key=lambda key: _sort_key(key, nodes[key][0]))
+            for position, key in enumerate(siblings, start=1):
+                name, fields = nodes[key]
+                sort_order = int(key[0]) if len(key) == 1 else position
+                desired[key] = _node_doc(key, name, fields, sort_order, len(children.get(key, ())))
+        return desired
+
+    def _diff(self, desired, existing, now):
+        writes = []
+        created = updated = 0
+        for key, doc in desired.items():
+            current = existing.get(key)
+            if current is None:
+                writes.append(("set", node_path(key), {**doc, "createdAt": now, "updatedAt": now}))
+                created += 1
+                continue
+            changes = {field: value for field, value in doc.items() if current.get(field) != value}
+            if changes:
+                writes.append(("merge", node_path(key), {**changes, "updatedAt": now}))
+                updated += 1
+        # Only with prune: a kept node is always in desired.
+        doomed = [key for key in existing if key not in desired]
+        for key in doomed:
+            writes.append(("delete", node_path(key), None))
+        return writes, created, updated, len(doomed)
+
+    def _commit(self, writes):
+        # Sets, merges and deletes are idempotent, so a failed batch is simply sent again.
+        for attempt in range(1, self._max_attempts + 1):
+            batch = self._db.batch()
+            for method, path, data in writes:
+                reference = self._db.document(path)
+                if method == "delete":
+                    batch.delete(reference)
+                else:
+                    batch.set(reference, data, merge=method == "merge")
+            try:
+                batch.commit()
+                return
+            except RETRYABLE_ERRORS:
+                if attempt == self._max_attempts:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                backoff = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempt - 1))
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+
+    def run(self, rows) -> dict:
+        started = time.perf_counter()
+        imported, row_count, skipped = self._read_dump(rows)
+        existing = self._load_existing()
+        desired = self._desired(imported, existing)
+        writes, created, updated, deleted = self._diff(desired, existing, self._now_ms())
+        batches = [writes[start : start + self._batch_size] for start in range(0, len(writes), self._batch_size)]
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            for _ in executor.map(self._commit, batches):
+                pass
+        elapsed = time.perf_counter() - started
+        stats = {
+            "rows": row_count,
+            "skippedRows": skipped,
+            "nodes": len(desired),
+            "created": created,
+            "updated": updated,
+            "unchanged": len(desired) - created - updated,
+            "deleted": deleted,
+            "batches": len(batches),
+            "retries": self.retries,
+            "elapsedSeconds": round(elapsed, 3),
+            "nodesPerSecond": round(len(desired) / elapsed, 2) if elapsed else 0.0,
+        }
+        logger.info("catalog: import finished", extra=stats)
+        return stats
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m catalog_import")
+    parser.add_argument("path", help="CSV or JSONL dump")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--prune", action="store_true", help="delete nodes missing from the dump")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    # Honours FIRESTORE_EMULATOR_HOST like the rest of the functions.
+    initialize_app()
+    job = CatalogImport(
+        firestore.client(),
+        now_ms=lambda: int(time.time() * 1000),
+        prune=args.prune,
+        concurrency=args.concurrency,
+    )
+    print(json.dumps(job.run(read_rows(args.path, args.format)), indent=2))
+
+
+if __name__ == "__main__":
+    run()
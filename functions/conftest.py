@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cloud Functions loads main.py with this directory on sys.path; mirror that in tests.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
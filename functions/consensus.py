@@ -0,0 +1,223 @@
+import math
+import re
+
+from priors import prior_title
+from stream_json import parse_json_content
+
+PRIMARY_PATTERN = re.compile(
+    r"^[\s>#*_-]*primary\s+diagnosis[\s*_]*[:\-][\s*_]*(.+?)[\s*_]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_BULLET_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.+?)\s*$", re.MULTILINE)
+
+STOP_WORDS = {
+    "a", "an", "and", "the", "of", "or", "in", "on", "to", "with", "for", "at",
+    "likely", "probably", "possible", "possibly", "suspected", "most",
+    "faulty", "failed", "failing", "failure", "bad", "worn", "defective", "broken",
+    "malfunctioning", "malfunction", "issue", "issues", "problem", "problems",
+    "fault", "dirty", "weak", "damaged",
+}
+
+# Where a part sits, not what failed: "coil on cylinder 3" and "plug on cylinder 3" share
+# nothing that matters. Bare numbers are dropped too.
+LOCATION_WORDS = {
+    "cylinder", "bank", "front", "rear", "left", "right", "driver", "passenger", "side",
+    "upper", "lower", "upstream", "downstream", "inner", "outer", "from", "near", "by",
+}
+
+# How a part failed. Kept in the tokens (a leak is not a clog) but not part of the part's name.
+FAILURE_MODES = {
+    "leak", "clogged", "stuck", "open", "closed", "misfire", "low", "high", "lean", "rich",
+    "slipping", "seized", "cracked", "blown", "shorted", "noise", "vibration",
+}
+
+PHRASES = {
+    "mass air flow": "maf",
+    "mass airflow": "maf",
+    "oxygen sensor": "o2 sensor",
+    "catalytic converter": "cat",
+    "spark plug": "sparkplug",
+    "coil pack": "coilpack",
+    "ignition coil": "coil",
+    "water pump": "waterpump",
+    "throttle position": "tps",
+    "head gasket": "headgasket",
+}
+
+# Maps spellings and abbreviations of the same part/system onto one token.
+SYNONYMS = {
+    "cyl": "cylinder",
+    "o2": "oxygen",
+    "lambda": "oxygen",
+    "maf": "massairflow",
+    "mass-airflow": "massairflow",
+    "map": "manifoldpressure",
+    "cat": "catalyticconverter",
+    "catalytic": "catalyticconverter",
+    "converter": "catalyticconverter",
+    "coilpack": "coil",
+    "coils": "coil",
+    "plugs": "plug",
+    "sparkplug": "spark",
+    "tps": "throttleposition",
+    "cv": "cvjoint",
+    "tranny": "transmission",
+    "trans": "transmission",
+    "atf": "transmission",
+    "tcm": "transmission",
+    "ecm": "enginecomputer",
+    "pcm": "enginecomputer",
+    "ecu": "enginecomputer",
+    "purge": "evap",
+    "injectors": "injector",
+    "misfiring": "misfire",
+    "misfires": "misfire",
+    "leaking": "leak",
+    "leaks": "leak",
+}
+
+
+def extract_primary_diagnosis(text: str) -> str:
+    if not isinstance(text, str) or not text.strip():
+        return ""
+    # No fallback to the first line: free-form openers look alike across models.
+    match = PRIMARY_PATTERN.search(text)
+    return match.group(1).strip()[:160] if match else ""
+
+
+def diagnosis_tokens(title: str):
+    text = (title or "").lower()
+    for phrase, replacement in PHRASES.items():
+        text = text.replace(phrase, replacement)
+    tokens = set()
+    for word in re.findall(r"[a-z0-9]+(?:-[a-z0-9]+)?", text):
+        word = SYNONYMS.get(word, word)
+        word = word.replace("-", "")
+        if word in STOP_WORDS or word in LOCATION_WORDS or word.isdigit():
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(SYNONYMS.get(word, word))
+    return tokens
+
+
+def similarity(left, right) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def diagnosis_part(title: str) -> str:
+    # The canonical failure the diagnosis names (via the priors synonym table), or "".
+    return prior_title(title)
+
+
+def _same_part(left, right) -> bool:
+    # One names the part the other does, or a more specific piece of it ("gasket" vs
+    # "valve cover gasket"), but not a sibling ("oil pan gasket").
+    left, right = left - FAILURE_MODES, right - FAILURE_MODES
+    return left <= right or right <= left
+
+
+def cluster_candidates(candidates, min_similarity: float = 0.5):
+    # Candidates agree only when they name the same canonical part (or both name none),
+    # the same part words, and their tokens overlap enough.
+    clusters = []
+    for candidate in candidates:
+        tokens = diagnosis_tokens(candidate["primary"])
+        if not tokens:
+            continue
+        part = diagnosis_part(candidate["primary"])
+        for cluster in clusters:
+            if (
+                cluster["part"] == part
+                and _same_part(tokens, cluster["seed"])
+                and similarity(tokens, cluster["tokens"]) >= min_similarity
+            ):
+                cluster["members"].append(candidate)
+                cluster["tokens"] |= tokens
+                break
+        else:
+            clusters.append({"part": part, "seed": tokens, "tokens": set(tokens), "members": [candidate]})
+    return sorted(clusters, key=lambda cluster: -len(cluster["members"]))
+
+
+def _string_list(value):
+    if not isinstance(value, list):
+        return []
+    return [item.strip() for item in value if isinstance(item, str) and item.strip()]
+
+
+def candidate_record(output: str) -> dict:
+    # Normalizes a fan-out answer into the compact record the judge and the vote use.
+    # Structured answers follow FANOUT_FORMAT; prose from older runs or models that
+    # ignore the schema falls back to the "Primary diagnosis:" line and its bullets.
+    parsed = parse_json_content(output or "")
+    if isinstance(parsed, dict) and isinstance(parsed.get("primary_diagnosis"), str):
+        confidence = parsed.get("confidence")
+        explanation = parsed.get("explanation")
+        return {
+            "primary_diagnosis": parsed["primary_diagnosis"].strip()[:160],
+            "root_causes": _string_list(parsed.get("root_causes")),
+            "next_checks": _string_list(parsed.get("next_checks")),
+            "confidence": confidence if isinstance(confidence, (int, float)) else None,
+            "explanation": explanation.strip() if isinstance(explanation, str) else "",
+        }
+    text = output or ""
+    explanation = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        cleaned = PRIMARY_PATTERN.sub("", paragraph).strip()
+        if cleaned and not _BULLET_PATTERN.match(cleaned):
+            explanation = cleaned
+            break
+    return {
+        "primary_diagnosis": extract_primary_diagnosis(text),
+        "root_causes": [
+            bullet for bullet in _BULLET_PATTERN.findall(text) if not PRIMARY_PATTERN.match(bullet)
+        ],
+        "next_checks": [],
+        "confidence": None,
+        "explanation": explanation,
+    }
+
+
+def _record(result) -> dict:
+    return result.get("record") or candidate_record(result.get("output") or "")
+
+
+def find_consensus(results, supermajority: float = 2 / 3, min_similarity: float = 0.5):
+    # results: [{"model", "output", "record"?, ...}] in a stable order; failed runs count
+    # as dissent.
+    candidates = []
+    for result in results:
+        record = _record(result)
+        primary = record["primary_diagnosis"]
+        if primary:
+            candidates.append({**result, "record": record, "primary": primary})
+    if len(results) < 2 or not candidates:
+        return None
+    clusters = cluster_candidates(candidates, min_similarity)
+    required = max(2, math.ceil(len(results) * supermajority - 1e-9))
+    winner = clusters[0]
+    if len(winner["members"]) < required:
+        return None
+    return {
+        "members": winner["members"],
+        "votes": len(winner["members"]),
+        "total": len(results),
+    }
+
+
+def build_judgement(consensus, max_reasons: int = 5) -> dict:
+    # The representative is the most detailed member so the user still gets reasons.
+    representative = max(consensus["members"], key=lambda member: len(member["output"]))
+    record = _record(representative)
+    reasons = record["root_causes"][:max_reasons]
+    agreeing = ", ".join(member["model"] for member in consensus["members"])
+    reasons.append(f"{consensus['votes']} of {consensus['total']} models agreed: {agreeing}")
+    return {
+        "model_name": representative["model"],
+        "diagnostic_answer": representative["primary"],
+        "justifacation": reasons,
+        "explanation": record["explanation"][:800] or representative["primary"],
+    }
@@ -0,0 +1,131 @@
+from typing import Any
+
+from response_formats import VEHICLE_METADATA_FIELDS
+from stream_json import parse_json_content
+
+CONFIDENCE_THRESHOLD = 0.8
+
+ENRICHMENT_SYSTEM_PROMPT = (
+    "You extract vehicle identity metadata and replaced parts from a batch of user "
+    "messages about one car. Only return updates the user explicitly states, and only "
+    "list parts the user says were replaced, installed, or swapped. Do not guess. Use "
+    "the current known data to avoid duplicates."
+)
+
+
+def normalize_vehicle_text(value: Any) -> str:
+    if not isinstance(value, str):
+        return ""
+    return value.strip()
+
+
+def extract_user_vehicle_text(content: str) -> str:
+    parsed = parse_json_content(content)
+    if parsed and isinstance(parsed, dict):
+        answers = parsed.get("answers")
+        if isinstance(answers, list):
+            clean_answers = [str(item).strip() for item in answers if str(item).strip()]
+            if clean_answers:
+                return "User answers:\n- " + "\n- ".join(clean_answers)
+    return content.strip()
+
+
+def is_confident(parsed) -> bool:
+    confidence = parsed.get("confidence")
+    return isinstance(confidence, (int, float)) and confidence >= CONFIDENCE_THRESHOLD
+
+
+def open_metadata_fields(car_data) -> tuple:
+    # Fields decoded from the VIN are authoritative, so the LLM only sees the rest.
+    vin_fields = set(car_data.get("vinDecodedFields") or [])
+    return tuple(
+        source_key
+        for source_key, target_key in VEHICLE_METADATA_FIELDS.items()
+        if target_key not in vin_fields
+    )
+
+
+def known_metadata_lines(car_data, open_fields) -> str:
+    return "".join(
+        f"Known {source_key}: "
+        f"{normalize_vehicle_text(car_data.get(VEHICLE_METADATA_FIELDS[source_key])) or 'unknown'}\n"
+        for source_key in open_fields
+    )
+
+
+def metadata_write_updates(car_data, updates, open_fields) -> dict:
+    write_updates = {}
+    for source_key in open_fields:
+        target_key = VEHICLE_METADATA_FIELDS[source_key]
+        value = normalize_vehicle_text(updates.get(source_key))
+        if not value:
+            continue
+        if value == normalize_vehicle_text(car_data.get(target_key)):
+            continue
+        write_updates[target_key] = value
+    return write_updates
+
+
+def existing_replacements(car_data) -> list:
+    replacements = car_data.get("Replacements") or []
+    return replacements if isinstance(replacements, list) else []
+
+
+def replacement_additions(existing, replacements) -> list:
+    existing_normalized = {str(item).strip().lower() for item in existing}
+    additions = []
+    for item in replacements:
+        if not isinstance(item, str):
+            continue
+        cleaned = item.strip()
+        if not cleaned:
+            continue
+        normalized = cleaned.lower()
+        if normalized in existing_normalized:
+            continue
+        existing_normalized.add(normalized)
+        additions.append(cleaned)
+    return additions
+
+
+def enrichment_messages(car_data, texts, open_fields) -> list:
+    known = existing_replacements(car_data)
+    numbered = "\n\n".join(f"Message {index}:\n{text}" for index, text in enumerate(texts, 1))
+    user_prompt = (
+        "Known vehicle:\n"
+        f"Year: {car_data.get('year', 'unknown')}\n"
+        f"Make: {car_data.get('make', 'unknown')}\n"
+        f"Model: {car_data.get('model', 'unknown')}\n"
+        f"{known_metadata_lines(car_data, open_fields)}"
+        f"Known replacements: {', '.join(known) if known else 'None'}\n\n"
+        "User messages:\n"
+        f"{numbered}"
+    )
+    return [
+        {"role": "system", "content": ENRICHMENT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def parse_enrichment(response):
+    # Returns the parsed extraction only when it is usable under the confidence rules.
+    parsed = parse_json_content(response)
+    if not parsed or not isinstance(parsed, dict):
+        return None
+    if not parsed.get("has_update") or not is_confident(parsed):
+        return None
+    return parsed
+
+
+def enrichment_write_updates(car_data, parsed, open_fields) -> dict:
+    write_updates = {}
+    updates = parsed.get("updates") or {}
+    if isinstance(updates, dict):
+        write_updates.update(metadata_write_updates(car_data, updates, open_fields))
+    replacements = parsed.get("replacements") or []
+    if isinstance(replacements, list):
+        known = existing_replacements(car_data)
+        additions = replacement_additions(known, replacements)
+        if additions:
+            write_updates["Replacements"] = known + additions
+    return write_updates
@@ -0,0 +1,153 @@
+import logging
+import time
+
+from firebase_admin import firestore
+
+from enrichment import enrichment_write_updates
+
+logger = logging.getLogger("carllm")
+
+ENRICHMENT_QUEUE_COLLECTION = "enrichment_queue"
+DEBOUNCE_WINDOW_MS = 8_000
+MAX_WAIT_MS = 30_000
+# A leader that has not finished by then is assumed dead and the next message takes over.
+LEADER_LEASE_MS = MAX_WAIT_MS + 90_000
+
+
+class EnrichmentQueue:
+    # Debounces enrichment per car: each user message is queued on enrichment_queue/{carId}
+    # and the message that finds no live leader waits out the window, then drains the
+    # whole batch. Messages arriving while it waits extend the window up to MAX_WAIT_MS.
+    def __init__(
+        self,
+        db,
+        now_ms,
+        window_ms: int = DEBOUNCE_WINDOW_MS,
+        max_wait_ms: int = MAX_WAIT_MS,
+        sleep=time.sleep,
+    ):
+        self._db = db
+        self._now_ms = now_ms
+        self._window_ms = window_ms
+        self._max_wait_ms = max_wait_ms
+        self._sleep = sleep
+
+    def _queue_ref(self, car_id: str):
+        return self._db.collection(ENRICHMENT_QUEUE_COLLECTION).document(car_id)
+
+    def enqueue(self, car_id: str, message_id: str, entry: dict) -> bool:
+        # Returns True when this message became the leader for the current batch.
+        queue_ref = self._queue_ref(car_id)
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = queue_ref.get(transaction=transaction)
+            state = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            now = self._now_ms()
+            pending = dict(state.get("pending") or {})
+            first_queued = state.get("firstQueuedAt") if pending else None
+            first_queued = first_queued or now
+            pending[message_id] = entry
+            leader = state.get("leader")
+            lease_expired = (state.get("leaseUntil") or 0) < now
+            is_leader = not leader or lease_expired or leader == message_id
+            transaction.set(
+                queue_ref,
+                {
+                    "pending": pending,
+                    "firstQueuedAt": first_queued,
+                    "dueAt": min(now + self._window_ms, first_queued + self._max_wait_ms),
+                    "leader": message_id if is_leader else leader,
+                    "leaseUntil": now + LEADER_LEASE_MS if is_leader else state.get("leaseUntil"),
+                    "updatedAt": now,
+                },
+            )
+            return is_leader
+
+        return apply(self._db.transaction())
+
+    def _claim(self, car_id: str, message_id: str):
+        # Returns ("wait", ms), ("batch", pending) or ("done", None).
+        queue_ref = self._queue_ref(car_id)
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = queue_ref.get(transaction=transaction)
+            state = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            if state.get("leader") != message_id:
+                return "done", None
+            now = self._now_ms()
+            pending = state.get("pending") or {}
+            if not pending:
+                transaction.update(queue_ref, {"leader": None, "leaseUntil": 0, "updatedAt": now})
+                return "done", None
+            due_at = state.get("dueAt") or now
+            if now < due_at:
+                return "wait", due_at - now
+            # The batch stays in pending until _ack, so a leader that dies mid-batch leaves
+            # it for whoever takes over once the lease runs out.
+            transaction.update(queue_ref, {"leaseUntil": now + LEADER_LEASE_MS, "updatedAt": now})
+            return "batch", pending
+
+        return apply(self._db.transaction())
+
+    def _ack(self, car_id: str, batch: dict):
+        # Drops the processed entries; anything queued meanwhile starts a fresh window.
+        queue_ref = self._queue_ref(car_id)
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = queue_ref.get(transaction=transaction)
+            state = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            now = self._now_ms()
+            pending = {
+                message_id: entry
+                for message_id, entry in (state.get("pending") or {}).items()
+                if batch.get(message_id) != entry
+            }
+            transaction.update(
+                queue_ref,
+                {
+                    "pending": pending,
+                    "firstQueuedAt": now if pending else None,
+                    "dueAt": now + self._window_ms if pending else None,
+                    "updatedAt": now,
+                },
+            )
+
+        apply(self._db.transaction())
+
+    def drain(self, car_id: str, message_id: str, process) -> int:
+        # Leader loop: wait for the window to close, hand the batch to process(entries),
+        # and repeat for anything queued meanwhile. Returns the number of batches run.
+        batches = 0
+        while True:
+            action, value = self._claim(car_id, message_id)
+            if action == "done":
+                return batches
+            if action == "wait":
+                self._sleep(value / 1000)
+                continue
+            entries = sorted(value.values(), key=lambda item: item.get("createdAt") or 0)
+            try:
+                process(entries)
+            except Exception:
+                logger.exception("enrichment: batch failed", extra={"carId": car_id})
+            self._ack(car_id, value)
+            batches += 1
+
+
+def apply_car_enrichment(db, car_ref, parsed, open_fields, now_ms):
+    # Recomputes the write against the car as it is at commit time, so concurrent
+    # enrichment runs merge their additions instead of overwriting each other.
+    @firestore.transactional
+    def apply(transaction):
+        snapshot = car_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return {}
+        write_updates = enrichment_write_updates(snapshot.to_dict() or {}, parsed, open_fields)
+        if write_updates:
+            transaction.update(car_ref, {**write_updates, "updatedAt": now_ms()})
+        return write_updates
+
+    return apply(db.transaction())
@@ -0,0 +1,247 @@
+import datetime
+import json
+import logging
+
+from firebase_admin import firestore
+
+logger = logging.getLogger("carllm")
+
+# Batch diagnosis for fleets. A batch creates every item's diagnostic, chat and intake
+# messages up front in bulk commits, then diagnoses the items with bounded concurrency.
+# Progress lands on diagnosis_batches/{batchId} (counters) and .../items/{index} (one doc
+# per item), so clients watch a batch the same way they watch a chat. Items for the same
+# vehicle are started back to back: their prompts share the system prompt and vehicle
+# context as a prefix, which is what provider prompt caches key on.
+
+BATCH_COLLECTION = "diagnosis_batches"
+ITEMS_COLLECTION = "items"
+BATCH_LIMIT = 400
+MAX_REPORT_CHARS = 4000
+
+
+def normalize_items(items, max_items: int):
+    # Raises ValueError with a message fit for the caller.
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > max_items:
+        raise ValueError(f"At most {max_items} items per batch")
+    normalized = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {index} must be an object")
+        car_id = item.get("carId")
+        report = item.get("report")
+        if not isinstance(car_id, str) or not car_id:
+            raise ValueError(f"Item {index} is missing carId")
+        if not isinstance(report, str) or not report.strip():
+            raise ValueError(f"Item {index} is missing report")
+        answers = item.get("answers") or []
+        questions = item.get("questions") or []
+        if not isinstance(answers, list) or not isinstance(questions, list):
+            raise ValueError(f"Item {index} answers and questions must be lists")
+        if not all(isinstance(value, str) for value in answers + questions):
+            raise ValueError(f"Item {index} answers and questions must be strings")
+        normalized.append(
+            {
+                "index": index,
+                "carId": car_id,
+                "report": report.strip()[:MAX_REPORT_CHARS],
+                "questions": [value.strip() for value in questions if value.strip()],
+                "answers": [value.strip() for value in answers if value.strip()],
+            }
+        )
+    return normalized
+
+
+def vehicle_key(car_data) -> tuple:
+    return tuple(str(car_data.get(field) or "").lower() for field in ("year", "make", "model"))
+
+
+def prefix_order(records, cars):
+    # Stable grouping by vehicle, in order of first appearance.
+    first_seen = {}
+    for record in records:
+        first_seen.setdefault(vehicle_key(cars[record["carId"]]), len(first_seen))
+    return sorted(records, key=lambda record: first_seen[vehicle_key(cars[record["carId"]])])
+
+
+class _BulkWriter:
+    def __init__(self, db):
+        self._db = db
+        self._batch = db.batch()
+        self._pending = 0
+        self.commits = 0
+
+    def set(self, reference, data):
+        self._batch.set(reference, data)
+        self._pending += 1
+        if self._pending >= BATCH_LIMIT:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._batch.commit()
+            self.commits += 1
+            self._batch = self._db.batch()
+            self._pending = 0
+
+
+def create_records(db, uid: str, items, now_ms):
+    # Writes the batch doc and, per item, diagnostic + chat + intake messages + item doc,
+    # in commits of up to BATCH_LIMIT writes. Returns the batch ref and one record per item.
+    now = now_ms()
+    batch_ref = db.collection(BATCH_COLLECTION).document()
+    title = f"Fleet diagnostic {datetime.datetime.fromtimestamp(now / 1000, datetime.timezone.utc):%Y-%m-%d}"
+    writer = _BulkWriter(db)
+    writer.set(
+        batch_ref,
+        {
+            "userId": uid,
+            "status": "running",
+            "total": len(items),
+            "completed": 0,
+            "diagnosed": 0,
+            "needsMoreInfo": 0,
+            "cancelled": 0,
+            "timedOut": 0,
+            "failed": 0,
+            "createdAt": now,
+            "updatedAt": now,
+        },
+    )
+    records = []
+    for item in items:
+        diagnostic_ref = db.collection("diagnostics").document()
+        chat_ref = db.collection("chats").document()
+        messages = chat_ref.collection("messages")
+        initial_ref = messages.document()
+        latest_ref = initial_ref
+        writer.set(
+            diagnostic_ref,
+            {
+                "userId": uid,
+                "carId": item["carId"],
+                "title": title,
+                "summary": item["report"],
+                "status": "open",
+                "batchId": batch_ref.id,
+                "createdAt": now,
+                "updatedAt": now,
+            },
+        )
+        writer.set(
+            initial_ref,
+            {
+                "role": "user",
+                "promptType": "intake",
+                "content": item["report"],
+                "createdAt": now,
+                "source": "user",
+                "metadata": {"intakeStage": "initial"},
+            },
+        )
+        if item["questions"]:
+            latest_ref = messages.document()
+            writer.set(
+                latest_ref,
+                {
+                    "role": "assistant",
+                    "promptType": "intake",
+                    "content": json.dumps({"questions": item["questions"]}),
+                    "createdAt": now + 1,
+                    "source": "system",
+                    "metadata": {"intakeStage": "followup_questions"},
+                },
+            )
+        if item["answers"]:
+            latest_ref = messages.document()
+            writer.set(
+                latest_ref,
+                {
+                    "role": "user",
+                    "promptType": "intake",
+                    "content": json.dumps({"answers": item["answers"]}),
+                    "createdAt": now + 2,
+                    "source": "user",
+                    "metadata": {"intakeStage": "followup_answer"},
+                },
+            )
+        writer.set(
+            chat_ref,
+            {
+                "userId": uid,
+                "diagnosticId": diagnostic_ref.id,
+                "carId": item["carId"],
+                "status": "open",
+                "phase": "diagnosis_pending",
+                "awaitingResponse": True,
+                "tokensReceived": 0,
+                "batchId": batch_ref.id,
+                "firstPromptId": initial_ref.id,
+                "latestMessageId": latest_ref.id,
+                "createdAt": now,
+                "updatedAt": now,
+            },
+        )
+        item_ref = batch_ref.collection(ITEMS_COLLECTION).document(f"{item['index']:04d}")
+        writer.set(
+            item_ref,
+            {
+                "index": item["index"],
+                "carId": item["carId"],
+                "diagnosticId": diagnostic_ref.id,
+                "chatId": chat_ref.id,
+                "status": "queued",
+                "createdAt": now,
+            },
+        )
+        records.append(
+            {
+                **item,
+                "itemRef": item_ref,
+                "chatRef": chat_ref,
+                "messageId": latest_ref.id,
+            }
+        )
+    writer.flush()
+    logger.info(
+        "fleet: batch created",
+        extra={"batchId": batch_ref.id, "items": len(items), "commits": writer.commits},
+    )
+    return batch_ref, records
+
+
+class BatchProgress:
+    # Per-item status docs plus batch counters; each finished item is one commit.
+    def __init__(self, db, batch_ref, now_ms):
+        self._db = db
+        self._batch_ref = batch_ref
+        self._now_ms = now_ms
+
+    def started(self, record):
+        record["itemRef"].update({"status": "running", "startedAt": self._now_ms()})
+
+    def finished(self, record, result: dict):
+        status = result.get("status")
+        counter = {
+            "diagnosed": "diagnosed",
+            "needs_more_info": "needsMoreInfo",
+            "cancelled": "cancelled",
+            "timed_out": "timedOut",
+        }.get(status, "failed")
+        now = self._now_ms()
+        batch = self._db.batch()
+        batch.update(record["itemRef"], {**result, "finishedAt": now})
+        batch.update(
+            self._batch_ref,
+            {
+                "completed": firestore.Increment(1),
+                counter: firestore.Increment(1),
+                "updatedAt": now,
+            },
+        )
+        batch.commit()
+
+    def done(self, summary: dict, status: str = "done"):
+        now = self._now_ms()
+        self._batch_ref.update({**summary, "status": status, "finishedAt": now, "updatedAt": now})
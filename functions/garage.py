@@ -0,0 +1,148 @@
+import base64
+import binascii
+import json
+import threading
+import time
+
+from firebase_admin import firestore
+
+# Garage dashboard: a page of the user's cars, each with its latest diagnostics and the
+# status of their chats, in one response. Every query is projected to the fields the
+# dashboard renders, so intake state, replacements and the like never leave Firestore.
+# Reads run in three waves (cars, then diagnostics per car, then chats by diagnostic id)
+# with the queries of a wave issued in parallel.
+
+CAR_FIELDS = ("name", "year", "make", "model", "trim", "mileage", "vin", "createdAt")
+DIAGNOSTIC_FIELDS = ("carId", "title", "summary", "status", "createdAt", "updatedAt")
+CHAT_FIELDS = ("diagnosticId", "status", "phase", "awaitingResponse", "latestMessageId", "updatedAt")
+MAX_PAGE_SIZE = 50
+MAX_DIAGNOSTICS_PER_CAR = 10
+# Firestore's limit on values in an "in" filter.
+IN_FILTER_LIMIT = 30
+SUMMARY_CHARS = 200
+
+
+def encode_cursor(car) -> str:
+    raw = json.dumps([car.get("createdAt"), car["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    # Returns (createdAt, carId); raises ValueError for anything not made by encode_cursor.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, car_id = json.loads(raw)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(car_id, str) or not car_id:
+        raise ValueError("Invalid cursor")
+    return created_at, car_id
+
+
+def _eq(field: str, value):
+    return firestore.FieldFilter(field, "==", value)
+
+
+def _cars_page(db, uid: str, limit: int, cursor):
+    query = (
+        db.collection("cars")
+        .where(filter=_eq("userId", uid))
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)
+        .select(CAR_FIELDS)
+    )
+    if cursor:
+        created_at, car_id = decode_cursor(cursor)
+        query = query.start_after({"createdAt": created_at, "__name__": db.collection("cars").document(car_id)})
+    # One extra car tells whether there is a next page.
+    snapshots = list(query.limit(limit + 1).stream())
+    cars = [{"id": snapshot.id, **(snapshot.to_dict() or {})} for snapshot in snapshots[:limit]]
+    return cars, len(snapshots) > limit
+
+
+def _latest_diagnostics(db, uid: str, car_id: str, per_car: int):
+    query = (
+        db.collection("diagnostics")
+        .where(filter=_eq("carId", car_id))
+        .where(filter=_eq("userId", uid))
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .select(DIAGNOSTIC_FIELDS)
+        .limit(per_car)
+    )
+    diagnostics = []
+    for snapshot in query.stream():
+        data = snapshot.to_dict() or {}
+        data.pop("carId", None)
+        if isinstance(data.get("summary"), str):
+            data["summary"] = data["summary"][:SUMMARY_CHARS]
+        diagnostics.append({"id": snapshot.id, **data, "chat": None})
+    return diagnostics
+
+
+def _chats_for(db, uid: str, diagnostic_ids):
+    query = (
+        db.collection("chats")
+        .where(filter=_eq("userId", uid))
+        .where(filter=firestore.FieldFilter("diagnosticId", "in", list(diagnostic_ids)))
+        .select(CHAT_FIELDS)
+    )
+    return [{"id": snapshot.id, **(snapshot.to_dict() or {})} for snapshot in query.stream()]
+
+
+def load_garage(db, uid: str, limit: int, per_car: int, cursor, executor) -> dict:
+    cars, has_more = _cars_page(db, uid, limit, cursor)
+    if per_car:
+        futures = [executor.submit(_latest_diagnostics, db, uid, car["id"], per_car) for car in cars]
+        for car, future in zip(cars, futures):
+            car["diagnostics"] = future.result()
+    else:
+        for car in cars:
+            car["diagnostics"] = []
+
+    by_id = {diagnostic["id"]: diagnostic for car in cars for diagnostic in car["diagnostics"]}
+    ids = list(by_id)
+    chunks = [ids[start : start + IN_FILTER_LIMIT] for start in range(0, len(ids), IN_FILTER_LIMIT)]
+    for future in [executor.submit(_chats_for, db, uid, chunk) for chunk in chunks]:
+        for chat in future.result():
+            diagnostic = by_id.get(chat.pop("diagnosticId", None))
+            if diagnostic is None:
+                continue
+            # A diagnostic has one chat; if there are more, the most recently active wins.
+            current = diagnostic["chat"]
+            if current is None or (chat.get("updatedAt") or 0) >= (current.get("updatedAt") or 0):
+                diagnostic["chat"] = chat
+    return {"cars": cars, "nextCursor": encode_cursor(cars[-1]) if has_more and cars else None}
+
+
+class GarageCache:
+    # Per-user responses for a few seconds, so paging through the garage is free. Callables
+    # that create diagnostics call invalidate(uid); other changes show up once the entry
+    # expires, or at once for a fresh page (the first page is fresh by default).
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+            return None
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, uid: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == uid]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,133 @@
+import re
+
+from stream_json import parse_json_content
+
+DTC_PATTERN = re.compile(r"\b([PBCU][0-3][0-9A-F]{3})\b", re.IGNORECASE)
+
+# Canonical symptom -> phrases users write for it. Matching is on word boundaries.
+SYMPTOM_PHRASES = {
+    "check engine light": ("check engine", "cel", "engine light", "mil light"),
+    "misfire": ("misfire", "misfiring", "misfires"),
+    "rough idle": ("rough idle", "idles rough", "idle is rough", "shaky idle"),
+    "stalling": ("stall", "stalls", "stalling", "dies at idle"),
+    "no start": ("no start", "won't start", "wont start", "doesn't start", "does not start"),
+    "hard start": ("hard start", "hard to start", "long crank", "cranks long"),
+    "overheating": ("overheat", "overheats", "overheating", "running hot"),
+    "hesitation": ("hesitate", "hesitates", "hesitation", "stumble", "stumbles"),
+    "loss of power": ("loss of power", "lack of power", "no power", "sluggish", "limp mode"),
+    "knocking": ("knock", "knocking", "pinging", "ticking"),
+    "grinding noise": ("grind", "grinding"),
+    "squealing": ("squeal", "squeals", "squealing", "squeak", "squeaking"),
+    "vibration": ("vibration", "vibrates", "shaking", "shakes", "shudder", "shudders"),
+    "pulling": ("pulls to", "pulling to", "pulls left", "pulls right"),
+    "fluid leak": ("leak", "leaks", "leaking", "drip", "dripping", "puddle"),
+    "smoke": ("smoke", "smoking", "smokes"),
+    "burning smell": ("burning smell", "smells burnt", "burning odor", "smell of burning"),
+    "fuel smell": ("gas smell", "fuel smell", "smells like gas"),
+    "poor fuel economy": ("bad mileage", "poor mileage", "fuel economy", "gas mileage"),
+    "battery drain": ("battery drain", "dead battery", "battery dies"),
+    "brake noise": ("brakes squeal", "brake noise", "brakes grind"),
+    "soft brake pedal": ("soft pedal", "spongy", "pedal goes to the floor"),
+    "transmission slipping": ("slipping", "slips", "rpm flare", "delayed shift", "hard shift"),
+    "warning light": ("warning light", "abs light", "battery light", "oil light", "tpms light"),
+}
+_SYMPTOM_PATTERNS = [
+    (symptom, re.compile(r"\b(?:" + "|".join(re.escape(p) for p in phrases) + r")\b", re.IGNORECASE))
+    for symptom, phrases in SYMPTOM_PHRASES.items()
+]
+
+
+def _parsed_list(content: str, key: str):
+    parsed = parse_json_content(content)
+    if parsed and isinstance(parsed, dict) and isinstance(parsed.get(key), list):
+        return [item.strip() for item in parsed[key] if isinstance(item, str) and item.strip()]
+    return None
+
+
+def intake_entry(message):
+    # The contribution of one intake message, parsed once when the message is written.
+    if not message or message.get("promptType") != "intake":
+        return None
+    content = (message.get("content") or "").strip()
+    if not content:
+        return None
+    role = message.get("role")
+    stage = (message.get("metadata") or {}).get("intakeStage")
+    entry = {"createdAt": message.get("createdAt") or 0}
+    if role == "user":
+        if stage == "initial":
+            return {**entry, "kind": "initial", "values": [content]}
+        if stage == "followup_answer":
+            answers = _parsed_list(content, "answers")
+            return {**entry, "kind": "answers", "values": answers if answers is not None else [content]}
+        return {**entry, "kind": "user", "values": [content]}
+    if role == "assistant":
+        questions = _parsed_list(content, "questions")
+        return {**entry, "kind": "questions", "values": questions if questions is not None else [content]}
+    return None
+
+
+def summarize_intake(entries) -> dict:
+    # Replays entries in transcript order, mirroring the stage rules of the original
+    # message walk, so out-of-order trigger delivery still yields the same state.
+    initial = ""
+    questions = []
+    answers = []
+    ordered = sorted(entries.items(), key=lambda item: (item[1].get("createdAt") or 0, item[0]))
+    for _, entry in ordered:
+        kind = entry.get("kind")
+        values = list(entry.get("values") or [])
+        if kind == "initial":
+            initial = values[0]
+        elif kind == "answers":
+            answers.extend(values)
+        elif kind == "user":
+            if not initial:
+                initial = values[0]
+            else:
+                answers.extend(values)
+        elif kind == "questions":
+            questions.extend(values)
+    return {"initial": initial, "questions": questions, "answers": answers}
+
+
+def extract_symptoms(texts) -> list:
+    text = "\n".join(texts)
+    return [symptom for symptom, pattern in _SYMPTOM_PATTERNS if pattern.search(text)]
+
+
+def extract_dtc_codes(texts) -> list:
+    codes = []
+    for text in texts:
+        for code in DTC_PATTERN.findall(text):
+            code = code.upper()
+            if code not in codes:
+                codes.append(code)
+    return codes
+
+
+def apply_intake_entry(intake_answers, message_id: str, entry):
+    # Returns the new intakeAnswers map, or None when the entry is already applied.
+    entries = dict((intake_answers or {}).get("entries") or {})
+    if entries.get(message_id) == entry:
+        return None
+    if entry is None:
+        if message_id not in entries:
+            return None
+        entries.pop(message_id)
+    else:
+        entries[message_id] = entry
+    return {**summarize_intake(entries), "entries": entries}
+
+
+def intake_updates(diagnostic_data, intake_answers) -> dict:
+    texts = [intake_answers["initial"], *intake_answers["answers"]]
+    dtc_codes = list(diagnostic_data.get("dtcCodes") or [])
+    for code in extract_dtc_codes(texts):
+        if code not in dtc_codes:
+            dtc_codes.append(code)
+    return {
+        "intakeAnswers": intake_answers,
+        "symptoms": extract_symptoms(texts),
+        "dtcCodes": dtc_codes,
+    }
@@ -0,0 +1,62 @@
+import re
+
+# Builds the judge's user prompt from compact fan-out records instead of verbatim prose,
+# so its size is bounded by fan-out width times the per-candidate cap rather than by
+# how verbose each model felt like being. Full answers stay in llm_runs.output.
+
+CANDIDATE_TOKEN_CAP = 120
+
+
+def estimate_tokens(text: str) -> int:
+    # Same whitespace heuristic as the stream progress counter.
+    return len(re.findall(r"\S+", text or ""))
+
+
+def _render(model: str, record, causes: int, checks: int) -> str:
+    lines = [f"Model: {model}", f"Primary diagnosis: {record['primary_diagnosis']}"]
+    if record.get("confidence") is not None:
+        lines.append(f"Confidence: {record['confidence']:.2f}")
+    if causes:
+        lines.append("Root causes (most likely first):")
+        lines.extend(f"{rank}. {cause}" for rank, cause in enumerate(record["root_causes"][:causes], 1))
+    if checks:
+        lines.append("Next checks:")
+        lines.extend(f"- {check}" for check in record["next_checks"][:checks])
+    return "\n".join(lines)
+
+
+def compact_candidate(model: str, record, max_tokens: int = CANDIDATE_TOKEN_CAP) -> str:
+    if not record or not record.get("primary_diagnosis"):
+        return f"Model: {model}\nNo usable response."
+    causes = len(record.get("root_causes") or [])
+    checks = len(record.get("next_checks") or [])
+    text = _render(model, record, causes, checks)
+    # Drop the lowest-ranked checks, then causes, keeping the top one of each.
+    while estimate_tokens(text) > max_tokens and (checks > 1 or causes > 1):
+        if checks > 1:
+            checks -= 1
+        else:
+            causes -= 1
+        text = _render(model, record, causes, checks)
+    if estimate_tokens(text) > max_tokens:
+        kept = []
+        budget = max_tokens
+        for line in text.split("\n"):
+            words = line.split()
+            if budget <= 0:
+                break
+            if len(words) > budget:
+                line = " ".join(words[:budget]) + " …"
+            kept.append(line)
+            budget -= len(words)
+        text = "\n".join(kept)
+    return text
+
+
+def build_judge_prompt(intake_text: str, candidates, max_tokens: int = CANDIDATE_TOKEN_CAP) -> str:
+    # candidates: [{"model", "record"}] in fan-out order.
+    sections = [
+        compact_candidate(candidate["model"], candidate.get("record"), max_tokens)
+        for candidate in candidates
+    ]
+    return f"{intake_text}\n\nCandidate diagnoses:\n\n" + "\n\n".join(sections)
@@ -0,0 +1,451 @@
+import copy
+import datetime
+import random
+import string
+import threading
+import time
+from collections import Counter
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+# In-memory stand-in for the subset of the Firestore client CarLLM uses. It backs the
+# benchmarks and tests, counts reads/writes like billing does, and honours the
+# transaction protocol expected by firestore.transactional. Transactions are fully
+# serialized, which is stricter than Firestore but keeps concurrent tests deterministic.
+# latency_ms adds a round trip to every read, query, get_all and commit, for latency benchmarks.
+
+_ID_CHARS = string.ascii_letters + string.digits
+_MISSING = object()
+
+
+def _auto_id() -> str:
+    return "".join(random.choice(_ID_CHARS) for _ in range(20))
+
+
+def _lookup(data, field_path: str):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _assign(data, parts, value):
+    target = data
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    if value is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+        return
+    current = target.get(parts[-1])
+    if isinstance(value, transforms.Increment):
+        value = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        existing = list(current) if isinstance(current, list) else []
+        value = existing + [item for item in value.values if item not in existing]
+    elif isinstance(value, transforms.ArrayRemove):
+        existing = list(current) if isinstance(current, list) else []
+        value = [item for item in existing if item not in value.values]
+    elif value is transforms.SERVER_TIMESTAMP:
+        value = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        value = copy.deepcopy(value)
+    target[parts[-1]] = value
+
+
+def _merge(current, data, dotted: bool):
+    # dotted=True is update() semantics: "a.b" keys address nested fields and map values
+    # replace the field. Otherwise maps merge recursively (set with merge=True).
+    result = copy.deepcopy(current) if current else {}
+    for key, value in data.items():
+        if dotted:
+            _assign(result, key.split("."), value)
+        elif isinstance(value, dict) and value:
+            existing = result.get(key)
+            result[key] = _merge(existing if isinstance(existing, dict) else None, value, False)
+        else:
+            _assign(result, [key], value)
+    return result
+
+
+def _compare(value, op: str, expected) -> bool:
+    if value is _MISSING:
+        return False
+    try:
+        if op == "==":
+            return value == expected
+        if op == "!=":
+            return value != expected and value is not None
+        if op == "<":
+            return value < expected
+        if op == "<=":
+            return value <= expected
+        if op == ">":
+            return value > expected
+        if op == ">=":
+            return value >= expected
+        if op == "in":
+            return value in expected
+        if op == "not-in":
+            return value not in expected
+        if op == "array_contains":
+            return isinstance(value, list) and expected in value
+        if op == "array_contains_any":
+            return isinstance(value, list) and any(item in value for item in expected)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _project(data, field_paths):
+    projected = {}
+    for field_path in field_paths:
+        value = _lookup(data, field_path)
+        if value is not _MISSING:
+            _assign(projected, field_path.split("."), value)
+    return projected
+
+
+class LocalSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        value = _lookup(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class LocalDocumentReference:
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, LocalDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return LocalCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str):
+        return LocalCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None, field_paths=None):
+        return self._client._read(self)
+
+    def set(self, data, merge=False):
+        self._client._write("set", self, data, merge)
+
+    def update(self, data):
+        self._client._write("update", self, data)
+
+    def create(self, data):
+        self._client._write("create", self, data)
+
+    def delete(self):
+        self._client._write("delete", self, None)
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("LocalFirestore does not support listeners")
+
+
+class LocalQuery:
+    def __init__(self, client, parent_path=None, group=None, filters=(), orders=(), limit=None,
+                 cursor=None, projection=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._group = group
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            "parent_path": self._parent_path,
+            "group": self._group,
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "projection": self._projection,
+        }
+        state.update(changes)
+        return LocalQuery(self._client, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, cursor):
+        if isinstance(cursor, LocalSnapshot):
+            cursor = {**(cursor.to_dict() or {}), "__name__": cursor.reference}
+        return self._copy(cursor=cursor)
+
+    def _matches(self, path: str, data) -> bool:
+        segments = path.split("/")
+        if self._group is not None:
+            if segments[-2] != self._group:
+                return False
+        elif path.rsplit("/", 1)[0] != self._parent_path:
+            return False
+        for field_path, op, expected in self._filters:
+            value = path if field_path == "__name__" else _lookup(data, field_path)
+            if isinstance(expected, LocalDocumentReference):
+                expected = expected.path
+            if not _compare(value, op, expected):
+                return False
+        return all(_lookup(data, field) is not _MISSING for field, _ in self._orders if field != "__name__")
+
+    def _sort_key(self, item):
+        path, data = item
+        key = []
+        for field, direction in self._orders:
+            value = path if field == "__name__" else _lookup(data, field)
+            key.append(_Ordered(value, direction == "DESCENDING"))
+        key.append(_Ordered(path, False))
+        return key
+
+    def _after_cursor(self, item) -> bool:
+        # Cursor values follow the explicit orders, then the implicit __name__ order.
+        path, data = item
+        position = []
+        bound = []
+        name_descending = False
+        for field, direction in self._orders:
+            descending = direction == "DESCENDING"
+            if field == "__name__":
+                name_descending = descending
+                continue
+            if field not in self._cursor:
+                break
+            position.append(_Ordered(_lookup(data, field), descending))
+            bound.append(_Ordered(self._cursor[field], descending))
+        else:
+            if "__name__" in self._cursor:
+                name = self._cursor["__name__"]
+                position.append(_Ordered(path, name_descending))
+                bound.append(_Ordered(getattr(name, "path", name), name_descending))
+        return position > bound
+
+    def stream(self, transaction=None):
+        return iter(self._client._query(self))
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class _Ordered:
+    def __init__(self, value, descending: bool):
+        self.value = value
+        self.descending = descending
+
+    def _rank(self):
+        value = self.value
+        if value is _MISSING or value is None:
+            return (0, 0)
+        if isinstance(value, bool):
+            return (1, value)
+        if isinstance(value, (int, float)):
+            return (2, value)
+        if isinstance(value, str):
+            return (3, value)
+        return (4, repr(value))
+
+    def __lt__(self, other):
+        if self.descending:
+            return other._rank() < self._rank()
+        return self._rank() < other._rank()
+
+    def __gt__(self, other):
+        return other < self
+
+    def __eq__(self, other):
+        return self._rank() == other._rank()
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, client, path: str):
+        super().__init__(client, parent_path=path)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        if "/" not in self.path:
+            return None
+        return LocalDocumentReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def document(self, document_id=None):
+        return LocalDocumentReference(self._client, f"{self.path}/{document_id or _auto_id()}")
+
+    def add(self, data, document_id=None):
+        reference = self.document(document_id)
+        reference.set(data)
+        return None, reference
+
+
+class LocalWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._round_trip()
+        with self._client._lock:
+            for method, reference, data, merge in writes:
+                self._client._write(method, reference, data, merge)
+        return writes
+
+
+class LocalTransaction(LocalWriteBatch):
+    # Just enough of the Transaction protocol for firestore.transactional.
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._transaction_lock.acquire()
+        self._id = _auto_id().encode()
+
+    def _rollback(self):
+        if self._id is not None:
+            self._writes = []
+            self._id = None
+            self._client._transaction_lock.release()
+
+    def _commit(self):
+        try:
+            return self.commit()
+        finally:
+            self._id = None
+            self._client._transaction_lock.release()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, LocalDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+class LocalFirestore:
+    def __init__(self, docs=None, latency_ms: float = 0):
+        self.docs = copy.deepcopy(docs or {})
+        self.latency_ms = latency_ms
+        self.ops = Counter()
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.Lock()
+
+    def collection(self, path: str):
+        return LocalCollectionReference(self, path)
+
+    def document(self, path: str):
+        return LocalDocumentReference(self, path)
+
+    def collection_group(self, name: str):
+        return LocalQuery(self, group=name)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return LocalTransaction(self)
+
+    def get_all(self, references, transaction=None):
+        self._round_trip()
+        return iter([self._read(reference, round_trip=False) for reference in references])
+
+    def _round_trip(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def _read(self, reference, round_trip=True):
+        if round_trip:
+            self._round_trip()
+        with self._lock:
+            self.ops["reads"] += 1
+            return LocalSnapshot(reference, copy.deepcopy(self.docs.get(reference.path)))
+
+    def _query(self, query):
+        self._round_trip()
+        with self._lock:
+            items = [(path, data) for path, data in self.docs.items() if query._matches(path, data)]
+            items.sort(key=query._sort_key)
+            if query._cursor is not None:
+                items = [item for item in items if query._after_cursor(item)]
+            if query._limit is not None:
+                items = items[: query._limit]
+            # Firestore bills a query that returns nothing as one read.
+            self.ops["reads"] += max(len(items), 1)
+            self.ops["queries"] += 1
+            return [
+                LocalSnapshot(
+                    LocalDocumentReference(self, path),
+                    copy.deepcopy(data if query._projection is None else _project(data, query._projection)),
+                )
+                for path, data in items
+            ]
+
+    def _write(self, method: str, reference, data, merge=False):
+        with self._lock:
+            path = reference.path
+            current = self.docs.get(path)
+            if method == "delete":
+                self.ops["deletes"] += 1
+                self.docs.pop(path, None)
+                return
+            if method == "update" and current is None:
+                raise exceptions.NotFound(f"No document to update: {path}")
+            if method == "create" and current is not None:
+                raise exceptions.Conflict(f"Document already exists: {path}")
+            self.ops["writes"] += 1
+            if method == "update":
+                self.docs[path] = _merge(current, data, dotted=True)
+            elif merge:
+                self.docs[path] = _merge(current, data, dotted=False)
+            else:
+                self.docs[path] = _merge(None, data, dotted=False)
@@ -0,0 +1,219 @@
+# OpenAI-compatible stand-in for a local inference server, for tests, benchmarks and
+# offline development of the provider failover path:
+#
+#     python -m local_inference --port 8081 --ttft-ms 400
+#     python -m local_inference --port 8081 --cassette benchmarks/data/replay_cassette.jsonl
+#
+# then LOCAL_LLM_URL=http://127.0.0.1:8081/v1/chat/completions. Streams keepalive
+# comments while "thinking", the way OpenRouter does, so TTFT deadlines are exercised
+# on a live connection rather than a silent socket.
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cassettes import Cassette
+
+DEFAULT_REPLY = "Primary diagnosis: worn ignition coil. Swap coils between cylinders to confirm."
+KEEPALIVE_MS = 250
+PREFIX_BLOCK_TOKENS = 16
+
+
+def _prompt_words(payload):
+    return [word for message in payload.get("messages") or [] for word in str(message.get("content") or "").split()]
+
+
+def _prompt_tokens(payload) -> int:
+    return len(_prompt_words(payload))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connects under a wide fan-out, and each dropped SYN
+    # is retried a second later.
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients drop pooled connections after closing a stream early; that is not an error.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class LocalInferenceServer:
+    # reply may be a callable taking the request payload. prefill_tps adds prompt-length
+    # dependent time to first token, like a real server's prefill. prefix_cache_blocks > 0
+    # keeps an LRU of that many PREFIX_BLOCK_TOKENS-word prompt blocks per model, and only
+    # uncached tokens are prefilled, like vLLM's automatic prefix caching.
+    def __init__(self, reply=DEFAULT_REPLY, ttft_ms: float = 0, gap_ms: float = 0,
+                 status: int = 200, cassette=None, host: str = "127.0.0.1", port: int = 0,
+                 prefill_tps: float = 0, prefix_cache_blocks: int = 0):
+        self.reply = reply
+        self.ttft_ms = ttft_ms
+        self.prefill_tps = prefill_tps
+        self.prefix_cache_blocks = prefix_cache_blocks
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._prefix_cache = OrderedDict()
+        self.gap_ms = gap_ms
+        self.status = status
+        self.cassette = cassette
+        self.requests = []
+        # Streams still being written; drops as soon as a client hangs up mid-stream.
+        self.active_streams = 0
+        self._lock = threading.Lock()
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self._server = _Server(self._address, _handler(self))
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _lines(self, payload):
+        if self.cassette is not None:
+            yield from self.cassette.replay(payload, stream=True).iter_lines(decode_unicode=True)
+            return
+        started = time.perf_counter()
+        ttft_ms = self._ttft_ms(payload)
+        while (time.perf_counter() - started) * 1000 < ttft_ms:
+            yield ": LOCAL PROCESSING"
+            time.sleep(min(KEEPALIVE_MS, ttft_ms) / 1000)
+        words = self._reply(payload).split(" ")
+        for index, word in enumerate(words):
+            piece = word if index == len(words) - 1 else word + " "
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": piece}}]})
+            time.sleep(self.gap_ms / 1000)
+        usage = {"prompt_tokens": 0, "completion_tokens": len(words)}
+        yield "data: " + json.dumps({"choices": [{"delta": {}}], "usage": usage})
+        yield "data: [DONE]"
+
+    def _body(self, payload) -> dict:
+        if self.cassette is not None:
+            return self.cassette.replay(payload).json()
+        time.sleep(self._ttft_ms(payload) / 1000)
+        return {"choices": [{"message": {"role": "assistant", "content": self._reply(payload)}}]}
+
+    def _reply(self, payload) -> str:
+        return self.reply(payload) if callable(self.reply) else self.reply
+
+    def _ttft_ms(self, payload) -> float:
+        if not self.prefill_tps:
+            return self.ttft_ms
+        return self.ttft_ms + self._prefill_tokens(payload) / self.prefill_tps * 1000
+
+    def _prefill_tokens(self, payload) -> int:
+        words = _prompt_words(payload)
+        cached = 0
+        with self._lock:
+            if self.prefix_cache_blocks:
+                key = payload.get("model")
+                hit = True
+                for start in range(0, len(words) - PREFIX_BLOCK_TOKENS + 1, PREFIX_BLOCK_TOKENS):
+                    key = hash((key, tuple(words[start : start + PREFIX_BLOCK_TOKENS])))
+                    if hit and key in self._prefix_cache:
+                        cached += PREFIX_BLOCK_TOKENS
+                        self._prefix_cache.move_to_end(key)
+                        continue
+                    hit = False
+                    self._prefix_cache[key] = True
+                    if len(self._prefix_cache) > self.prefix_cache_blocks:
+                        self._prefix_cache.popitem(last=False)
+            self.prompt_tokens += len(words)
+            self.cached_tokens += cached
+        return len(words) - cached
+
+
+def _handler(stand_in: LocalInferenceServer):
+    class Handler(BaseHTTPRequestHandler):
+        # Chunked like the real APIs, so clients see each event as soon as it is sent.
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            stand_in.requests.append(payload)
+            if stand_in.status != 200:
+                self.send_error(stand_in.status)
+                return
+            try:
+                if payload.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    with stand_in._lock:
+                        stand_in.active_streams += 1
+                    try:
+                        for line in stand_in._lines(payload):
+                            self._write_chunk(f"{line}\n\n".encode("utf-8"))
+                        self._write_chunk(b"")
+                    finally:
+                        with stand_in._lock:
+                            stand_in.active_streams -= 1
+                else:
+                    body = json.dumps(stand_in._body(payload)).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client failed over or cancelled; nothing left to send.
+                pass
+
+    return Handler
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m local_inference")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--ttft-ms", type=float, default=0)
+    parser.add_argument("--gap-ms", type=float, default=0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--cassette", help="replay a recorded cassette instead of --reply")
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    cassette = Cassette(args.cassette, "replay", args.speed) if args.cassette else None
+    server = LocalInferenceServer(
+        args.reply, args.ttft_ms, args.gap_ms, cassette=cassette, host=args.host, port=args.port
+    ).start()
+    print(f"local inference: {server.url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    run()
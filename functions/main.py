@@ -1,20 +1,77 @@
+import itertools
 import json
 import os
+import random
 import re
 import time
 import logging
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from threading import Event, Lock, Timer
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from functools import lru_cache
-from typing import Any
 
 import requests
-from firebase_admin import initialize_app, firestore
-from firebase_functions import https_fn, firestore_fn
+from firebase_admin import firestore, get_app, initialize_app
+from firebase_functions import https_fn, firestore_fn, scheduler_fn
+
+from backfill import BackfillJob
+from bracket import run_bracket
+from cancellation import Cancelled, cancel_local, cancellation_scope, interrupt
+from case_history import CASE_INDEX_COLLECTION, apply_case, case_record, format_cases, search
+from cassettes import cassette_from_env
+from consensus import build_judgement, candidate_record, find_consensus
+from enrichment import (
+    enrichment_messages,
+    existing_replacements,
+    extract_user_vehicle_text,
+    normalize_vehicle_text,
+    open_metadata_fields,
+    parse_enrichment,
+)
+from enrichment_queue import EnrichmentQueue, apply_car_enrichment
+from fleet import BatchProgress, create_records, normalize_items, prefix_order
+from garage import MAX_DIAGNOSTICS_PER_CAR, MAX_PAGE_SIZE, GarageCache, decode_cursor, load_garage
+from intake import apply_intake_entry, intake_entry, intake_updates
+from judge_input import build_judge_prompt, estimate_tokens
+from metrics import METRICS
+from priors import (
+    PRIORS_COLLECTION,
+    apply_prior,
+    format_priors,
+    group_from_doc_id,
+    prior_doc_ids,
+    prior_title,
+    top_priors,
+    vehicle_group,
+)
+from profiling import SamplingProfiler, carry, run_profiled, store_from_env
+from providers import TTFTDeadlineExceeded, retryable, router_from_env
+from response_formats import (
+    FANOUT_FORMAT,
+    INTAKE_QUESTIONS_FORMAT,
+    JUDGEMENT_FORMAT,
+    SUFFICIENCY_FORMAT,
+    vehicle_enrichment_response_format,
+)
+from stream_json import StreamingJsonArrayParser, parse_json_content
+from transcripts import apply_message_write, load_transcript, run_compaction
+from vehicle_index import (
+    CATALOG_LEVELS,
+    LEVEL_SELECTION_KEYS,
+    VehicleIndex,
+    catalog_key_from_path,
+)
+from vin_decoder import decode_vin, normalize_vin
 
 logger = logging.getLogger("carllm")
 
-initialize_app()
+
+# The callable wrappers verify ID tokens against the default app before a handler runs,
+# so it has to exist at import. The Firestore trigger wrapper may have created it already.
+try:
+    get_app()
+except ValueError:
+    initialize_app()
 
 
 @lru_cache(maxsize=1)
@@ -23,6 +80,22 @@ def _get_db():
     return firestore.client()
 
 REQUEST_TIMEOUT = 360
+# Shared across invocations on a warm instance and across requests in server mode.
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+# Streamed assistant messages get at most one interim write per interval, and at most
+# STREAM_WRITE_BUDGET of them; the final write always lands. Every write to a message
+# invokes maintain_chat_transcript and maintain_intake_state, so a streamed answer costs
+# about 2 x (STREAM_WRITE_BUDGET + 2) trigger invocations. The interval grows by
+# STREAM_INTERVAL_GROWTH after each write: the first words show within a second and the
+# budget still spreads over about 55 s of a long answer, at the price of coarser updates.
+STREAM_MIN_INTERVAL_SECONDS = float(os.environ.get("STREAM_MIN_INTERVAL_SECONDS", "1.0"))
+STREAM_INTERVAL_GROWTH = float(os.environ.get("STREAM_INTERVAL_GROWTH", "1.3"))
+STREAM_WRITE_BUDGET = int(os.environ.get("STREAM_WRITE_BUDGET", "12"))
+# How often a running fan-out or chat reply checks its chat for a cancel from another instance.
+CANCEL_POLL_SECONDS = float(os.environ.get("CANCEL_POLL_SECONDS", "1.0"))
+# Share of callable invocations profiled without being asked; admins can pass {"profile": true}.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
 
 FOLLOWUP_MODEL = "google/gemini-3-flash-preview"
 CHAT_MODEL = "google/gemini-3-flash-preview"
@@ -33,6 +106,89 @@ FANOUT_MODELS = [
 ]
 AGGREGATOR_MODEL = "google/gemini-3-pro-preview"
 
+QUESTION_SYSTEM_PROMPT = (
+    "You are an automotive diagnostic assistant. Ask concise, high-signal follow-up "
+    "questions to clarify symptoms. Always ask for mileage if it was not provided. "
+    "Ask 3-6 questions max. When common failures for similar vehicles are listed, "
+    "prefer questions that tell them apart."
+)
+
+SUFFICIENCY_SYSTEM_PROMPT = (
+    "You are a master automotive diagnostician. Decide if the intake provides "
+    "enough information to confidently choose a single diagnosis. Only say it is "
+    "sufficient when you are very confident. If insufficient, ask 3-6 more focused "
+    "questions, one question per item. Common failures for similar vehicles, when "
+    "listed, are base rates: use them to pick questions, not as evidence."
+)
+
+FANOUT_SYSTEM_PROMPT = (
+    "You are an automotive diagnostic assistant. Return JSON with "
+    "`primary_diagnosis` (a short title), `root_causes` (most likely first), "
+    "`next_checks` (the next 2-3 checks to confirm), `confidence` (0 to 1) and "
+    "`explanation` (two to four sentences for the owner). Be specific and brief."
+)
+
+JUDGE_SYSTEM_PROMPT = (
+    "You are a master automotive diagnostician. Review the candidate diagnoses and "
+    "select the most accurate given the intake data. Return JSON with keys "
+    "`model_name`, `diagnostic_answer`, `justifacation`, and `explanation`. "
+    "`diagnostic_answer` must be a short title only (no full explanation). "
+    "`justifacation` must be an array of brief bullet-point strings."
+)
+
+CHAT_SYSTEM_PROMPT = (
+    "You are an automotive diagnostic assistant. Use the full conversation "
+    "context and answer the latest user question clearly and concisely."
+)
+
+SUFFICIENCY_THRESHOLD = 0.85
+# Fast tiers run first; a verdict within the band of the threshold escalates.
+SUFFICIENCY_TIERS = [FOLLOWUP_MODEL, AGGREGATOR_MODEL]
+SUFFICIENCY_ESCALATION_BAND = float(os.environ.get("SUFFICIENCY_ESCALATION_BAND", "0.1"))
+
+# When this share of fan-out candidates names the same failure, skip the judge call.
+CONSENSUS_ENABLED = os.environ.get("CONSENSUS_ENABLED", "1") != "0"
+FANOUT_POOL_SIZE = int(os.environ.get("FANOUT_POOL_SIZE", str(len(FANOUT_MODELS) * 4)))
+CONSENSUS_SUPERMAJORITY = 2 / 3
+CONSENSUS_MIN_SIMILARITY = 0.5
+# Each candidate reaches the judge as a compact record of at most this many tokens.
+JUDGE_CANDIDATE_TOKEN_CAP = int(os.environ.get("JUDGE_CANDIDATE_TOKEN_CAP", "120"))
+# With more candidates than this, groups are judged in parallel and only the group
+# winners reach the final judge (strategy "rank").
+JUDGE_GROUP_SIZE = int(os.environ.get("JUDGE_GROUP_SIZE", "4"))
+# batch_diagnose: items per call, and items diagnosed at once per instance. Upstream
+# streams are bounded by BATCH_CONCURRENCY (sufficiency, judge) + FANOUT_POOL_SIZE.
+# An item (sufficiency, fan-out, judge) can take a few minutes with reasoning models, so
+# a full batch is two waves. Items still running when BATCH_TIME_BUDGET_SECONDS is up are
+# cut short and items not yet started are skipped, both as "timed_out", leaving the rest of
+# the 540 s function timeout for the writes.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "16"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_TIME_BUDGET_SECONDS = float(os.environ.get("BATCH_TIME_BUDGET_SECONDS", "450"))
+# Prior cases of the same car added to intake and fan-out prompts. A lookup that misses
+# CASE_RETRIEVAL_BUDGET_MS is dropped rather than delaying the call.
+CASE_RETRIEVAL_TOP_K = int(os.environ.get("CASE_RETRIEVAL_TOP_K", "3"))
+CASE_RETRIEVAL_BUDGET_MS = float(os.environ.get("CASE_RETRIEVAL_BUDGET_MS", "150"))
+# Failure priors of the vehicle group added to the intake and sufficiency prompts; the
+# engine-level group is used once it has PRIOR_MIN_SUPPORT diagnoses.
+PRIOR_TOP_K = int(os.environ.get("PRIOR_TOP_K", "5"))
+PRIOR_MIN_SUPPORT = int(os.environ.get("PRIOR_MIN_SUPPORT", "5"))
+PRIOR_CACHE_SECONDS = 300
+# list_garage: cars per page, latest diagnostics per car, and how long a user's pages are
+# served from this instance's cache.
+GARAGE_PAGE_SIZE = int(os.environ.get("GARAGE_PAGE_SIZE", "20"))
+GARAGE_DIAGNOSTICS_PER_CAR = int(os.environ.get("GARAGE_DIAGNOSTICS_PER_CAR", "3"))
+GARAGE_CACHE_SECONDS = float(os.environ.get("GARAGE_CACHE_SECONDS", "10"))
+
+ENRICHMENT_MODEL = AGGREGATOR_MODEL
+BACKFILL_MODEL = ENRICHMENT_MODEL
+BACKFILL_TIME_BUDGET_SECONDS = 480
+COMPACTION_TIME_BUDGET_SECONDS = 480
+
+CATALOG_REFRESH_SECONDS = 60
+CATALOG_REBUILD_SECONDS = 3600
+CATALOG_SEARCH_LIMIT = 20
+
 
 class ProgressTracker:
     def __init__(self, ref, min_interval: float = 1.0):
@@ -58,16 +214,235 @@ class ProgressTracker:
         self._ref.update({"tokensReceived": firestore.Increment(to_flush)})
 
 
+class StreamingMessageWriter:
+    # Writes partial assistant content to one message doc at most once per interval, and
+    # at most max_writes times before the final write so long streams stay within
+    # Firestore's sustained per-document write rate and the message triggers fire a
+    # bounded number of times. The interval is multiplied by growth after each write.
+    # Content passed as a callable is only rendered when a write is actually due.
+    def __init__(
+        self,
+        message_ref,
+        base_doc,
+        min_interval: float = STREAM_MIN_INTERVAL_SECONDS,
+        max_writes: int = STREAM_WRITE_BUDGET,
+        growth: float = STREAM_INTERVAL_GROWTH,
+    ):
+        self._ref = message_ref
+        self._base_doc = base_doc
+        self._min_interval = min_interval
+        self._growth = growth
+        self._max_writes = max_writes
+        self._lock = Lock()
+        self._created = False
+        self._closed = False
+        self._pending = None
+        self._parts = []
+        self._writes = 0
+        self._last_update = 0.0
+
+    @property
+    def id(self) -> str:
+        return self._ref.id
+
+    def start(self):
+        # Creates the placeholder up front so clients can show it before the first token.
+        with self._lock:
+            if self._created or self._closed:
+                return
+            self._created = True
+        self._ref.set(
+            {**self._base_doc, "content": "", "status": "streaming", "createdAt": _now_ms()}
+        )
+
+    def append(self, delta: str):
+        if not delta:
+            return
+        with self._lock:
+            self._parts.append(delta)
+        self.update(self._joined)
+
+    def _joined(self) -> str:
+        with self._lock:
+            return "".join(self._parts)
+
+    def update(self, content, force: bool = False):
+        with self._lock:
+            if self._closed:
+                return
+            self._pending = content
+            now = time.time()
+            if not force and (
+                (now - self._last_update) < self._min_interval * self._growth ** max(self._writes - 1, 0)
+                or self._writes >= self._max_writes
+            ):
+                return
+            pending = self._pending
+            self._pending = None
+        to_write = pending() if callable(pending) else pending
+        if to_write is None:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._last_update = now
+            self._writes += 1
+            created = self._created
+            self._created = True
+        if created:
+            self._ref.update({"content": to_write})
+        else:
+            self._ref.set(
+                {
+                    **self._base_doc,
+                    "content": to_write,
+                    "status": "streaming",
+                    "createdAt": _now_ms(),
+                }
+            )
+
+    def finalize(self, content: str, batch=None, metadata=None):
+        # Pass a batch to land the final content in the same commit as the chat update.
+        with self._lock:
+            self._closed = True
+            created = self._created
+        if created:
+            data = {"content": content, "status": "complete"}
+            data.update({f"metadata.{key}": value for key, value in (metadata or {}).items()})
+            if batch is not None:
+                batch.update(self._ref, data)
+            else:
+                self._ref.update(data)
+            return
+        base_metadata = self._base_doc.get("metadata") or {}
+        data = {
+            **self._base_doc,
+            "content": content,
+            "status": "complete",
+            "createdAt": _now_ms(),
+        }
+        if metadata:
+            data["metadata"] = {**base_metadata, **metadata}
+        if batch is not None:
+            batch.set(self._ref, data)
+        else:
+            self._ref.set(data)
+
+    def discard(self):
+        with self._lock:
+            self._closed = True
+            created = self._created
+        if created:
+            self._ref.delete()
+
+
 def _now_ms() -> int:
     return int(time.time() * 1000)
 
 
+@lru_cache(maxsize=1)
+def _http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@lru_cache(maxsize=1)
+def _fanout_executor():
+    # Bounded and shared, so concurrent diagnoses queue instead of spawning threads.
+    return ThreadPoolExecutor(max_workers=FANOUT_POOL_SIZE, thread_name_prefix="fanout")
+
+
+@lru_cache(maxsize=1)
+def _batch_executor():
+    # Separate from the fan-out pool so a batch item never waits on a slot its own
+    # fan-out needs.
+    return ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+
+@lru_cache(maxsize=1)
+def _garage_executor():
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="garage")
+
+
+@lru_cache(maxsize=1)
+def _retrieval_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+
+# Every process-wide pool, in shutdown order: batch items still submit to the fan-out pool.
+_EXECUTORS = (_batch_executor, _fanout_executor, _garage_executor, _retrieval_executor)
+
+
+def shared_executors() -> list:
+    # The pools created so far; server shutdown drains each of them.
+    return [factory() for factory in _EXECUTORS if factory.cache_info().currsize]
+
+
+@lru_cache(maxsize=1)
+def _cassette():
+    # Set OPENROUTER_CASSETTE_MODE=record|replay to capture or replay OpenRouter traffic.
+    return cassette_from_env()
+
+
+@lru_cache(maxsize=1)
+def _profile_store():
+    # PROFILE_DIR chooses where profiles land; a temp directory by default.
+    return store_from_env()
+
+
+@lru_cache(maxsize=1)
+def _provider_router():
+    # PROVIDERS_CONFIG / LOCAL_LLM_URL choose the endpoints; OpenRouter alone by default.
+    return router_from_env()
+
+
+def _post_completion(target, api_key: str, payload, stream: bool = False, read_timeout=REQUEST_TIMEOUT):
+    name = target.endpoint.name
+    METRICS.increment(f"provider.{name}.requests")
+    started = time.perf_counter()
+    cassette = _cassette()
+    if cassette is not None and cassette.replaying:
+        return cassette.replay(payload, stream)
+    response = None
+    try:
+        response = _http_session().post(
+            target.endpoint.url,
+            headers=target.endpoint.headers(api_key),
+            json=payload,
+            stream=stream,
+            timeout=(_provider_router().connect_timeout, read_timeout),
+        )
+        response.raise_for_status()
+    except requests.RequestException:
+        METRICS.increment(f"provider.{name}.errors")
+        if response is not None:
+            response.close()
+        raise
+    METRICS.observe(f"provider.{name}.response_ms", (time.perf_counter() - started) * 1000)
+    if cassette is not None:
+        return cassette.record(payload, response, started)
+    return response
+
+
+def _fail_over(router, target, exc: Exception):
+    router.mark_failed(target.endpoint)
+    METRICS.increment("provider.failovers")
+    logger.warning(
+        "provider: failing over",
+        extra={"endpoint": target.endpoint.name, "model": target.model, "error": str(exc)},
+    )
+
+
 def _call_openrouter(
     api_key: str,
     model: str,
     messages,
     temperature: float = 0.3,
     response_format=None,
+    role=None,
 ) -> str:
     payload = {
         "model": model,
@@ -77,19 +452,119 @@ def _call_openrouter(
     if response_format:
         payload["response_format"] = response_format
 
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        json=payload,
-        timeout=REQUEST_TIMEOUT,
-    )
-    response.raise_for_status()
-    data = response.json()
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    return (content or "").strip()
+    router = _provider_router()
+    last_error = None
+    for target in router.candidates(model, role):
+        try:
+            response = _post_completion(target, api_key, {**payload, "model": target.model})
+            data = response.json()
+        except requests.RequestException as exc:
+            if not retryable(exc):
+                raise
+            _fail_over(router, target, exc)
+            last_error = exc
+            continue
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return (content or "").strip()
+    raise last_error
+
+
+def _sse_delta(line: str) -> str:
+    if not line or not line.startswith("data:"):
+        return ""
+    try:
+        chunk = json.loads(line[len("data:") :].strip())
+    except json.JSONDecodeError:
+        return ""
+    if not isinstance(chunk, dict):
+        return ""
+    return chunk.get("choices", [{}])[0].get("delta", {}).get("content", "") or ""
+
+
+def _restore_read_timeout(response):
+    # The TTFT deadline is the socket timeout only until the response headers arrive;
+    # later chunks get the usual REQUEST_TIMEOUT.
+    sock = getattr(getattr(getattr(response, "raw", None), "_connection", None), "sock", None)
+    if sock is not None:
+        sock.settimeout(REQUEST_TIMEOUT)
+
+
+def _open_stream(api_key: str, payload, role=None, cancellation=None):
+    # Returns (response, lines) once the first content delta has arrived. Until
+    # then a connect error, retryable status or missed TTFT deadline moves on to the next
+    # endpoint; after it, errors surface to the caller since deltas were already used.
+    # The deadline only applies when there is a next endpoint: the last (or only) one
+    # gets REQUEST_TIMEOUT, since slow reasoning models are better late than failed.
+    # The deadline is wall-clock: a watchdog closes a silent stream when it passes.
+    # The response is attached to cancellation, so a cancel interrupts the wait too.
+    router = _provider_router()
+    deadline = router.ttft_deadline_ms / 1000
+    candidates = router.candidates(payload["model"], role)
+    last_error = None
+    for position, target in enumerate(candidates):
+        enforce = position < len(candidates) - 1
+        started = time.perf_counter()
+        response = None
+        watchdog = None
+        missed = Event()
+        try:
+            response = _post_completion(
+                target,
+                api_key,
+                {**payload, "model": target.model},
+                stream=True,
+                read_timeout=deadline if enforce else REQUEST_TIMEOUT,
+            )
+            if cancellation is not None:
+                cancellation.attach(response)
+            if enforce:
+                _restore_read_timeout(response)
+
+                def expire(response=response):
+                    missed.set()
+                    interrupt(response)
+
+                watchdog = Timer(max(0.0, deadline - (time.perf_counter() - started)), expire)
+                watchdog.daemon = True
+                watchdog.start()
+            lines = response.iter_lines(decode_unicode=True)
+            head = []
+            for line in lines:
+                head.append(line)
+                if _sse_delta(line):
+                    if watchdog is not None:
+                        watchdog.cancel()
+                        if missed.is_set():
+                            raise TTFTDeadlineExceeded("deadline passed with the first delta")
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    router.observe_ttft(target.endpoint, ttft_ms)
+                    METRICS.observe(f"provider.{target.endpoint.name}.ttft_ms", ttft_ms)
+                    return response, itertools.chain(head, lines)
+                if enforce and time.perf_counter() - started > deadline:
+                    raise TTFTDeadlineExceeded("deadline passed")
+            if watchdog is not None:
+                watchdog.cancel()
+            if missed.is_set():
+                raise TTFTDeadlineExceeded("deadline passed")
+            return response, iter(head)
+        except Exception as exc:
+            if watchdog is not None:
+                watchdog.cancel()
+            if missed.is_set() or isinstance(exc, TTFTDeadlineExceeded):
+                exc = TTFTDeadlineExceeded(
+                    f"{target.endpoint.name} sent no content within {router.ttft_deadline_ms:.0f} ms"
+                )
+            if response is not None:
+                if cancellation is not None:
+                    cancellation.detach(response)
+                response.close()
+            if cancellation is not None and cancellation.cancelled:
+                raise Cancelled("Generation cancelled") from None
+            if not isinstance(exc, requests.RequestException) or not retryable(exc):
+                raise exc
+            _fail_over(router, target, exc)
+            last_error = exc
+    raise last_error
 
 
 def _estimate_tokens(text: str) -> int:
@@ -105,6 +580,9 @@ def _call_openrouter_stream(
     temperature: float = 0.3,
     response_format=None,
     progress_tracker=None,
+    on_delta=None,
+    role=None,
+    cancellation=None,
 ):
     payload = {
         "model": model,
@@ -115,50 +593,57 @@ def _call_openrouter_stream(
     if response_format:
         payload["response_format"] = response_format
 
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        json=payload,
-        stream=True,
-        timeout=REQUEST_TIMEOUT,
-    )
-    response.raise_for_status()
+    if cancellation is not None:
+        cancellation.check()
+    response, lines = _open_stream(api_key, payload, role, cancellation)
 
     content_parts = []
     tokens_received = 0
     usage_info = None
 
-    for line in response.iter_lines(decode_unicode=True):
-        if not line:
-            continue
-        if line.startswith(":"):
-            continue
-        if not line.startswith("data:"):
-            continue
-        data_str = line[len("data:") :].strip()
-        if data_str == "[DONE]":
-            break
-        try:
-            chunk = json.loads(data_str)
-        except json.JSONDecodeError:
-            continue
-        usage_chunk = chunk.get("usage")
-        if isinstance(usage_chunk, dict):
-            usage_info = usage_chunk
-        delta = (
-            chunk.get("choices", [{}])[0]
-            .get("delta", {})
-            .get("content", "")
-        )
-        if delta:
-            content_parts.append(delta)
-            delta_tokens = _estimate_tokens(delta)
-            tokens_received += delta_tokens
-            if progress_tracker and delta_tokens:
-                progress_tracker.add(delta_tokens)
+    try:
+        for line in lines:
+            if not line:
+                continue
+            if line.startswith(":"):
+                continue
+            if not line.startswith("data:"):
+                continue
+            data_str = line[len("data:") :].strip()
+            if data_str == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            usage_chunk = chunk.get("usage")
+            if isinstance(usage_chunk, dict):
+                usage_info = usage_chunk
+            delta = (
+                chunk.get("choices", [{}])[0]
+                .get("delta", {})
+                .get("content", "")
+            )
+            if delta:
+                content_parts.append(delta)
+                delta_tokens = _estimate_tokens(delta)
+                tokens_received += delta_tokens
+                if progress_tracker and delta_tokens:
+                    progress_tracker.add(delta_tokens)
+                if on_delta:
+                    on_delta(delta)
+    except Exception:
+        # A cancel shuts the socket down under the read; report it as the cancel it is.
+        if cancellation is not None and cancellation.cancelled:
+            raise Cancelled("Generation cancelled") from None
+        raise
+    finally:
+        # Returns the connection to the pool even when the caller stops early.
+        if cancellation is not None:
+            cancellation.detach(response)
+        response.close()
+    if cancellation is not None:
+        cancellation.check()
 
     content = "".join(content_parts).strip()
     if progress_tracker:
@@ -180,6 +665,57 @@ def _require_auth(request) -> str:
     return request.auth.uid
 
 
+def _require_admin(request) -> str:
+    uid = _require_auth(request)
+    if (request.auth.token or {}).get("admin") is not True:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.PERMISSION_DENIED,
+            "Forbidden",
+        )
+    return uid
+
+
+def _profile_requested(request) -> bool:
+    token = (request.auth.token or {}) if request.auth is not None else {}
+    if (request.data or {}).get("profile") and token.get("admin") is True:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profiled(handler):
+    # Samples the whole invocation, fan-out workers included, when a profile was asked for
+    # or drawn; otherwise calls straight through. __wrapped__ is left unset on purpose so
+    # inspect.unwrap() in tests and benchmarks still goes through this wrapper.
+    def wrapper(request):
+        if not _profile_requested(request):
+            return handler(request)
+        chat_id = (request.data or {}).get("chatId")
+        profile = SamplingProfiler(handler.__name__, {"chatId": chat_id}, PROFILE_INTERVAL_MS)
+        try:
+            return run_profiled(profile, handler, request)
+        finally:
+            try:
+                path = _profile_store().write(profile)
+            except OSError:
+                logger.exception("profile: write failed", extra={"chatId": chat_id})
+            else:
+                METRICS.increment("profile.written")
+                logger.info(
+                    "profile: written",
+                    extra={
+                        "chatId": chat_id,
+                        "stage": profile.stage,
+                        "path": path,
+                        "wallMs": int(profile.wall_ms),
+                    },
+                )
+
+    wrapper.__name__ = handler.__name__
+    wrapper.__qualname__ = handler.__qualname__
+    wrapper.__module__ = handler.__module__
+    return wrapper
+
+
 def _require_chat_owner(chat_ref, uid: str):
     chat_snapshot = chat_ref.get()
     if not chat_snapshot.exists:
@@ -196,6 +732,15 @@ def _require_chat_owner(chat_ref, uid: str):
     return chat_data
 
 
+def _car_context_lines(car_data) -> str:
+    return (
+        f"Year: {car_data.get('year', 'unknown')}\n"
+        f"Make: {car_data.get('make', 'unknown')}\n"
+        f"Model: {car_data.get('model', 'unknown')}\n"
+        f"Mileage: {car_data.get('mileage', 'unknown')}\n"
+    )
+
+
 def _fetch_car_data(car_id: str):
     if not car_id:
         return {}
@@ -204,14 +749,200 @@ def _fetch_car_data(car_id: str):
 
 
 def _load_messages(chat_ref):
-    messages = []
-    for snap in chat_ref.collection("messages").order_by("createdAt").stream():
+    # Transcript chunks cover compacted and live history in 1-3 reads; the tail query
+    # picks up messages whose transcript trigger has not run yet.
+    messages = load_transcript(chat_ref) or []
+    known = {message["id"] for message in messages}
+    query = chat_ref.collection("messages")
+    if messages:
+        since = messages[-1].get("createdAt") or 0
+        query = query.where(filter=firestore.FieldFilter("createdAt", ">=", since))
+    tail = False
+    for snap in query.order_by("createdAt").stream():
+        if snap.id in known:
+            continue
         data = snap.to_dict()
+        if data.get("status") == "streaming":
+            # Another reply still in flight; its partial content is not history yet.
+            continue
         data["id"] = snap.id
         messages.append(data)
+        tail = True
+    if tail and known:
+        messages.sort(key=lambda message: message.get("createdAt") or 0)
     return messages
 
 
+_sufficiency_stats_lock = Lock()
+_sufficiency_stats = {"escalations": 0, "agreements": 0}
+
+_catalog_lock = Lock()
+_catalog_state = {"index": None, "builtAt": 0.0, "refreshedAt": 0.0, "syncedThrough": 0}
+
+
+def _load_catalog_nodes(index: VehicleIndex, since: int = 0) -> int:
+    newest = since
+    for level in CATALOG_LEVELS:
+        query = _get_db().collection_group(level)
+        if since:
+            query = query.where(filter=firestore.FieldFilter("updatedAt", ">", since))
+        for snap in query.stream():
+            key = catalog_key_from_path(snap.reference.path)
+            if not key:
+                continue
+            data = snap.to_dict() or {}
+            index.upsert(key, data)
+            updated_at = data.get("updatedAt")
+            if isinstance(updated_at, (int, float)) and updated_at > newest:
+                newest = int(updated_at)
+    return newest
+
+
+def _get_vehicle_index() -> VehicleIndex:
+    # Deltas are picked up through updatedAt; a periodic full rebuild drops deleted nodes.
+    with _catalog_lock:
+        now = time.time()
+        state = _catalog_state
+        if state["index"] is None or now - state["builtAt"] >= CATALOG_REBUILD_SECONDS:
+            index = VehicleIndex()
+            state["syncedThrough"] = _load_catalog_nodes(index)
+            state["index"] = index
+            state["builtAt"] = now
+            state["refreshedAt"] = now
+            logger.info("catalog: index built", extra={"nodes": len(index)})
+        elif now - state["refreshedAt"] >= CATALOG_REFRESH_SECONDS:
+            state["syncedThrough"] = _load_catalog_nodes(
+                state["index"], since=state["syncedThrough"]
+            )
+            state["refreshedAt"] = now
+        return state["index"]
+
+
+def _catalog_selection(payload) -> tuple:
+    selection = []
+    for name in LEVEL_SELECTION_KEYS[:-1]:
+        value = payload.get(name)
+        if value is None or value == "":
+            break
+        selection.append(str(value))
+    return tuple(selection)
+
+
+def _sufficiency_decision(verdict, final: bool = True) -> str:
+    is_sufficient = bool(verdict.get("is_sufficient"))
+    confidence = verdict.get("confidence")
+    if not isinstance(confidence, (int, float)):
+        confidence = 0.0
+    leans_sufficient = confidence >= SUFFICIENCY_THRESHOLD
+    if not final and (
+        abs(confidence - SUFFICIENCY_THRESHOLD) <= SUFFICIENCY_ESCALATION_BAND
+        or is_sufficient != leans_sufficient
+    ):
+        return "escalate"
+    if is_sufficient and leans_sufficient:
+        return "sufficient"
+    return "insufficient"
+
+
+def _record_tier_agreement(fast_verdict, final_decision: str):
+    fast_lean = "sufficient" if _sufficiency_decision(fast_verdict) == "sufficient" else "insufficient"
+    with _sufficiency_stats_lock:
+        _sufficiency_stats["escalations"] += 1
+        if fast_lean == final_decision:
+            _sufficiency_stats["agreements"] += 1
+        escalations = _sufficiency_stats["escalations"]
+        agreements = _sufficiency_stats["agreements"]
+    logger.info(
+        "sufficiency: tier agreement",
+        extra={
+            "agree": fast_lean == final_decision,
+            "fastConfidence": fast_verdict.get("confidence"),
+            "finalDecision": final_decision,
+            "escalations": escalations,
+            "agreementRate": agreements / escalations,
+        },
+    )
+
+
+def _run_sufficiency_gate(
+    api_key: str, chat_ref, intake_text: str, progress_tracker, cancellation=None, priors_text: str = ""
+):
+    # Cheap tiers answer clear-cut intakes; borderline confidence escalates to the next tier.
+    fast_verdict = None
+    for tier, model in enumerate(SUFFICIENCY_TIERS):
+        final = tier == len(SUFFICIENCY_TIERS) - 1
+        stream = StreamingJsonArrayParser(("followup_questions",))
+        writer = StreamingMessageWriter(
+            chat_ref.collection("messages").document(),
+            {
+                "role": "assistant",
+                "promptType": "intake",
+                "source": "llm",
+                "metadata": {
+                    "model": model,
+                    "intakeStage": "followup_questions",
+                },
+            },
+        )
+
+        def publish_followups(delta, stream=stream, writer=writer, final=final):
+            if not stream.feed(delta):
+                return
+            # The schema orders the verdict first, so only publish once it says "ask more".
+            verdict = stream.values
+            if "is_sufficient" not in verdict or "confidence" not in verdict:
+                return
+            if _sufficiency_decision(verdict, final=final) == "insufficient":
+                writer.update(json.dumps({"questions": stream.items["followup_questions"]}))
+
+        started = time.perf_counter()
+        try:
+            raw, _ = _call_openrouter_stream(
+                api_key,
+                model,
+                [
+                    {"role": "system", "content": SUFFICIENCY_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"{intake_text}{priors_text}"},
+                ],
+                temperature=0.1,
+                response_format=SUFFICIENCY_FORMAT,
+                progress_tracker=progress_tracker,
+                on_delta=publish_followups,
+                role="aggregator" if model == AGGREGATOR_MODEL else "followup",
+                cancellation=cancellation,
+            )
+        except Cancelled:
+            writer.discard()
+            raise
+        except requests.RequestException:
+            writer.discard()
+            if final:
+                raise
+            logger.exception("sufficiency: tier failed, escalating", extra={"model": model})
+            continue
+        verdict = parse_json_content(raw) or stream.result() or {}
+        decision = _sufficiency_decision(verdict, final=final)
+        logger.info(
+            "sufficiency: tier verdict",
+            extra={
+                "tier": tier,
+                "model": model,
+                "latencyMs": int((time.perf_counter() - started) * 1000),
+                "confidence": verdict.get("confidence"),
+                "isSufficient": verdict.get("is_sufficient"),
+                "decision": decision,
+            },
+        )
+        if decision == "escalate":
+            writer.discard()
+            fast_verdict = fast_verdict or verdict
+            continue
+        if fast_verdict is not None:
+            _record_tier_agreement(fast_verdict, decision)
+        return decision, verdict, writer
+    raise RuntimeError("SUFFICIENCY_TIERS must end with a final tier")
+
+
 def _extract_intake_context(messages):
     initial = ""
     answers = []
@@ -236,7 +967,7 @@ def _extract_intake_context(messages):
         if intake_stage == "initial":
             initial = content
         elif intake_stage == "followup_answer":
-            parsed = _parse_json_content(content)
+            parsed = parse_json_content(content)
             if parsed and isinstance(parsed, dict) and isinstance(parsed.get("answers"), list):
                 for item in parsed["answers"]:
                     if isinstance(item, str) and item.strip():
@@ -253,7 +984,7 @@ def _extract_intake_context(messages):
         content = (msg.get("content") or "").strip()
         if not content:
             continue
-        parsed = _parse_json_content(content)
+        parsed = parse_json_content(content)
         if parsed and isinstance(parsed, dict) and isinstance(parsed.get("questions"), list):
             for item in parsed["questions"]:
                 if isinstance(item, str) and item.strip():
@@ -268,46 +999,199 @@ def _extract_intake_context(messages):
     }
 
 
-def _parse_json_content(content: str):
-    if not isinstance(content, str):
-        return None
-    trimmed = content.strip()
-    if not trimmed:
-        return None
-    if trimmed.startswith("```"):
-        lines = trimmed.split("\n")
-        lines.pop(0)
-        if lines and lines[-1].strip().startswith("```"):
-            lines.pop()
-        trimmed = "\n".join(lines).strip()
-    if not trimmed.startswith("{") or not trimmed.endswith("}"):
-        return None
+def _update_intake_state(diagnostic_ref, message_id: str, message):
+    # Transactional so concurrent intake messages for one case cannot drop each other.
+    entry = intake_entry(message)
+
+    @firestore.transactional
+    def apply(transaction):
+        snapshot = diagnostic_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict() or {}
+        intake_answers = apply_intake_entry(data.get("intakeAnswers"), message_id, entry)
+        if intake_answers is None:
+            return data.get("intakeAnswers")
+        transaction.update(
+            diagnostic_ref,
+            {**intake_updates(data, intake_answers), "updatedAt": _now_ms()},
+        )
+        return intake_answers
+
+    return apply(_get_db().transaction())
+
+
+def _load_intake_context(chat_ref, chat_data, message_id: str, message):
+    diagnostic_id = chat_data.get("diagnosticId")
+    if diagnostic_id:
+        diagnostic_ref = _get_db().collection("diagnostics").document(diagnostic_id)
+        snapshot = diagnostic_ref.get()
+        state = ((snapshot.to_dict() or {}).get("intakeAnswers") if snapshot.exists else None) or {}
+        if message_id not in (state.get("entries") or {}):
+            # The caller usually beats the trigger for the message it just wrote.
+            state = _update_intake_state(diagnostic_ref, message_id, message) or {}
+        if state.get("initial"):
+            return {
+                "initial": state["initial"],
+                "questions": list(state.get("questions") or []),
+                "answers": list(state.get("answers") or []),
+            }
+    # Cases created before intake state was maintained rebuild it from the transcript.
+    return _extract_intake_context(_load_messages(chat_ref))
+
+
+def _prior_cases(car_id: str, car_data, query: str, exclude_chat_id: str) -> list:
+    # Top CASE_RETRIEVAL_TOP_K earlier cases and replacements for the car, best first.
+    if not car_id or CASE_RETRIEVAL_TOP_K <= 0:
+        return []
+
+    def lookup():
+        snapshot = _get_db().collection(CASE_INDEX_COLLECTION).document(car_id).get()
+        return search(
+            snapshot.to_dict() if snapshot.exists else None,
+            query,
+            CASE_RETRIEVAL_TOP_K,
+            replacements=existing_replacements(car_data),
+            exclude=(exclude_chat_id,),
+        )
+
+    started = time.perf_counter()
+    future = _retrieval_executor().submit(carry(lookup))
     try:
-        return json.loads(trimmed)
-    except json.JSONDecodeError:
-        return None
+        hits = future.result(timeout=CASE_RETRIEVAL_BUDGET_MS / 1000)
+    except TimeoutError:
+        METRICS.increment("retrieval.timeout")
+        logger.warning(
+            "retrieval: over budget",
+            extra={"carId": car_id, "budgetMs": CASE_RETRIEVAL_BUDGET_MS},
+        )
+        return []
+    except Exception:
+        logger.exception("retrieval: lookup failed", extra={"carId": car_id})
+        return []
+    METRICS.observe("retrieval.latency_ms", (time.perf_counter() - started) * 1000)
+    METRICS.observe("retrieval.hits", len(hits))
+    return hits
+
+
+_garage_cache = GarageCache(GARAGE_CACHE_SECONDS)
+_priors_lock = Lock()
+_priors_cache = {}
+PRIOR_CACHE_ENTRIES = 1024
+
+
+def _failure_priors(car_data) -> dict:
+    # Top priors for the car's vehicle group, cached per group for PRIOR_CACHE_SECONDS.
+    doc_ids = tuple(prior_doc_ids(vehicle_group(car_data or {})))
+    if not doc_ids:
+        return top_priors([], PRIOR_TOP_K)
+    now = time.time()
+    with _priors_lock:
+        cached = _priors_cache.get(doc_ids)
+    if cached and now - cached[0] < PRIOR_CACHE_SECONDS:
+        return cached[1]
+    refs = [_get_db().collection(PRIORS_COLLECTION).document(doc_id) for doc_id in doc_ids]
+    try:
+        docs = {snapshot.id: snapshot.to_dict() for snapshot in _get_db().get_all(refs) if snapshot.exists}
+    except Exception:
+        logger.exception("priors: lookup failed", extra={"group": doc_ids[0]})
+        return top_priors([], PRIOR_TOP_K)
+    result = top_priors([docs.get(doc_id) for doc_id in doc_ids], PRIOR_TOP_K, PRIOR_MIN_SUPPORT)
+    with _priors_lock:
+        _priors_cache.pop(doc_ids, None)
+        _priors_cache[doc_ids] = (now, result)
+        while len(_priors_cache) > PRIOR_CACHE_ENTRIES:
+            _priors_cache.pop(next(iter(_priors_cache)))
+    return result
+
+
+def _priors_text(priors) -> str:
+    if priors["total"] < PRIOR_MIN_SUPPORT or not priors["priors"]:
+        return ""
+    return f"\n{format_priors(priors)}\n"
 
 
-def _question_response_format(name: str = "followup_questions"):
-    return {
-        "type": "json_schema",
-        "json_schema": {
-            "name": name,
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "questions": {
-                        "type": "array",
-                        "description": "Short, single-focus diagnostic questions",
-                        "items": {"type": "string"},
-                    }
-                },
-                "required": ["questions"],
-                "additionalProperties": False,
+def _prior_cases_text(prior_cases) -> str:
+    if not prior_cases:
+        return ""
+    return f"\nPrior cases for this vehicle (most relevant first):\n{format_cases(prior_cases)}\n"
+
+
+def _index_case(chat_id: str, aggregation) -> bool:
+    # Adds the aggregation's diagnosis to its car's case index and moves the failure priors
+    # from the chat's previous verdict to this one, in one transaction. The case keeps the
+    # prior docs it was counted in, so a car whose group changed since (enrichment filled
+    # the engine, the year was fixed) moves its count to the new group. False when nothing
+    # changed (trigger redelivery).
+    chat_snapshot = _get_db().collection("chats").document(chat_id).get()
+    chat_data = chat_snapshot.to_dict() if chat_snapshot.exists else None
+    if not chat_data or not chat_data.get("carId"):
+        return False
+    diagnostic_id = chat_data.get("diagnosticId")
+    diagnostic = {}
+    if diagnostic_id:
+        diagnostic_snapshot = _get_db().collection("diagnostics").document(diagnostic_id).get()
+        diagnostic = diagnostic_snapshot.to_dict() if diagnostic_snapshot.exists else {}
+    case = case_record(chat_id, diagnostic_id, aggregation, diagnostic)
+    if case is None:
+        return False
+    index_ref = _get_db().collection(CASE_INDEX_COLLECTION).document(chat_data["carId"])
+    case["priorDocs"] = prior_doc_ids(vehicle_group(_fetch_car_data(chat_data["carId"])))
+    priors = _get_db().collection(PRIORS_COLLECTION)
+
+    @firestore.transactional
+    def apply(transaction):
+        snapshot = index_ref.get(transaction=transaction)
+        index_data = snapshot.to_dict() if snapshot.exists else None
+        updated = apply_case(index_data, case)
+        if updated is None:
+            return False
+        previous = ((index_data or {}).get("cases") or {}).get(chat_id)
+        removed = prior_title(previous["diagnosis"]) if previous else ""
+        added = prior_title(case["diagnosis"])
+        # Cases indexed before priorDocs was kept were counted in the car's current group.
+        old_docs = (previous.get("priorDocs", case["priorDocs"]) or []) if previous else []
+        moves = {}
+        for doc_id in dict.fromkeys(old_docs + case["priorDocs"]):
+            move = (removed if doc_id in old_docs else "", added if doc_id in case["priorDocs"] else "")
+            if move[0] != move[1]:
+                moves[doc_id] = move
+        prior_snapshots = {doc_id: priors.document(doc_id).get(transaction=transaction) for doc_id in moves}
+        for doc_id, (old_title, new_title) in moves.items():
+            prior_snapshot = prior_snapshots[doc_id]
+            prior = prior_snapshot.to_dict() if prior_snapshot.exists else None
+            group = group_from_doc_id(doc_id)
+            transaction.set(
+                priors.document(doc_id),
+                {**apply_prior(prior, old_title, new_title, group, group["engine"]), "updatedAt": _now_ms()},
+            )
+        transaction.set(
+            index_ref,
+            {
+                **updated,
+                "carId": chat_data["carId"],
+                "userId": chat_data.get("userId"),
+                "updatedAt": _now_ms(),
             },
-        },
-    }
+        )
+        return True
+
+    return apply(_get_db().transaction())
+
+
+def _intake_text(car_data, intake, prior_cases=None) -> str:
+    # Vehicle context leads (after the system prompt), so diagnoses of the same vehicle
+    # share a prompt prefix; the car's own prior cases follow it.
+    car_text = f"Vehicle context:\n{_car_context_lines(car_data)}{_prior_cases_text(prior_cases)}"
+    return (
+        f"{car_text}\n"
+        "Initial report:\n"
+        f"{intake['initial']}\n\n"
+        "Follow-up questions:\n"
+        f"{chr(10).join(intake['questions']) or 'None'}\n\n"
+        "User answers:\n"
+        f"{chr(10).join(intake['answers']) or 'None'}"
+    )
 
 
 def _build_questions_payload(questions):
@@ -324,101 +1208,194 @@ def _build_questions_payload(questions):
     return json.dumps({"questions": cleaned})
 
 
-def _vehicle_metadata_response_format():
-    return {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "vehicle_metadata_update",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "has_update": {"type": "boolean"},
-                    "confidence": {
-                        "type": "number",
-                        "description": "Confidence from 0 to 1 that updates are correct",
-                    },
-                    "updates": {
-                        "type": "object",
-                        "properties": {
-                            "engine_type": {"type": "string"},
-                            "transmission_type": {"type": "string"},
-                            "drivetrain": {"type": "string"},
-                            "fuel_type": {"type": "string"},
-                        },
-                        "additionalProperties": False,
-                    },
-                },
-                "required": ["has_update", "confidence", "updates"],
-                "additionalProperties": False,
-            },
-        },
-    }
+@https_fn.on_request(invoker="public")
+def hello(request):
+    return https_fn.Response("CARLLM Functions online.")
 
 
-def _replacement_response_format():
-    return {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "vehicle_replacements_update",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "has_update": {"type": "boolean"},
-                    "confidence": {
-                        "type": "number",
-                        "description": "Confidence from 0 to 1 that updates are correct",
-                    },
-                    "replacements": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                    },
-                },
-                "required": ["has_update", "confidence", "replacements"],
-                "additionalProperties": False,
-            },
-        },
+def _publish_aggregation(
+    chat_ref,
+    message_id: str,
+    results,
+    combined_output: str,
+    strategy: str,
+    winner_model,
+    aggregator_model: str,
+    writer=None,
+    bracket=None,
+):
+    # The aggregation, the final verdict message and the chat state land in one commit.
+    if writer is None:
+        writer = _verdict_writer(chat_ref, aggregator_model)
+    aggregation_ref = chat_ref.collection("aggregations").document()
+    aggregation = {
+        "messageId": message_id,
+        "llmRunIds": [result["id"] for result in results],
+        "combinedOutput": combined_output,
+        "strategy": strategy,
+        "winnerModel": winner_model,
+        "createdAt": _now_ms(),
     }
+    if bracket is not None:
+        aggregation["bracket"] = bracket
+    batch = _get_db().batch()
+    batch.set(aggregation_ref, aggregation)
+    writer.finalize(
+        combined_output,
+        batch=batch,
+        metadata={"winnerModel": winner_model, "aggregationId": aggregation_ref.id},
+    )
+    batch.update(
+        chat_ref,
+        {
+            "awaitingResponse": False,
+            "phase": "normal",
+            "updatedAt": _now_ms(),
+            "latestMessageId": writer.id,
+        },
+    )
+    batch.commit()
 
-
-def _normalize_vehicle_text(value: Any) -> str:
-    if not isinstance(value, str):
-        return ""
-    return value.strip()
+    verdict = parse_json_content(combined_output)
+    return {
+        "status": "ok",
+        "aggregationId": aggregation_ref.id,
+        "winnerModel": winner_model,
+        "diagnosis": verdict.get("diagnostic_answer") if isinstance(verdict, dict) else None,
+    }
 
 
-def _extract_user_vehicle_text(content: str) -> str:
-    parsed = _parse_json_content(content)
-    if parsed and isinstance(parsed, dict):
-        answers = parsed.get("answers")
-        if isinstance(answers, list):
-            clean_answers = [str(item).strip() for item in answers if str(item).strip()]
-            if clean_answers:
-                return "User answers:\n- " + "\n- ".join(clean_answers)
-    return content.strip()
+def _release_cancelled(chat_ref, chat_id: str, cancellation, stage: str):
+    # Runs once every upstream stream of a cancelled invocation is closed.
+    chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
+    release_ms = max(0, _now_ms() - (cancellation.requested_ms or _now_ms()))
+    METRICS.increment(f"cancel.{stage}")
+    METRICS.observe("cancel.release_ms", release_ms)
+    logger.info(
+        "cancel: released",
+        extra={
+            "chatId": chat_id,
+            "messageId": cancellation.message_id,
+            "stage": stage,
+            "releaseMs": release_ms,
+        },
+    )
+    return {"status": "cancelled"}
 
 
-@https_fn.on_request(invoker="public")
-def hello(request):
-    return https_fn.Response("CARLLM Functions online.")
+def _verdict_writer(chat_ref, model: str):
+    return StreamingMessageWriter(
+        chat_ref.collection("messages").document(),
+        {
+            "role": "assistant",
+            "promptType": "aggregate",
+            "source": "llm",
+            "metadata": {"model": model},
+        },
+    )
 
 
-@https_fn.on_call(secrets=["OPENROUTER_API_KEY"], invoker="public")
-def question_prompt(request):
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
+@https_fn.on_call(invoker="public")
+def vehicle_catalog_lookup(request):
+    _require_auth(request)
+    payload = request.data or {}
+    query = payload.get("query")
+    limit = payload.get("limit") or CATALOG_SEARCH_LIMIT
+    if not isinstance(limit, int) or limit < 1:
         raise https_fn.HttpsError(
-            https_fn.FunctionsErrorCode.INTERNAL,
-            "Missing OPENROUTER_API_KEY",
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Invalid limit",
         )
 
+    index = _get_vehicle_index()
+    selection = _catalog_selection(payload)
+    level, options = index.options(selection)
+    response = {"level": level, "options": options}
+    if isinstance(query, str) and query.strip():
+        response["matches"] = index.search(query, limit=min(limit, 100))
+    return response
+
+
+@https_fn.on_call(invoker="public")
+def list_garage(request):
+    # The garage dashboard in one call: a page of cars with their latest diagnostics and
+    # chat status. Pass back nextCursor for the next page. The first page is read fresh
+    # unless "fresh" is false, since cars and diagnostics created by the app never reach
+    # this instance's cache; later pages come from the cache unless "fresh" is true.
     uid = _require_auth(request)
     payload = request.data or {}
-    chat_id = payload.get("chatId")
-    message_id = payload.get("messageId")
-
-    if not chat_id or not message_id:
+    limit = payload.get("limit", GARAGE_PAGE_SIZE)
+    per_car = payload.get("diagnosticsPerCar", GARAGE_DIAGNOSTICS_PER_CAR)
+    cursor = payload.get("cursor") or None
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Invalid limit",
+        )
+    if not isinstance(per_car, int) or isinstance(per_car, bool) or not 0 <= per_car <= MAX_DIAGNOSTICS_PER_CAR:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Invalid diagnosticsPerCar",
+        )
+    if cursor is not None:
+        try:
+            decode_cursor(cursor if isinstance(cursor, str) else "")
+        except ValueError as exc:
+            raise https_fn.HttpsError(https_fn.FunctionsErrorCode.INVALID_ARGUMENT, str(exc))
+
+    key = (uid, cursor, limit, per_car)
+    if not payload.get("fresh", cursor is None):
+        cached = _garage_cache.get(key)
+        if cached is not None:
+            METRICS.increment("garage.cache_hit")
+            return cached
+    started = time.perf_counter()
+    response = load_garage(_get_db(), uid, limit, per_car, cursor, _garage_executor())
+    METRICS.observe("garage.load_ms", (time.perf_counter() - started) * 1000)
+    _garage_cache.put(key, response)
+    return response
+
+
+@https_fn.on_call(invoker="public")
+def failure_priors(request):
+    # Read-only: priors for {carId} of one of the caller's cars, or {year, make, model, engine?}.
+    uid = _require_auth(request)
+    payload = request.data or {}
+    car_id = payload.get("carId")
+    if car_id:
+        car_data = _fetch_car_data(car_id)
+        if car_data.get("userId") != uid:
+            raise https_fn.HttpsError(
+                https_fn.FunctionsErrorCode.NOT_FOUND,
+                "Car not found",
+            )
+    else:
+        car_data = {key: payload.get(key) for key in ("year", "make", "model", "engine")}
+    group = vehicle_group(car_data)
+    if group is None:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Missing year, make or model",
+        )
+    return {**group, **_failure_priors(car_data)}
+
+
+@https_fn.on_call(secrets=["OPENROUTER_API_KEY"], invoker="public")
+@_profiled
+def question_prompt(request):
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INTERNAL,
+            "Missing OPENROUTER_API_KEY",
+        )
+
+    uid = _require_auth(request)
+    payload = request.data or {}
+    chat_id = payload.get("chatId")
+    message_id = payload.get("messageId")
+
+    if not chat_id or not message_id:
         raise https_fn.HttpsError(
             https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
             "Missing chatId or messageId",
@@ -427,7 +1404,6 @@ def question_prompt(request):
     chat_ref = _get_db().collection("chats").document(chat_id)
     chat_data = _require_chat_owner(chat_ref, uid)
     chat_ref.update({"tokensReceived": 0, "updatedAt": _now_ms()})
-    chat_ref.update({"tokensReceived": 0, "updatedAt": _now_ms()})
 
     message_snapshot = chat_ref.collection("messages").document(message_id).get()
     if not message_snapshot.exists:
@@ -445,37 +1421,53 @@ def question_prompt(request):
         )
 
     car_data = _fetch_car_data(chat_data.get("carId"))
+    prior_cases = _prior_cases(chat_data.get("carId"), car_data, description, chat_id)
 
-    system_prompt = (
-        "You are an automotive diagnostic assistant. Ask concise, high-signal follow-up "
-        "questions to clarify symptoms. Always ask for mileage if it was not provided. "
-        "Ask 3-6 questions max."
-    )
     user_prompt = (
         "User description:\n"
         f"{description}\n\n"
         "Car info:\n"
-        f"Year: {car_data.get('year', 'unknown')}\n"
-        f"Make: {car_data.get('make', 'unknown')}\n"
-        f"Model: {car_data.get('model', 'unknown')}\n"
-        f"Mileage: {car_data.get('mileage', 'unknown')}\n"
+        f"{_car_context_lines(car_data)}"
+        f"{_prior_cases_text(prior_cases)}"
+        f"{_priors_text(_failure_priors(car_data))}"
     )
 
     progress_tracker = ProgressTracker(chat_ref)
-    response_format = _question_response_format("intake_questions")
+    question_stream = StreamingJsonArrayParser(("questions",))
+    question_writer = StreamingMessageWriter(
+        chat_ref.collection("messages").document(),
+        {
+            "role": "assistant",
+            "promptType": "intake",
+            "source": "llm",
+            "metadata": {
+                "model": FOLLOWUP_MODEL,
+                "intakeStage": "followup_questions",
+            },
+        },
+    )
+
+    def publish_questions(delta):
+        if question_stream.feed(delta):
+            question_writer.update(json.dumps({"questions": question_stream.items["questions"]}))
+
+    question_writer.start()
     try:
         content, _ = _call_openrouter_stream(
             api_key,
             FOLLOWUP_MODEL,
             [
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.3,
             progress_tracker=progress_tracker,
-            response_format=response_format,
+            response_format=INTAKE_QUESTIONS_FORMAT,
+            on_delta=publish_questions,
+            role="followup",
         )
     except requests.RequestException:
+        question_writer.discard()
         chat_ref.update(
             {
                 "awaitingResponse": False,
@@ -487,39 +1479,30 @@ def question_prompt(request):
             "OpenRouter request failed",
         )
 
-    parsed = _parse_json_content(content)
+    parsed = parse_json_content(content) or question_stream.result()
     if parsed and isinstance(parsed, dict) and isinstance(parsed.get("questions"), list):
         content = json.dumps(parsed)
     else:
         content = _build_questions_payload([content])
 
-    assistant_ref = chat_ref.collection("messages").document()
-    assistant_ref.set(
-        {
-            "role": "assistant",
-            "promptType": "intake",
-            "content": content or "No response generated.",
-            "createdAt": _now_ms(),
-            "source": "llm",
-            "metadata": {
-                "model": FOLLOWUP_MODEL,
-                "intakeStage": "followup_questions",
-            },
-        }
-    )
-    chat_ref.update(
+    batch = _get_db().batch()
+    question_writer.finalize(content or "No response generated.", batch=batch)
+    batch.update(
+        chat_ref,
         {
             "awaitingResponse": False,
             "phase": "intake_answers",
             "updatedAt": _now_ms(),
-            "latestMessageId": assistant_ref.id,
-        }
+            "latestMessageId": question_writer.id,
+        },
     )
+    batch.commit()
 
     return {"status": "ok"}
 
 
 @https_fn.on_call(timeout_sec=360, secrets=["OPENROUTER_API_KEY"], invoker="public")
+@_profiled
 def fanout_diagnosis(request):
     api_key = os.environ.get("OPENROUTER_API_KEY")
     if not api_key:
@@ -550,8 +1533,7 @@ def fanout_diagnosis(request):
         )
 
     car_data = _fetch_car_data(chat_data.get("carId"))
-    messages = _load_messages(chat_ref)
-    intake = _extract_intake_context(messages)
+    intake = _load_intake_context(chat_ref, chat_data, message_id, message_snapshot.to_dict() or {})
 
     if not intake["initial"]:
         chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
@@ -560,68 +1542,41 @@ def fanout_diagnosis(request):
             "Missing intake context",
         )
 
-    car_text = (
-        "Vehicle context:\n"
-        f"Year: {car_data.get('year', 'unknown')}\n"
-        f"Make: {car_data.get('make', 'unknown')}\n"
-        f"Model: {car_data.get('model', 'unknown')}\n"
-        f"Mileage: {car_data.get('mileage', 'unknown')}\n"
-    )
-    intake_text = (
-        f"{car_text}\n"
-        "Initial report:\n"
-        f"{intake['initial']}\n\n"
-        "Follow-up questions:\n"
-        f"{chr(10).join(intake['questions']) or 'None'}\n\n"
-        "User answers:\n"
-        f"{chr(10).join(intake['answers']) or 'None'}"
+    prior_cases = _prior_cases(
+        chat_data.get("carId"), car_data, " ".join([intake["initial"], *intake["answers"]]), chat_id
     )
+    intake_text = _intake_text(car_data, intake, prior_cases)
+
+    with cancellation_scope(chat_id, chat_ref, message_id, CANCEL_POLL_SECONDS) as cancellation:
+        try:
+            return _run_fanout(
+                api_key, chat_id, chat_ref, message_id, car_data, intake, intake_text, cancellation
+            )
+        except Cancelled:
+            return _release_cancelled(chat_ref, chat_id, cancellation, "fanout")
 
+
+def _run_fanout(
+    api_key: str,
+    chat_id: str,
+    chat_ref,
+    message_id: str,
+    car_data,
+    intake,
+    intake_text: str,
+    cancellation,
+):
     progress_tracker = ProgressTracker(chat_ref)
 
-    sufficiency_system = (
-        "You are a master automotive diagnostician. Decide if the intake provides "
-        "enough information to confidently choose a single diagnosis. Only say it is "
-        "sufficient when you are very confident. If insufficient, ask 3-6 more focused "
-        "questions, one question per item."
-    )
-    sufficiency_user = intake_text
-    sufficiency_format = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "diagnosis_sufficiency",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "is_sufficient": {"type": "boolean"},
-                    "confidence": {
-                        "type": "number",
-                        "description": "Confidence from 0 to 1 that a single diagnosis is correct",
-                    },
-                    "followup_questions": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                    },
-                },
-                "required": ["is_sufficient", "confidence", "followup_questions"],
-                "additionalProperties": False,
-            },
-        },
-    }
     try:
-        sufficiency_raw, _ = _call_openrouter_stream(
+        decision, sufficiency, followup_writer = _run_sufficiency_gate(
             api_key,
-            AGGREGATOR_MODEL,
-            [
-                {"role": "system", "content": sufficiency_system},
-                {"role": "user", "content": sufficiency_user},
-            ],
-            temperature=0.1,
-            response_format=sufficiency_format,
-            progress_tracker=progress_tracker,
+            chat_ref,
+            intake_text,
+            progress_tracker,
+            cancellation,
+            priors_text=_priors_text(_failure_priors(car_data)),
         )
-        sufficiency = _parse_json_content(sufficiency_raw) or {}
     except requests.RequestException:
         chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
         raise https_fn.HttpsError(
@@ -629,48 +1584,26 @@ def fanout_diagnosis(request):
             "OpenRouter request failed",
         )
 
-    is_sufficient = bool(sufficiency.get("is_sufficient"))
-    confidence = sufficiency.get("confidence")
-    followup_questions = sufficiency.get("followup_questions") or []
-
-    if not isinstance(confidence, (int, float)):
-        confidence = 0.0
-
-    if (not is_sufficient) or confidence < 0.85:
-        question_payload = _build_questions_payload(followup_questions)
-        assistant_ref = chat_ref.collection("messages").document()
-        assistant_ref.set(
-            {
-                "role": "assistant",
-                "promptType": "intake",
-                "content": question_payload,
-                "createdAt": _now_ms(),
-                "source": "llm",
-                "metadata": {
-                    "model": AGGREGATOR_MODEL,
-                    "intakeStage": "followup_questions",
-                },
-            }
-        )
-        chat_ref.update(
+    if decision != "sufficient":
+        question_payload = _build_questions_payload(sufficiency.get("followup_questions") or [])
+        batch = _get_db().batch()
+        followup_writer.finalize(question_payload, batch=batch)
+        batch.update(
+            chat_ref,
             {
                 "awaitingResponse": False,
                 "phase": "intake_answers",
                 "updatedAt": _now_ms(),
-                "latestMessageId": assistant_ref.id,
-            }
+                "latestMessageId": followup_writer.id,
+            },
         )
+        batch.commit()
         return {"status": "needs_more_info"}
-
-    system_prompt = (
-        "You are an automotive diagnostic assistant. Provide a concise diagnosis, "
-        "likely root causes, and the next 2-3 checks to confirm. Be specific."
-    )
-    user_prompt = intake_text
+    followup_writer.discard()
 
     base_messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
+        {"role": "system", "content": FANOUT_SYSTEM_PROMPT},
+        {"role": "user", "content": intake_text},
     ]
 
     llm_run_refs = []
@@ -698,6 +1631,10 @@ def fanout_diagnosis(request):
         llm_run_refs.append((model, run_ref))
 
     def run_model(model, run_ref):
+        if cancellation.cancelled:
+            # Still queued behind other diagnoses when the cancel came in.
+            run_ref.update({"status": "cancelled", "finishedAt": _now_ms()})
+            return {"model": model, "output": "", "record": None, "id": run_ref.id}
         run_ref.update({"status": "running"})
         try:
             output, _ = _call_openrouter_stream(
@@ -705,16 +1642,24 @@ def fanout_diagnosis(request):
                 model,
                 base_messages,
                 temperature=0.2,
+                response_format=FANOUT_FORMAT,
                 progress_tracker=progress_tracker,
+                role="fanout",
+                cancellation=cancellation,
             )
+            record = candidate_record(output)
             run_ref.update(
                 {
                     "status": "completed",
                     "output": output,
+                    "record": record,
                     "finishedAt": _now_ms(),
                 }
             )
-            return {"model": model, "output": output, "id": run_ref.id}
+            return {"model": model, "output": output, "record": record, "id": run_ref.id}
+        except Cancelled:
+            run_ref.update({"status": "cancelled", "finishedAt": _now_ms()})
+            return {"model": model, "output": "", "record": None, "id": run_ref.id}
         except requests.RequestException as exc:
             run_ref.update(
                 {
@@ -723,81 +1668,133 @@ def fanout_diagnosis(request):
                     "finishedAt": _now_ms(),
                 }
             )
-            return {"model": model, "output": "", "id": run_ref.id}
+            return {"model": model, "output": "", "record": None, "id": run_ref.id}
 
     results = []
-    with ThreadPoolExecutor(max_workers=len(FANOUT_MODELS)) as executor:
-        futures = [executor.submit(run_model, model, ref) for model, ref in llm_run_refs]
-        for future in as_completed(futures):
-            results.append(future.result())
-
-    candidate_sections = []
-    for result in results:
-        candidate_sections.append(
-            f"Model: {result['model']}\nResponse:\n{result['output'] or 'No response.'}"
+    executor = _fanout_executor()
+    futures = [executor.submit(carry(run_model), model, ref) for model, ref in llm_run_refs]
+    for future in as_completed(futures):
+        results.append(future.result())
+    results.sort(key=lambda result: FANOUT_MODELS.index(result["model"]))
+    cancellation.check()
+
+    consensus = None
+    if CONSENSUS_ENABLED:
+        consensus = find_consensus(
+            results,
+            supermajority=CONSENSUS_SUPERMAJORITY,
+            min_similarity=CONSENSUS_MIN_SIMILARITY,
+        )
+    if consensus:
+        judgement = build_judgement(consensus)
+        logger.info(
+            "consensus: skipped judge",
+            extra={"chatId": chat_id, "votes": consensus["votes"], "total": consensus["total"]},
+        )
+        return _publish_aggregation(
+            chat_ref,
+            message_id,
+            results,
+            combined_output=json.dumps(judgement),
+            strategy="vote",
+            winner_model=judgement["model_name"],
+            aggregator_model=judgement["model_name"],
         )
 
-    judge_system = (
-        "You are a master automotive diagnostician. Review the candidate diagnoses and "
-        "select the most accurate given the intake data. Return JSON with keys "
-        "`model_name`, `diagnostic_answer`, `justifacation`, and `explanation`. "
-        "`diagnostic_answer` must be a short title only (no full explanation). "
-        "`justifacation` must be an array of brief bullet-point strings."
-    )
-    judge_user = (
-        f"{intake_text}\n\nCandidate diagnoses:\n\n" + "\n\n".join(candidate_sections)
-    )
+    finalists = results
+    bracket = None
+    contenders = [result for result in results if (result.get("record") or {}).get("primary_diagnosis")]
+    if len(contenders) > JUDGE_GROUP_SIZE:
+
+        def judge_group(group):
+            started = time.perf_counter()
+            try:
+                raw, _ = _call_openrouter_stream(
+                    api_key,
+                    AGGREGATOR_MODEL,
+                    [
+                        {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
+                        {
+                            "role": "user",
+                            "content": build_judge_prompt(intake_text, group, JUDGE_CANDIDATE_TOKEN_CAP),
+                        },
+                    ],
+                    temperature=0.2,
+                    response_format=JUDGEMENT_FORMAT,
+                    progress_tracker=progress_tracker,
+                    role="aggregator",
+                    cancellation=cancellation,
+                )
+            except requests.RequestException:
+                # A failed sub-judge advances its first candidate instead of sinking the bracket.
+                logger.exception("bracket: sub-judge failed", extra={"chatId": chat_id})
+                return group[0], {"failed": True}
+            verdict = parse_json_content(raw) or {}
+            winner = next(
+                (candidate for candidate in group if candidate["model"] == verdict.get("model_name")),
+                group[0],
+            )
+            return winner, {
+                "diagnosis": verdict.get("diagnostic_answer") or "",
+                "latencyMs": int((time.perf_counter() - started) * 1000),
+            }
+
+        bracket_started = time.perf_counter()
+        finalists, rounds = run_bracket(contenders, JUDGE_GROUP_SIZE, carry(judge_group), _fanout_executor())
+        bracket = {"groupSize": JUDGE_GROUP_SIZE, "rounds": rounds}
+        logger.info(
+            "bracket: finalists chosen",
+            extra={
+                "chatId": chat_id,
+                "candidates": len(contenders),
+                "finalists": len(finalists),
+                "latencyMs": int((time.perf_counter() - bracket_started) * 1000),
+            },
+        )
+
+    judge_user = build_judge_prompt(intake_text, finalists, JUDGE_CANDIDATE_TOKEN_CAP)
 
     combined_output = ""
     winner_model = None
-    response_format = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "diagnosis_judgement",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "model_name": {
-                        "type": "string",
-                        "description": "The winning model identifier",
-                    },
-                    "diagnostic_answer": {
-                        "type": "string",
-                        "description": "Short title of what is wrong with the car",
-                    },
-                    "justifacation": {
-                        "type": "array",
-                        "description": "Bullet point reasons supporting the diagnosis",
-                        "items": {"type": "string"},
-                    },
-                    "explanation": {
-                        "type": "string",
-                        "description": "Concise explanation for the user",
-                    },
-                },
-                "required": [
-                    "model_name",
-                    "diagnostic_answer",
-                    "justifacation",
-                    "explanation",
-                ],
-                "additionalProperties": False,
-            },
-        },
-    }
 
+    # Streams the verdict as valid partial JSON so clients render fields as they complete.
+    verdict_stream = StreamingJsonArrayParser(("justifacation",))
+    verdict_writer = _verdict_writer(chat_ref, AGGREGATOR_MODEL)
+
+    def render_verdict():
+        partial = verdict_stream.snapshot()
+        return json.dumps(partial) if partial else None
+
+    def publish_verdict(delta):
+        verdict_stream.feed(delta)
+        verdict_writer.update(render_verdict)
+
+    verdict_writer.start()
+    judge_started = time.perf_counter()
     try:
-        aggregation_raw, _ = _call_openrouter_stream(
+        aggregation_raw, judge_usage = _call_openrouter_stream(
             api_key,
             AGGREGATOR_MODEL,
             [
-                {"role": "system", "content": judge_system},
+                {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
                 {"role": "user", "content": judge_user},
             ],
             temperature=0.2,
-            response_format=response_format,
+            response_format=JUDGEMENT_FORMAT,
             progress_tracker=progress_tracker,
+            on_delta=publish_verdict,
+            role="aggregator",
+            cancellation=cancellation,
+        )
+        judge_ms = (time.perf_counter() - judge_started) * 1000
+        prompt_tokens = (judge_usage or {}).get("prompt_tokens") or estimate_tokens(
+            JUDGE_SYSTEM_PROMPT + "\n" + judge_user
+        )
+        METRICS.observe("judge.prompt_tokens", prompt_tokens)
+        METRICS.observe("judge.latency_ms", judge_ms)
+        logger.info(
+            "judge: verdict",
+            extra={"chatId": chat_id, "promptTokens": prompt_tokens, "latencyMs": int(judge_ms)},
         )
         try:
             parsed = json.loads(aggregation_raw)
@@ -805,7 +1802,11 @@ def fanout_diagnosis(request):
             combined_output = json.dumps(parsed)
         except json.JSONDecodeError:
             combined_output = aggregation_raw
+    except Cancelled:
+        verdict_writer.discard()
+        raise
     except requests.RequestException:
+        verdict_writer.discard()
         chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
         raise https_fn.HttpsError(
             https_fn.FunctionsErrorCode.INTERNAL,
@@ -815,47 +1816,21 @@ def fanout_diagnosis(request):
     if not combined_output:
         combined_output = "Unable to determine a diagnosis at this time."
 
-    aggregation_ref = chat_ref.collection("aggregations").document()
-    aggregation_ref.set(
-        {
-            "messageId": message_id,
-            "llmRunIds": [result["id"] for result in results],
-            "combinedOutput": combined_output,
-            "strategy": "judge",
-            "winnerModel": winner_model,
-            "createdAt": _now_ms(),
-        }
+    return _publish_aggregation(
+        chat_ref,
+        message_id,
+        results,
+        combined_output=combined_output,
+        strategy="rank" if bracket else "judge",
+        winner_model=winner_model,
+        aggregator_model=AGGREGATOR_MODEL,
+        writer=verdict_writer,
+        bracket=bracket,
     )
 
-    assistant_ref = chat_ref.collection("messages").document()
-    assistant_ref.set(
-        {
-            "role": "assistant",
-            "promptType": "aggregate",
-            "content": combined_output,
-            "createdAt": _now_ms(),
-            "source": "llm",
-            "metadata": {
-                "model": AGGREGATOR_MODEL,
-                "winnerModel": winner_model,
-                "aggregationId": aggregation_ref.id,
-            },
-        }
-    )
-
-    chat_ref.update(
-        {
-            "awaitingResponse": False,
-            "phase": "normal",
-            "updatedAt": _now_ms(),
-            "latestMessageId": assistant_ref.id,
-        }
-    )
-
-    return {"status": "ok"}
-
 
 @https_fn.on_call(secrets=["OPENROUTER_API_KEY"], invoker="public")
+@_profiled
 def chat_reply(request):
     api_key = os.environ.get("OPENROUTER_API_KEY")
     if not api_key:
@@ -894,322 +1869,418 @@ def chat_reply(request):
         if role in ("user", "assistant") and content:
             history.append({"role": role, "content": content})
 
-    system_prompt = (
-        "You are an automotive diagnostic assistant. Use the full conversation "
-        "context and answer the latest user question clearly and concisely."
-    )
-    full_messages = [{"role": "system", "content": system_prompt}, *history]
+    full_messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}, *history]
 
     progress_tracker = ProgressTracker(chat_ref)
-    try:
-        content, _ = _call_openrouter_stream(
-            api_key,
-            CHAT_MODEL,
-            full_messages,
-            temperature=0.3,
-            progress_tracker=progress_tracker,
-        )
-    except requests.RequestException:
-        chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
-        raise https_fn.HttpsError(
-            https_fn.FunctionsErrorCode.INTERNAL,
-            "OpenRouter request failed",
-        )
-
-    assistant_ref = chat_ref.collection("messages").document()
-    assistant_ref.set(
+    reply_writer = StreamingMessageWriter(
+        chat_ref.collection("messages").document(),
         {
             "role": "assistant",
             "promptType": "normal",
-            "content": content or "No response generated.",
-            "createdAt": _now_ms(),
             "source": "llm",
             "metadata": {"model": CHAT_MODEL},
-        }
+        },
     )
+    reply_writer.start()
+    with cancellation_scope(chat_id, chat_ref, message_id, CANCEL_POLL_SECONDS) as cancellation:
+        try:
+            content, _ = _call_openrouter_stream(
+                api_key,
+                CHAT_MODEL,
+                full_messages,
+                temperature=0.3,
+                progress_tracker=progress_tracker,
+                on_delta=reply_writer.append,
+                role="chat",
+                cancellation=cancellation,
+            )
+        except Cancelled:
+            reply_writer.discard()
+            return _release_cancelled(chat_ref, chat_id, cancellation, "chat")
+        except requests.RequestException:
+            reply_writer.discard()
+            chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
+            raise https_fn.HttpsError(
+                https_fn.FunctionsErrorCode.INTERNAL,
+                "OpenRouter request failed",
+            )
 
-    chat_ref.update(
+    batch = _get_db().batch()
+    reply_writer.finalize(content or "No response generated.", batch=batch)
+    batch.update(
+        chat_ref,
         {
             "awaitingResponse": False,
             "phase": "normal",
             "updatedAt": _now_ms(),
-            "latestMessageId": assistant_ref.id,
-        }
+            "latestMessageId": reply_writer.id,
+        },
     )
+    batch.commit()
 
     return {"status": "ok"}
 
 
-@firestore_fn.on_document_created(
-    document="chats/{chatId}/messages/{messageId}",
-    secrets=["OPENROUTER_API_KEY"],
-)
-def enrich_vehicle_metadata(event):
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
-        logger.warning("metadata: missing OPENROUTER_API_KEY")
-        return
-
-    snapshot = event.data
-    if snapshot is None:
-        logger.warning("metadata: missing snapshot data")
-        return
-    message = snapshot.to_dict() or {}
-    if message.get("role") != "user":
-        logger.info("metadata: skipping non-user message")
-        return
-
-    content = (message.get("content") or "").strip()
-    if not content:
-        logger.info("metadata: empty message content")
-        return
+@https_fn.on_call(invoker="public")
+def cancel_generation(request):
+    # Stops the fan-out or chat reply answering messageId (default: the chat's latest
+    # message), wherever it runs. The UI is unblocked here; the running invocation marks
+    # its runs cancelled and releases its streams when it sees the stamp.
+    uid = _require_auth(request)
+    payload = request.data or {}
+    chat_id = payload.get("chatId")
 
-    params = getattr(event, "params", {}) or {}
-    chat_id = params.get("chatId")
     if not chat_id:
-        logger.warning("metadata: missing chatId in event params")
-        return
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Missing chatId",
+        )
 
     chat_ref = _get_db().collection("chats").document(chat_id)
-    chat_snapshot = chat_ref.get()
-    if not chat_snapshot.exists:
-        logger.warning("metadata: chat not found", extra={"chatId": chat_id})
-        return
-    chat_data = chat_snapshot.to_dict() or {}
+    chat_data = _require_chat_owner(chat_ref, uid)
+    message_id = payload.get("messageId") or chat_data.get("latestMessageId")
+    if not message_id:
+        return {"status": "idle"}
 
-    car_id = chat_data.get("carId")
-    if not car_id:
-        logger.info("metadata: chat missing carId", extra={"chatId": chat_id})
-        return
+    requested_ms = _now_ms()
+    chat_ref.update(
+        {
+            "cancelledMessageId": message_id,
+            "cancelRequestedAt": requested_ms,
+            "awaitingResponse": False,
+            "updatedAt": requested_ms,
+        }
+    )
+    local = cancel_local(chat_id, message_id, requested_ms)
+    METRICS.increment("cancel.requests")
+    logger.info(
+        "cancel: requested",
+        extra={"chatId": chat_id, "messageId": message_id, "local": local},
+    )
+    return {"status": "cancelling"}
 
-    car_ref = _get_db().collection("cars").document(car_id)
-    car_snapshot = car_ref.get()
-    if not car_snapshot.exists:
-        logger.warning("metadata: car not found", extra={"carId": car_id})
-        return
-    car_data = car_snapshot.to_dict() or {}
 
-    known_engine = _normalize_vehicle_text(car_data.get("engineType"))
-    known_transmission = _normalize_vehicle_text(car_data.get("transmissionType"))
-    known_drivetrain = _normalize_vehicle_text(car_data.get("drivetrain"))
-    known_fuel = _normalize_vehicle_text(car_data.get("fuelType"))
+def _diagnose_batch_item(api_key: str, record, car_data, progress, deadline: float):
+    # One fleet item through sufficiency, fan-out and judging; failures stay with the item.
+    chat_ref = record["chatRef"]
+    message_id = record["messageId"]
+    intake = {"initial": record["report"], "questions": record["questions"], "answers": record["answers"]}
+    if time.perf_counter() >= deadline:
+        chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
+        result = {"status": "timed_out", "latencyMs": 0}
+        progress.finished(record, result)
+        return {"index": record["index"], "chatId": chat_ref.id, **result}
+    progress.started(record)
+    started = time.perf_counter()
+    prior_cases = _prior_cases(
+        record["carId"], car_data, " ".join([record["report"], *record["answers"]]), chat_ref.id
+    )
+    with cancellation_scope(chat_ref.id, chat_ref, message_id, CANCEL_POLL_SECONDS) as cancellation:
+        try:
+            outcome = _run_fanout(
+                api_key,
+                chat_ref.id,
+                chat_ref,
+                message_id,
+                car_data,
+                intake,
+                _intake_text(car_data, intake, prior_cases),
+                cancellation,
+            )
+        except Cancelled:
+            outcome = _release_cancelled(chat_ref, chat_ref.id, cancellation, "batch")
+            if time.perf_counter() >= deadline:
+                outcome = {"status": "timed_out"}
+        except Exception as exc:
+            logger.exception("fleet: item failed", extra={"chatId": chat_ref.id})
+            chat_ref.update({"awaitingResponse": False, "updatedAt": _now_ms()})
+            outcome = {"status": "failed", "error": getattr(exc, "message", None) or str(exc)}
+    status = "diagnosed" if outcome.get("status") == "ok" else outcome.get("status")
+    result = {
+        **{key: value for key, value in outcome.items() if value is not None},
+        "status": status,
+        "latencyMs": int((time.perf_counter() - started) * 1000),
+    }
+    progress.finished(record, result)
+    return {"index": record["index"], "chatId": chat_ref.id, **result}
+
 
-    message_text = _extract_user_vehicle_text(content)
+@https_fn.on_call(timeout_sec=540, secrets=["OPENROUTER_API_KEY"], invoker="public")
+@_profiled
+def batch_diagnose(request):
+    # Diagnoses up to BATCH_MAX_ITEMS {carId, report, questions?, answers?} items. Progress
+    # and per-item results stream to diagnosis_batches/{batchId}; the call returns them all.
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INTERNAL,
+            "Missing OPENROUTER_API_KEY",
+        )
+
+    uid = _require_auth(request)
+    try:
+        items = normalize_items((request.data or {}).get("items"), BATCH_MAX_ITEMS)
+    except ValueError as exc:
+        raise https_fn.HttpsError(https_fn.FunctionsErrorCode.INVALID_ARGUMENT, str(exc))
+
+    db = _get_db()
+    car_refs = [db.collection("cars").document(car_id) for car_id in sorted({item["carId"] for item in items})]
+    cars = {}
+    for snapshot in db.get_all(car_refs):
+        car_data = snapshot.to_dict() if snapshot.exists else None
+        if not car_data or car_data.get("userId") != uid:
+            raise https_fn.HttpsError(
+                https_fn.FunctionsErrorCode.NOT_FOUND,
+                f"Car {snapshot.id} not found",
+            )
+        cars[snapshot.id] = car_data
+
+    started = time.perf_counter()
+    batch_ref, records = create_records(db, uid, items, _now_ms)
+    _garage_cache.invalidate(uid)
+    progress = BatchProgress(db, batch_ref, _now_ms)
+    executor = _batch_executor()
+    deadline = started + BATCH_TIME_BUDGET_SECONDS
+    futures = {
+        executor.submit(
+            carry(_diagnose_batch_item), api_key, record, cars[record["carId"]], progress, deadline
+        ): record
+        for record in prefix_order(records, cars)
+    }
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=max(deadline - time.perf_counter(), CANCEL_POLL_SECONDS))
+        if pending and time.perf_counter() >= deadline:
+            # Repeated each poll, in case an item registered its token after the last pass.
+            for future in pending:
+                cancel_local(futures[future]["chatRef"].id, futures[future]["messageId"], _now_ms())
+    results = sorted((future.result() for future in futures), key=lambda result: result["index"])
+
+    elapsed = time.perf_counter() - started
+    counts = Counter(result["status"] for result in results)
+    per_minute = len(results) / elapsed * 60 if elapsed > 0 else 0.0
+    progress.done({"diagnosesPerMinute": round(per_minute, 2)}, "partial" if counts["timed_out"] else "done")
+    METRICS.increment("fleet.items", len(results))
+    METRICS.observe("fleet.batch_ms", elapsed * 1000)
     logger.info(
-        "metadata: evaluating message",
-        extra={"carId": car_id, "chatId": chat_id},
+        "fleet: batch done",
+        extra={
+            "batchId": batch_ref.id,
+            "items": len(results),
+            "statuses": dict(counts),
+            "diagnosesPerMinute": round(per_minute, 2),
+        },
     )
+    return {"batchId": batch_ref.id, "results": results}
 
-    system_prompt = (
-        "You extract vehicle identity metadata from user messages. "
-        "Only return updates if the user explicitly states the information. "
-        "Do not guess. Use the current known data to avoid duplicates."
-    )
-    user_prompt = (
-        "Known vehicle:\n"
-        f"Year: {car_data.get('year', 'unknown')}\n"
-        f"Make: {car_data.get('make', 'unknown')}\n"
-        f"Model: {car_data.get('model', 'unknown')}\n"
-        f"Known engine_type: {known_engine or 'unknown'}\n"
-        f"Known transmission_type: {known_transmission or 'unknown'}\n"
-        f"Known drivetrain: {known_drivetrain or 'unknown'}\n"
-        f"Known fuel_type: {known_fuel or 'unknown'}\n\n"
-        "User message:\n"
-        f"{message_text}"
-    )
 
-    try:
-        response = _call_openrouter(
+@https_fn.on_call(timeout_sec=540, secrets=["OPENROUTER_API_KEY"], invoker="public")
+def backfill_vehicle_enrichment(request):
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INTERNAL,
+            "Missing OPENROUTER_API_KEY",
+        )
+
+    _require_admin(request)
+    payload = request.data or {}
+    job_id = payload.get("jobId")
+    if not isinstance(job_id, str) or not job_id.strip():
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            "Missing jobId",
+        )
+
+    def call_llm(messages, response_format):
+        return _call_openrouter(
             api_key,
-            AGGREGATOR_MODEL,
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
+            BACKFILL_MODEL,
+            messages,
             temperature=0.1,
-            response_format=_vehicle_metadata_response_format(),
+            response_format=response_format,
+            role="enrichment",
         )
+
+    # Each call runs until the time budget; call again with the same jobId to resume.
+    job = BackfillJob(_get_db(), call_llm, job_id.strip(), now_ms=_now_ms)
+    try:
+        return job.run(time_budget_seconds=BACKFILL_TIME_BUDGET_SECONDS)
     except requests.RequestException:
-        logger.exception("metadata: OpenRouter request failed")
-        return
+        raise https_fn.HttpsError(
+            https_fn.FunctionsErrorCode.INTERNAL,
+            "OpenRouter request failed",
+        )
 
-    parsed = _parse_json_content(response)
-    if not parsed or not isinstance(parsed, dict):
-        logger.warning("metadata: invalid JSON response")
+
+@scheduler_fn.on_schedule(schedule="every day 03:00", timeout_sec=540)
+def compact_closed_chats(event):
+    run_compaction(_get_db(), _now_ms, time_budget_seconds=COMPACTION_TIME_BUDGET_SECONDS)
+
+
+@firestore_fn.on_document_written(document="chats/{chatId}/messages/{messageId}")
+def maintain_chat_transcript(event):
+    after = event.data.after if event.data else None
+    data = after.to_dict() if after is not None and after.exists else None
+    chat_ref = _get_db().collection("chats").document(event.params["chatId"])
+    apply_message_write(_get_db(), chat_ref, event.params["messageId"], data)
+
+
+@firestore_fn.on_document_written(document="chats/{chatId}/messages/{messageId}")
+def maintain_intake_state(event):
+    before = event.data.before if event.data else None
+    after = event.data.after if event.data else None
+    before_data = before.to_dict() if before is not None and before.exists else None
+    data = after.to_dict() if after is not None and after.exists else None
+    if (data or before_data or {}).get("promptType") != "intake":
+        return
+    if data is not None and data.get("status") == "streaming":
         return
+    chat_snapshot = _get_db().collection("chats").document(event.params["chatId"]).get()
+    chat_data = (chat_snapshot.to_dict() or {}) if chat_snapshot.exists else {}
+    diagnostic_id = chat_data.get("diagnosticId")
+    if not diagnostic_id:
+        return
+    # A compacted chat is archived; deleting its messages (as compaction did before it
+    # kept them) must not unwind the intake state built from them.
+    if data is None and chat_data.get("compaction"):
+        return
+    diagnostic_ref = _get_db().collection("diagnostics").document(diagnostic_id)
+    _update_intake_state(diagnostic_ref, event.params["messageId"], data)
+
 
-    if not parsed.get("has_update"):
-        logger.info("metadata: no update suggested")
+@firestore_fn.on_document_created(document="chats/{chatId}/aggregations/{aggregationId}")
+def index_case_history(event):
+    snapshot = event.data
+    if snapshot is None or not snapshot.exists:
         return
+    if _index_case(event.params["chatId"], snapshot.to_dict() or {}):
+        logger.info("retrieval: case indexed", extra={"chatId": event.params["chatId"]})
+
 
-    confidence = parsed.get("confidence")
-    if not isinstance(confidence, (int, float)) or confidence < 0.8:
-        logger.info("metadata: low confidence", extra={"confidence": confidence})
+@firestore_fn.on_document_created(document="cars/{carId}")
+def prefill_car_from_vin(event):
+    snapshot = event.data
+    if snapshot is None:
+        logger.warning("vin: missing snapshot data")
+        return
+    car_data = snapshot.to_dict() or {}
+    vin = normalize_vin(car_data.get("vin"))
+    if not vin:
+        logger.info("vin: car has no VIN")
         return
 
-    updates = parsed.get("updates") or {}
-    if not isinstance(updates, dict):
-        logger.warning("metadata: updates not a dict")
+    decoded = decode_vin(vin, year_hint=car_data.get("year"))
+    if not decoded["valid"] or not decoded["checkDigitValid"]:
+        logger.info("vin: VIN failed validation", extra={"vin": vin})
         return
 
-    field_map = {
-        "engine_type": "engineType",
-        "transmission_type": "transmissionType",
-        "drivetrain": "drivetrain",
-        "fuel_type": "fuelType",
-    }
     write_updates = {}
-    for source_key, target_key in field_map.items():
-        value = _normalize_vehicle_text(updates.get(source_key))
-        if not value:
-            continue
-        if value == _normalize_vehicle_text(car_data.get(target_key)):
+    for field, value in decoded["fields"].items():
+        if normalize_vehicle_text(car_data.get(field)):
             continue
-        write_updates[target_key] = value
+        write_updates[field] = value
+    if write_updates:
+        write_updates["vinDecodedFields"] = sorted(write_updates)
+    if not car_data.get("year") and decoded["modelYear"]:
+        write_updates["year"] = decoded["modelYear"]
+    if not normalize_vehicle_text(car_data.get("make")) and decoded["manufacturer"]:
+        write_updates["make"] = decoded["manufacturer"]
 
     if not write_updates:
-        logger.info("metadata: no new fields to write")
+        logger.info("vin: nothing to prefill", extra={"carId": snapshot.id})
         return
 
     write_updates["updatedAt"] = _now_ms()
-    car_ref.update(write_updates)
+    snapshot.reference.update(write_updates)
     logger.info(
-        "metadata: updated car record",
-        extra={"carId": car_id, "updates": write_updates},
+        "vin: prefilled car record",
+        extra={"carId": snapshot.id, "updates": write_updates},
     )
 
 
+def _enrich_car(api_key: str, car_id: str, entries) -> dict:
+    car_ref = _get_db().collection("cars").document(car_id)
+    car_snapshot = car_ref.get()
+    if not car_snapshot.exists:
+        logger.warning("enrichment: car not found", extra={"carId": car_id})
+        return {}
+    car_data = car_snapshot.to_dict() or {}
+    open_fields = open_metadata_fields(car_data)
+    texts = [entry["text"] for entry in entries]
+    logger.info(
+        "enrichment: evaluating batch",
+        extra={"carId": car_id, "messages": len(texts)},
+    )
+
+    response = _call_openrouter(
+        api_key,
+        ENRICHMENT_MODEL,
+        enrichment_messages(car_data, texts, open_fields),
+        temperature=0.1,
+        response_format=vehicle_enrichment_response_format(open_fields),
+        role="enrichment",
+    )
+    parsed = parse_enrichment(response)
+    if parsed is None:
+        logger.info("enrichment: no confident update", extra={"carId": car_id})
+        return {}
+
+    write_updates = apply_car_enrichment(_get_db(), car_ref, parsed, open_fields, _now_ms)
+    if write_updates:
+        logger.info(
+            "enrichment: updated car record",
+            extra={"carId": car_id, "updates": write_updates},
+        )
+    return write_updates
+
+
 @firestore_fn.on_document_created(
     document="chats/{chatId}/messages/{messageId}",
     secrets=["OPENROUTER_API_KEY"],
+    timeout_sec=180,
 )
-def enrich_vehicle_replacements(event):
+def enrich_vehicle_from_messages(event):
     api_key = os.environ.get("OPENROUTER_API_KEY")
     if not api_key:
-        logger.warning("replacements: missing OPENROUTER_API_KEY")
+        logger.warning("enrichment: missing OPENROUTER_API_KEY")
         return
 
     snapshot = event.data
     if snapshot is None:
-        logger.warning("replacements: missing snapshot data")
+        logger.warning("enrichment: missing snapshot data")
         return
     message = snapshot.to_dict() or {}
     if message.get("role") != "user":
-        logger.info("replacements: skipping non-user message")
         return
 
     content = (message.get("content") or "").strip()
     if not content:
-        logger.info("replacements: empty message content")
         return
 
     params = getattr(event, "params", {}) or {}
     chat_id = params.get("chatId")
     if not chat_id:
-        logger.warning("replacements: missing chatId in event params")
+        logger.warning("enrichment: missing chatId in event params")
         return
 
-    chat_ref = _get_db().collection("chats").document(chat_id)
-    chat_snapshot = chat_ref.get()
+    chat_snapshot = _get_db().collection("chats").document(chat_id).get()
     if not chat_snapshot.exists:
-        logger.warning("replacements: chat not found", extra={"chatId": chat_id})
+        logger.warning("enrichment: chat not found", extra={"chatId": chat_id})
         return
-    chat_data = chat_snapshot.to_dict() or {}
-
-    car_id = chat_data.get("carId")
+    car_id = (chat_snapshot.to_dict() or {}).get("carId")
     if not car_id:
-        logger.info("replacements: chat missing carId", extra={"chatId": chat_id})
+        logger.info("enrichment: chat missing carId", extra={"chatId": chat_id})
         return
 
-    car_ref = _get_db().collection("cars").document(car_id)
-    car_snapshot = car_ref.get()
-    if not car_snapshot.exists:
-        logger.warning("replacements: car not found", extra={"carId": car_id})
-        return
-    car_data = car_snapshot.to_dict() or {}
-
-    existing_replacements = car_data.get("Replacements") or []
-    if not isinstance(existing_replacements, list):
-        existing_replacements = []
-    existing_normalized = {str(item).strip().lower() for item in existing_replacements}
-
-    message_text = _extract_user_vehicle_text(content)
-    logger.info(
-        "replacements: evaluating message",
-        extra={"carId": car_id, "chatId": chat_id},
-    )
-
-    system_prompt = (
-        "You extract replacement parts from user messages. "
-        "Only return replacements if the user explicitly says a part was replaced, "
-        "installed, or swapped. Do not guess."
-    )
-    user_prompt = (
-        "Known replacements:\n"
-        f"{', '.join(existing_replacements) if existing_replacements else 'None'}\n\n"
-        "User message:\n"
-        f"{message_text}"
-    )
-
-    try:
-        response = _call_openrouter(
-            api_key,
-            AGGREGATOR_MODEL,
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.1,
-            response_format=_replacement_response_format(),
-        )
-    except requests.RequestException:
-        logger.exception("replacements: OpenRouter request failed")
-        return
-
-    parsed = _parse_json_content(response)
-    if not parsed or not isinstance(parsed, dict):
-        logger.warning("replacements: invalid JSON response")
-        return
-
-    if not parsed.get("has_update"):
-        logger.info("replacements: no update suggested")
-        return
-
-    confidence = parsed.get("confidence")
-    if not isinstance(confidence, (int, float)) or confidence < 0.8:
-        logger.info("replacements: low confidence", extra={"confidence": confidence})
-        return
-
-    replacements = parsed.get("replacements") or []
-    if not isinstance(replacements, list):
-        logger.warning("replacements: replacements not a list")
-        return
-
-    additions = []
-    for item in replacements:
-        if not isinstance(item, str):
-            continue
-        cleaned = item.strip()
-        if not cleaned:
-            continue
-        normalized = cleaned.lower()
-        if normalized in existing_normalized:
-            continue
-        existing_normalized.add(normalized)
-        additions.append(cleaned)
-
-    if not additions:
-        logger.info("replacements: no new replacements to add")
+    # Messages a few seconds apart (report, then answers) share one extraction; only
+    # the message that becomes the batch leader waits and calls the model.
+    queue = EnrichmentQueue(_get_db(), _now_ms)
+    entry = {
+        "text": extract_user_vehicle_text(content),
+        "chatId": chat_id,
+        "createdAt": message.get("createdAt") or _now_ms(),
+    }
+    if not queue.enqueue(car_id, snapshot.id, entry):
         return
-
-    updated_replacements = existing_replacements + additions
-    car_ref.update(
-        {
-            "Replacements": updated_replacements,
-            "updatedAt": _now_ms(),
-        }
-    )
-    logger.info(
-        "replacements: updated car record",
-        extra={"carId": car_id, "additions": additions},
-    )
+    queue.drain(car_id, snapshot.id, lambda entries: _enrich_car(api_key, car_id, entries))
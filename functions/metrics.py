@@ -0,0 +1,66 @@
+import re
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+
+class Metrics:
+    # Process-wide counters and summaries. Cloud Functions instances keep them per
+    # instance; the self-hosted server exposes them on /metrics.
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {name: dict(value) for name, value in self._summaries.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric}_total counter")
+            lines.append(f"{metric}_total {value}")
+        for name, summary in sorted(snapshot["summaries"].items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {summary['count']}")
+            lines.append(f"{metric}_sum {summary['sum']:.3f}")
+            lines.append(f"{metric}_max {summary['max']:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name: str) -> str:
+    return "carllm_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+METRICS = Metrics()
@@ -0,0 +1,160 @@
+import re
+
+# Failure-pattern priors: how often each (normalized) diagnosis comes up for a vehicle
+# group. A group is a YEAR_RANGE-year span of one make and model, per engine and across
+# engines, one failure_priors doc each. Title counts are a space-saving summary of at most
+# MAX_TITLES entries, so a doc stays the same size after millions of cases while the
+# frequent titles keep (slightly over-estimated) counts.
+
+PRIORS_COLLECTION = "failure_priors"
+YEAR_RANGE = 5
+MAX_TITLES = 128
+MAX_TITLE_CHARS = 60
+ANY_ENGINE = "*"
+
+# Canonical title -> phrases a diagnosis uses for it. The first match in this order wins,
+# so parts named as a symptom's cause (coil, plug) come before the systems they sit in.
+TITLE_SYNONYMS = {
+    "ignition coil failure": ("ignition coil", "coil pack", "coil packs", "coil on plug", "coil-on-plug"),
+    "spark plug wear": ("spark plug", "spark plugs", "plug gap"),
+    "fuel injector fault": ("fuel injector", "injector", "injectors"),
+    "vacuum leak": ("vacuum leak", "intake leak", "intake manifold gasket", "pcv hose"),
+    "mass airflow sensor fault": ("mass airflow", "mass air flow", "maf sensor", "maf"),
+    "oxygen sensor failure": ("oxygen sensor", "o2 sensor", "air fuel ratio sensor", "a/f sensor"),
+    "catalytic converter failure": ("catalytic converter", "cat converter", "catalyst efficiency"),
+    "evap system leak": ("evap", "gas cap", "fuel cap", "purge valve", "purge solenoid"),
+    "egr valve fault": ("egr valve", "egr"),
+    "throttle body fault": ("throttle body",),
+    "fuel pump failure": ("fuel pump",),
+    "timing chain wear": ("timing chain", "timing belt", "chain tensioner"),
+    "head gasket failure": ("head gasket",),
+    "thermostat failure": ("thermostat",),
+    "water pump failure": ("water pump",),
+    "coolant leak": ("coolant leak", "radiator leak", "radiator", "heater hose", "coolant hose"),
+    "alternator failure": ("alternator", "charging system", "voltage regulator"),
+    "starter failure": ("starter motor", "starter solenoid", "starter"),
+    "battery failure": ("battery", "battery terminal", "battery terminals"),
+    "serpentine belt wear": ("serpentine belt", "drive belt", "belt tensioner"),
+    "brake pad wear": ("brake pad", "brake pads"),
+    "brake rotor wear": ("brake rotor", "brake rotors", "rotor", "rotors", "warped rotor"),
+    "brake caliper fault": ("brake caliper", "caliper", "sticking caliper"),
+    "wheel bearing failure": ("wheel bearing", "hub bearing", "hub assembly"),
+    "cv axle failure": ("cv axle", "cv joint", "cv boot"),
+    "transmission fluid issue": ("transmission fluid", "atf"),
+    "transmission solenoid fault": ("shift solenoid", "transmission solenoid", "valve body"),
+}
+_TITLE_PATTERNS = [
+    (title, re.compile(r"\b(?:" + "|".join(re.escape(phrase) for phrase in phrases) + r")\b", re.IGNORECASE))
+    for title, phrases in TITLE_SYNONYMS.items()
+]
+_QUALIFIERS = re.compile(
+    r"^(?:(?:a|an|the|failed|failing|faulty|bad|worn|defective|damaged|broken|possible|likely|probable)\s+)+"
+)
+
+
+def normalize_title(diagnosis: str) -> str:
+    text = str(diagnosis or "").strip()
+    if not text:
+        return ""
+    for title, pattern in _TITLE_PATTERNS:
+        if pattern.search(text):
+            return title
+    text = re.sub(r"[^a-z0-9 ]+", " ", text.lower())
+    text = _QUALIFIERS.sub("", " ".join(text.split()))
+    return text[:MAX_TITLE_CHARS].strip()
+
+
+def prior_title(diagnosis: str) -> str:
+    # Priors are shared across users and end up in prompts, so only the canonical titles
+    # are counted; free text is "".
+    title = normalize_title(diagnosis)
+    return title if title in TITLE_SYNONYMS else ""
+
+
+def _slug(value) -> str:
+    return re.sub(r"[^a-z0-9.]+", "-", str(value or "").strip().lower()).strip("-")
+
+
+def vehicle_group(car_data) -> dict:
+    # None when the car lacks a usable year, make or model.
+    try:
+        year = int(str(car_data.get("year") or "").strip())
+    except ValueError:
+        return None
+    make = _slug(car_data.get("make"))
+    model = _slug(car_data.get("model"))
+    if not make or not model:
+        return None
+    start = year - year % YEAR_RANGE
+    return {
+        "years": f"{start}-{start + YEAR_RANGE - 1}",
+        "make": make,
+        "model": model,
+        # engineType is what VIN prefill and enrichment fill in; engine is set by hand.
+        "engine": _slug(car_data.get("engine") or car_data.get("engineType")) or ANY_ENGINE,
+    }
+
+
+def prior_doc_ids(group) -> list:
+    # Most specific first: the engine-level doc, then the doc across engines.
+    if not group:
+        return []
+    ids = [f"{group['years']}|{group['make']}|{group['model']}|{engine}" for engine in (group["engine"], ANY_ENGINE)]
+    return ids[:1] if ids[0] == ids[1] else ids
+
+
+def group_from_doc_id(doc_id: str) -> dict:
+    # Inverse of prior_doc_ids for one doc: its group fields, with the doc's engine.
+    years, make, model, engine = doc_id.split("|")
+    return {"years": years, "make": make, "model": model, "engine": engine}
+
+
+def apply_prior(data, removed: str, added: str, group, engine: str) -> dict:
+    # Moves one case from the removed title (a chat's earlier verdict) to the added one.
+    data = data or {}
+    titles = dict(data.get("titles") or {})
+    total = data.get("total") or 0
+    if removed:
+        total -= 1
+        if removed in titles:
+            titles[removed] -= 1
+            if titles[removed] <= 0:
+                del titles[removed]
+    if added:
+        total += 1
+        if added in titles or len(titles) < MAX_TITLES:
+            titles[added] = titles.get(added, 0) + 1
+        else:
+            # Space-saving: the rarest title makes way and its count carries over.
+            floor = min(titles, key=titles.__getitem__)
+            titles[added] = titles.pop(floor) + 1
+    return {**group, "engine": engine, "total": max(total, 0), "titles": titles}
+
+
+def top_priors(docs, k: int, min_support: int = 0) -> dict:
+    # docs are prior docs (or None) most specific first; the first with enough cases wins.
+    candidates = [doc for doc in docs if doc and doc.get("total")]
+    if not candidates:
+        return {"level": None, "total": 0, "priors": []}
+    chosen = next((doc for doc in candidates if doc["total"] >= min_support), None)
+    if chosen is None:
+        chosen = max(candidates, key=lambda doc: doc["total"])
+    total = chosen["total"]
+    # Docs written before free text was dropped may still hold it.
+    titles = [item for item in (chosen.get("titles") or {}).items() if item[0] in TITLE_SYNONYMS]
+    titles = sorted(titles, key=lambda item: (-item[1], item[0]))[:k]
+    return {
+        "level": "model" if chosen.get("engine") == ANY_ENGINE else "engine",
+        "total": total,
+        "priors": [
+            {"title": title, "count": count, "share": round(min(count, total) / total, 3)}
+            for title, count in titles
+        ],
+    }
+
+
+def format_priors(result) -> str:
+    if not result.get("priors"):
+        return ""
+    lines = [f"- {prior['title']} ({prior['share']:.0%})" for prior in result["priors"]]
+    return f"Common failures for similar vehicles ({result['total']} diagnoses):\n" + "\n".join(lines)
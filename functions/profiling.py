@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Opt-in wall-clock sampling profiler for single invocations. While a profile runs, a
+# sampler thread snapshots the stacks of the threads working for that invocation (the
+# callable's own thread plus any fan-out workers it hands work to via carry()), so time
+# spent blocked on the network shows up as well as CPU. Results are collapsed stacks,
+# "stage;thread;outer;...;inner count", ready for flamegraph.pl or speedscope. Nothing
+# here runs unless a profile was requested: carry() hands back the function untouched.
+
+PROFILE_DIR_ENV = "PROFILE_DIR"
+DEFAULT_INTERVAL_MS = 5
+MAX_DEPTH = 64
+
+_local = threading.local()
+
+
+def _frame_name(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{code.co_name}"
+
+
+def _stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, stage: str, tags=None, interval_ms: float = DEFAULT_INTERVAL_MS):
+        self.stage = stage
+        self.tags = dict(tags or {})
+        self.interval_ms = interval_ms
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_ms = None
+        self.wall_ms = 0.0
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._thread_ms = Counter()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def start(self):
+        self.started_ms = int(time.time() * 1000)
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        self.wall_ms = (time.perf_counter() - self._started) * 1000
+
+    @contextmanager
+    def track(self):
+        # Samples the current thread, and lets carry() see this profile, until exit.
+        thread = threading.current_thread()
+        previous = getattr(_local, "profile", None)
+        _local.profile = self
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._threads.pop(thread.ident, None)
+                self._thread_ms[thread.name] += (time.perf_counter() - started) * 1000
+            _local.profile = previous
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_ms / 1000):
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self._threads.items())
+        for ident, name in threads:
+            frame = frames.get(ident)
+            if frame is not None:
+                self.stacks[(self.stage, name) + _stack(frame)] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        with self._lock:
+            thread_ms = {name: round(ms, 1) for name, ms in self._thread_ms.items()}
+        return {
+            **self.tags,
+            "stage": self.stage,
+            "startedAt": self.started_ms,
+            "wallMs": round(self.wall_ms, 1),
+            "intervalMs": self.interval_ms,
+            "samples": self.samples,
+            "threadMs": thread_ms,
+        }
+
+
+def carry(fn):
+    # Wraps work handed to another thread so it is sampled with the current profile.
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with profile.track():
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def run_profiled(profile: SamplingProfiler, fn, *args):
+    profile.start()
+    try:
+        with profile.track():
+            return fn(*args)
+    finally:
+        profile.stop()
+
+
+class ProfileStore:
+    # Local-disk stand-in for a bucket: {root}/{chatId}/{stage}/{startedAt}.collapsed, with
+    # the summary next to it as .json.
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, profile: SamplingProfiler) -> str:
+        chat_id = re.sub(r"[^A-Za-z0-9_-]", "_", str(profile.tags.get("chatId") or "none"))
+        directory = os.path.join(self.root, chat_id, profile.stage)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, str(profile.started_ms))
+        with open(base + ".collapsed", "w", encoding="utf-8") as handle:
+            handle.write(profile.collapsed())
+        with open(base + ".json", "w", encoding="utf-8") as handle:
+            json.dump(profile.summary(), handle, indent=2)
+        return base + ".collapsed"
+
+
+def store_from_env() -> ProfileStore:
+    return ProfileStore(os.environ.get(PROFILE_DIR_ENV) or os.path.join(tempfile.gettempdir(), "carllm-profiles"))
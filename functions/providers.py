@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+# Routes chat-completion calls across OpenAI-compatible endpoints. Each call names a
+# logical role (followup, chat, fanout, aggregator, enrichment) and the model the
+# pipeline asked for; the route table turns that into an ordered list of targets:
+#
+#     {
+#       "endpoints": {
+#         "local": {"url": "http://127.0.0.1:8081/v1/chat/completions",
+#                   "apiKeyEnv": "LOCAL_LLM_API_KEY", "expectedTtftMs": 800}
+#       },
+#       "routes": {
+#         "followup": ["openrouter", {"endpoint": "local", "model": "qwen2.5-7b-instruct"}],
+#         "fanout:x-ai/grok-4.1-fast": ["openrouter"],
+#         "*": ["openrouter"]
+#       },
+#       "ttftDeadlineMs": 15000
+#     }
+#
+# A bare endpoint name keeps the requested model id. Lookup order is "role:model",
+# "model", "role", then "*". PROVIDERS_CONFIG holds the JSON inline or a path to it;
+# LOCAL_LLM_URL (+ LOCAL_LLM_MODEL) alone appends a local server as the last resort for
+# every route. The built-in "openrouter" endpoint is the only one sent the OpenRouter
+# secret; other endpoints authenticate with their own apiKeyEnv, if any.
+
+CONFIG_ENV = "PROVIDERS_CONFIG"
+LOCAL_URL_ENV = "LOCAL_LLM_URL"
+LOCAL_MODEL_ENV = "LOCAL_LLM_MODEL"
+LOCAL_API_KEY_ENV = "LOCAL_LLM_API_KEY"
+
+OPENROUTER = "openrouter"
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+DEFAULT_TTFT_DEADLINE_MS = int(os.environ.get("PROVIDER_TTFT_DEADLINE_MS", "20000"))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get("PROVIDER_CONNECT_TIMEOUT", "5"))
+COOLDOWN_SECONDS = 30
+EWMA_ALPHA = 0.3
+# Statuses worth retrying elsewhere; anything else is the request's fault.
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class TTFTDeadlineExceeded(requests.Timeout):
+    pass
+
+
+class Endpoint:
+    def __init__(self, name: str, url: str, api_key_env=None, expected_ttft_ms: float = 0.0,
+                 uses_secret: bool = False):
+        self.name = name
+        self.url = url
+        self.api_key_env = api_key_env
+        self.expected_ttft_ms = expected_ttft_ms
+        self.uses_secret = uses_secret
+
+    def headers(self, secret) -> dict:
+        headers = {"Content-Type": "application/json"}
+        key = secret if self.uses_secret else os.environ.get(self.api_key_env or "")
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        return headers
+
+
+class Target:
+    def __init__(self, endpoint: Endpoint, model: str):
+        self.endpoint = endpoint
+        self.model = model
+
+    def __repr__(self):
+        return f"Target({self.endpoint.name}, {self.model})"
+
+
+def retryable(exc: Exception) -> bool:
+    # Connect failures and deadlines move on to the next endpoint, as do overloaded
+    # or failing upstreams. Read errors after content has streamed are not retried.
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRYABLE_STATUSES
+    return False
+
+
+class Router:
+    def __init__(self, endpoints, routes, ttft_deadline_ms: float = DEFAULT_TTFT_DEADLINE_MS,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 cooldown_seconds: float = COOLDOWN_SECONDS, clock=time.monotonic):
+        self.endpoints = endpoints
+        self.routes = routes
+        self.ttft_deadline_ms = ttft_deadline_ms
+        self.connect_timeout = connect_timeout
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ttft = {}
+        self._cooldown_until = {}
+
+    def _route(self, model: str, role=None):
+        for key in (f"{role}:{model}" if role else None, model, role, "*"):
+            if key and key in self.routes:
+                return self.routes[key]
+        return [OPENROUTER]
+
+    def candidates(self, model: str, role=None) -> list:
+        targets = []
+        for entry in self._route(model, role):
+            if isinstance(entry, str):
+                name, target_model = entry, model
+            else:
+                name, target_model = entry["endpoint"], entry.get("model") or model
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                raise ValueError(f"Route for {role or model!r} names unknown endpoint {name!r}")
+            targets.append(Target(endpoint, target_model))
+        now = self._clock()
+        with self._lock:
+            ranked = [
+                (
+                    self._cooldown_until.get(target.endpoint.name, 0) > now,
+                    self._ttft.get(target.endpoint.name, target.endpoint.expected_ttft_ms),
+                    index,
+                    target,
+                )
+                for index, target in enumerate(targets)
+            ]
+        # Healthy endpoints first, fastest observed TTFT first; ties keep config order.
+        # Cooling-down endpoints stay at the back so a route never runs out of targets.
+        ranked.sort(key=lambda item: item[:3])
+        return [item[3] for item in ranked]
+
+    def observe_ttft(self, endpoint: Endpoint, ttft_ms: float):
+        with self._lock:
+            previous = self._ttft.get(endpoint.name)
+            if previous is None:
+                self._ttft[endpoint.name] = ttft_ms
+            else:
+                self._ttft[endpoint.name] = previous + EWMA_ALPHA * (ttft_ms - previous)
+            self._cooldown_until.pop(endpoint.name, None)
+
+    def mark_failed(self, endpoint: Endpoint):
+        with self._lock:
+            self._cooldown_until[endpoint.name] = self._clock() + self.cooldown_seconds
+
+    def stats(self) -> dict:
+        now = self._clock()
+        with self._lock:
+            return {
+                name: {
+                    "ttftMs": self._ttft.get(name),
+                    "coolingDown": self._cooldown_until.get(name, 0) > now,
+                }
+                for name in self.endpoints
+            }
+
+
+def _load_config(raw: str) -> dict:
+    raw = raw.strip()
+    if not raw.startswith("{"):
+        with open(raw, encoding="utf-8") as handle:
+            raw = handle.read()
+    return json.loads(raw)
+
+
+def router_from_env() -> Router:
+    config = _load_config(os.environ[CONFIG_ENV]) if os.environ.get(CONFIG_ENV) else {}
+    endpoints = {
+        OPENROUTER: Endpoint(OPENROUTER, OPENROUTER_URL, uses_secret=True),
+    }
+    for name, spec in (config.get("endpoints") or {}).items():
+        endpoints[name] = Endpoint(
+            name,
+            spec["url"],
+            api_key_env=spec.get("apiKeyEnv"),
+            expected_ttft_ms=float(spec.get("expectedTtftMs", 0)),
+            uses_secret=name == OPENROUTER,
+        )
+    routes = dict(config.get("routes") or {})
+    routes.setdefault("*", [OPENROUTER])
+
+    local_url = os.environ.get(LOCAL_URL_ENV)
+    if local_url and "local" not in endpoints:
+        endpoints["local"] = Endpoint("local", local_url, api_key_env=LOCAL_API_KEY_ENV)
+        fallback = {"endpoint": "local", "model": os.environ.get(LOCAL_MODEL_ENV)}
+        routes = {key: list(entries) + [fallback] for key, entries in routes.items()}
+
+    return Router(
+        endpoints,
+        routes,
+        ttft_deadline_ms=float(config.get("ttftDeadlineMs", DEFAULT_TTFT_DEADLINE_MS)),
+        connect_timeout=float(config.get("connectTimeoutSeconds", DEFAULT_CONNECT_TIMEOUT)),
+        cooldown_seconds=float(config.get("cooldownSeconds", COOLDOWN_SECONDS)),
+    )
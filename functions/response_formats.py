@@ -0,0 +1,223 @@
+from functools import lru_cache
+
+VEHICLE_METADATA_FIELDS = {
+    "engine_type": "engineType",
+    "transmission_type": "transmissionType",
+    "drivetrain": "drivetrain",
+    "fuel_type": "fuelType",
+}
+
+
+class FrozenDict(dict):
+    # Still a dict for json.dumps, but shared constants cannot be edited per request.
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("response formats are read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def _json_schema_format(name: str, schema: dict):
+    return freeze(
+        {
+            "type": "json_schema",
+            "json_schema": {"name": name, "strict": True, "schema": schema},
+        }
+    )
+
+
+def question_response_format(name: str = "followup_questions"):
+    return _json_schema_format(
+        name,
+        {
+            "type": "object",
+            "properties": {
+                "questions": {
+                    "type": "array",
+                    "description": "Short, single-focus diagnostic questions",
+                    "items": {"type": "string"},
+                }
+            },
+            "required": ["questions"],
+            "additionalProperties": False,
+        },
+    )
+
+
+@lru_cache(maxsize=16)
+def vehicle_metadata_response_format(fields=None):
+    fields = fields or tuple(VEHICLE_METADATA_FIELDS)
+    return _json_schema_format(
+        "vehicle_metadata_update",
+        {
+            "type": "object",
+            "properties": {
+                "has_update": {"type": "boolean"},
+                "confidence": {
+                    "type": "number",
+                    "description": "Confidence from 0 to 1 that updates are correct",
+                },
+                "updates": {
+                    "type": "object",
+                    "properties": {field: {"type": "string"} for field in fields},
+                    "additionalProperties": False,
+                },
+            },
+            "required": ["has_update", "confidence", "updates"],
+            "additionalProperties": False,
+        },
+    )
+
+
+@lru_cache(maxsize=16)
+def vehicle_enrichment_response_format(fields=None):
+    fields = tuple(VEHICLE_METADATA_FIELDS) if fields is None else fields
+    return _json_schema_format(
+        "vehicle_enrichment_update",
+        {
+            "type": "object",
+            "properties": {
+                "has_update": {"type": "boolean"},
+                "confidence": {
+                    "type": "number",
+                    "description": "Confidence from 0 to 1 that updates are correct",
+                },
+                "updates": {
+                    "type": "object",
+                    "properties": {field: {"type": "string"} for field in fields},
+                    "additionalProperties": False,
+                },
+                "replacements": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                },
+            },
+            "required": ["has_update", "confidence", "updates", "replacements"],
+            "additionalProperties": False,
+        },
+    )
+
+
+INTAKE_QUESTIONS_FORMAT = question_response_format("intake_questions")
+
+VEHICLE_METADATA_FORMAT = vehicle_metadata_response_format()
+
+REPLACEMENTS_FORMAT = _json_schema_format(
+    "vehicle_replacements_update",
+    {
+        "type": "object",
+        "properties": {
+            "has_update": {"type": "boolean"},
+            "confidence": {
+                "type": "number",
+                "description": "Confidence from 0 to 1 that updates are correct",
+            },
+            "replacements": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+        },
+        "required": ["has_update", "confidence", "replacements"],
+        "additionalProperties": False,
+    },
+)
+
+SUFFICIENCY_FORMAT = _json_schema_format(
+    "diagnosis_sufficiency",
+    {
+        "type": "object",
+        "properties": {
+            "is_sufficient": {"type": "boolean"},
+            "confidence": {
+                "type": "number",
+                "description": "Confidence from 0 to 1 that a single diagnosis is correct",
+            },
+            "followup_questions": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+        },
+        "required": ["is_sufficient", "confidence", "followup_questions"],
+        "additionalProperties": False,
+    },
+)
+
+FANOUT_FORMAT = _json_schema_format(
+    "fanout_diagnosis",
+    {
+        "type": "object",
+        "properties": {
+            "primary_diagnosis": {
+                "type": "string",
+                "description": "Short title of the most likely failure",
+            },
+            "root_causes": {
+                "type": "array",
+                "description": "Likely root causes, most likely first",
+                "items": {"type": "string"},
+            },
+            "next_checks": {
+                "type": "array",
+                "description": "The next 2-3 checks that would confirm the diagnosis",
+                "items": {"type": "string"},
+            },
+            "confidence": {
+                "type": "number",
+                "description": "Confidence from 0 to 1 in the primary diagnosis",
+            },
+            "explanation": {
+                "type": "string",
+                "description": "Two to four sentences for the owner",
+            },
+        },
+        "required": [
+            "primary_diagnosis",
+            "root_causes",
+            "next_checks",
+            "confidence",
+            "explanation",
+        ],
+        "additionalProperties": False,
+    },
+)
+
+JUDGEMENT_FORMAT = _json_schema_format(
+    "diagnosis_judgement",
+    {
+        "type": "object",
+        "properties": {
+            "model_name": {
+                "type": "string",
+                "description": "The winning model identifier",
+            },
+            "diagnostic_answer": {
+                "type": "string",
+                "description": "Short title of what is wrong with the car",
+            },
+            "justifacation": {
+                "type": "array",
+                "description": "Bullet point reasons supporting the diagnosis",
+                "items": {"type": "string"},
+            },
+            "explanation": {
+                "type": "string",
+                "description": "Concise explanation for the user",
+            },
+        },
+        "required": [
+            "model_name",
+            "diagnostic_answer",
+            "justifacation",
+            "explanation",
+        ],
+        "additionalProperties": False,
+    },
+)
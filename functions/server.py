@@ -0,0 +1,276 @@
+# Self-hosted entry point for running CarLLM outside Cloud Functions:
+#
+#     python -m server http --bind 0.0.0.0:8000 --workers 4
+#     python -m server events
+#
+# "http" serves the callables over the Firebase callable protocol with gunicorn, so the
+# web client only needs a different functions origin. "events" runs the Firestore
+# listeners that stand in for the document triggers; run exactly one. Point
+# FIRESTORE_EMULATOR_HOST / FIREBASE_AUTH_EMULATOR_HOST at the emulators from
+# firebase.json to run everything locally.
+
+import argparse
+import logging
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from flask import Flask, Response, request
+from firebase_functions import firestore_fn
+
+import main
+from metrics import METRICS
+
+logger = logging.getLogger("carllm")
+
+CALLABLE_ENDPOINTS = (
+    "question_prompt",
+    "fanout_diagnosis",
+    "chat_reply",
+    "cancel_generation",
+    "batch_diagnose",
+    "list_garage",
+    "vehicle_catalog_lookup",
+    "failure_priors",
+    "backfill_vehicle_enrichment",
+)
+DRAIN_TIMEOUT_SECONDS = 60
+EVENT_WORKERS = 8
+
+# Document triggers replayed by the local event source, keyed by collection pattern.
+MESSAGE_TRIGGERS = {
+    "created": ("enrich_vehicle_from_messages",),
+    "written": ("maintain_chat_transcript", "maintain_intake_state"),
+}
+CAR_TRIGGERS = {"created": ("prefill_car_from_vin",), "written": ()}
+AGGREGATION_TRIGGERS = {"created": ("index_case_history",), "written": ()}
+# Wildcard names in the trigger paths ("chats/{chatId}/messages/{messageId}").
+PATH_PARAMS = {"cars": "carId", "chats": "chatId", "messages": "messageId", "aggregations": "aggregationId"}
+
+
+class _Drain:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.in_flight = 0
+        self.draining = False
+
+    def enter(self) -> bool:
+        with self._lock:
+            if self.draining:
+                return False
+            self.in_flight += 1
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        with self._lock:
+            self.draining = True
+            return self._idle.wait_for(lambda: not self.in_flight, timeout)
+
+
+DRAIN = _Drain()
+
+
+def shutdown_shared_resources(timeout: float = DRAIN_TIMEOUT_SECONDS):
+    # Stop taking requests, let in-flight ones finish, then release the shared pools.
+    drained = DRAIN.wait(timeout)
+    for executor in main.shared_executors():
+        executor.shutdown(wait=drained)
+    main._http_session().close()
+    logger.info("server: drained", extra={"clean": drained})
+
+
+def _dispatch(name: str):
+    def view():
+        if not DRAIN.enter():
+            return Response("Draining", status=503, headers={"Retry-After": "1"})
+        try:
+            with METRICS.timer(f"http.{name}_ms"):
+                return getattr(main, name)(request)
+        finally:
+            DRAIN.exit()
+
+    view.__name__ = f"dispatch_{name}"
+    return view
+
+
+def create_app() -> Flask:
+    app = Flask("carllm")
+    for name in CALLABLE_ENDPOINTS:
+        app.add_url_rule(f"/{name}", view_func=_dispatch(name), methods=["POST", "OPTIONS"])
+    app.add_url_rule("/hello", view_func=lambda: main.hello(request), endpoint="hello")
+
+    @app.get("/healthz")
+    def healthz():
+        return "ok"
+
+    @app.get("/readyz")
+    def readyz():
+        if DRAIN.draining:
+            return Response("draining", status=503)
+        return "ready"
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(METRICS.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+def _params(path: str) -> dict:
+    # "chats/c1/messages/m1" -> {"chatId": "c1", "messageId": "m1"}
+    segments = path.split("/")
+    params = {}
+    for collection, doc_id in zip(segments[::2], segments[1::2]):
+        params[PATH_PARAMS[collection]] = doc_id
+    return params
+
+
+def _event(snapshot, data) -> firestore_fn.Event:
+    path = snapshot.reference.path
+    return firestore_fn.Event(
+        specversion="1.0",
+        id=uuid.uuid4().hex,
+        source="carllm.local",
+        type="google.cloud.firestore.document.v1.local",
+        time=datetime.now(timezone.utc),
+        data=data,
+        subject=f"documents/{path}",
+        location="local",
+        project="local",
+        database="(default)",
+        namespace="(default)",
+        document=path,
+        params=_params(path),
+    )
+
+
+class LocalEventSource:
+    # Firestore listeners that invoke the document trigger functions in-process. The
+    # first snapshot of each listener is the existing data and is skipped.
+    def __init__(self, db, workers: int = EVENT_WORKERS):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="events")
+        self._watches = []
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for query, triggers in (
+            (self._db.collection_group("messages"), MESSAGE_TRIGGERS),
+            (self._db.collection("cars"), CAR_TRIGGERS),
+            (self._db.collection_group("aggregations"), AGGREGATION_TRIGGERS),
+        ):
+            self._watches.append(query.on_snapshot(self._listener(triggers)))
+
+    def _listener(self, triggers):
+        state = {"initial": True}
+
+        def on_snapshot(snapshots, changes, read_time):
+            if state["initial"]:
+                state["initial"] = False
+                with self._lock:
+                    for snapshot in snapshots:
+                        self._previous[snapshot.reference.path] = snapshot
+                return
+            for change in changes:
+                self._handle(change, triggers)
+
+        return on_snapshot
+
+    def _handle(self, change, triggers):
+        snapshot = change.document
+        path = snapshot.reference.path
+        kind = change.type.name
+        with self._lock:
+            before = self._previous.get(path)
+            if kind == "REMOVED":
+                self._previous.pop(path, None)
+                before, after = snapshot, None
+            else:
+                self._previous[path] = snapshot
+                after = snapshot
+        if kind == "ADDED":
+            for name in triggers["created"]:
+                self._submit(name, _event(snapshot, snapshot))
+        for name in triggers["written"]:
+            self._submit(name, _event(snapshot, firestore_fn.Change(before=before, after=after)))
+
+    def _submit(self, name: str, event):
+        handler = getattr(main, name).__wrapped__
+
+        def run():
+            METRICS.increment(f"events.{name}")
+            try:
+                with METRICS.timer(f"events.{name}_ms"):
+                    handler(event)
+            except Exception:
+                METRICS.increment(f"events.{name}.errors")
+                logger.exception("events: handler failed", extra={"trigger": name})
+
+        self._executor.submit(run)
+
+    def stop(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._executor.shutdown(wait=True, cancel_futures=False)
+
+
+def _serve_http(bind: str, workers: int, threads: int):
+    from gunicorn.app.base import BaseApplication
+
+    class _Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("timeout", main.REQUEST_TIMEOUT + 60)
+            self.cfg.set("graceful_timeout", DRAIN_TIMEOUT_SECONDS)
+            self.cfg.set("worker_exit", lambda server, worker: shutdown_shared_resources())
+
+        def load(self):
+            return create_app()
+
+    _Server().run()
+
+
+def _serve_events():
+    source = LocalEventSource(main._get_db())
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    source.start()
+    logger.info("events: listening")
+    while not stopped.is_set():
+        time.sleep(0.5)
+    source.stop()
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    http = commands.add_parser("http", help="serve the callables")
+    http.add_argument("--bind", default="127.0.0.1:8000")
+    http.add_argument("--workers", type=int, default=2)
+    http.add_argument("--threads", type=int, default=16)
+    commands.add_parser("events", help="run the local document triggers")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "http":
+        _serve_http(args.bind, args.workers, args.threads)
+    else:
+        _serve_events()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,170 @@
+import json
+import re
+
+# A trailing lone backslash or unfinished \uXXXX escape in a string cut mid-stream.
+_PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+
+
+def parse_json_content(content: str):
+    if not isinstance(content, str):
+        return None
+    trimmed = content.strip()
+    if not trimmed:
+        return None
+    if trimmed.startswith("```"):
+        lines = trimmed.split("\n")
+        lines.pop(0)
+        if lines and lines[-1].strip().startswith("```"):
+            lines.pop()
+        trimmed = "\n".join(lines).strip()
+    if not trimmed.startswith("{") or not trimmed.endswith("}"):
+        return None
+    try:
+        return json.loads(trimmed)
+    except json.JSONDecodeError:
+        return None
+
+
+class StreamingJsonArrayParser:
+    # Incremental parser for a streamed top-level JSON object. Strings inside the
+    # watched top-level arrays are emitted as soon as their closing quote arrives.
+    def __init__(self, array_keys=("questions", "followup_questions")):
+        self._array_keys = set(array_keys)
+        self._raw = []
+        self._started = False
+        self._done = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._chars = []
+        self._scalar = None
+        self.items = {}
+        self.values = {}
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, text: str):
+        emitted = []
+        if not text:
+            return emitted
+        self._raw.append(text)
+        for char in text:
+            if self._done:
+                break
+            if not self._started:
+                # Skips code fences and any preamble before the object opens.
+                if char == "{":
+                    self._started = True
+                    self._stack.append({"kind": "{", "expect_key": True, "key": None})
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._chars.append(char)
+                    self._escape = False
+                elif char == "\\":
+                    self._chars.append(char)
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._close_string(emitted)
+                else:
+                    self._chars.append(char)
+                continue
+            if self._scalar is not None:
+                if char not in ",}] \t\r\n":
+                    self._scalar.append(char)
+                    continue
+                self._close_scalar()
+            self._consume(char)
+        return emitted
+
+    def _consume(self, char: str):
+        top = self._stack[-1]
+        if char == '"':
+            self._in_string = True
+            self._chars = []
+        elif char in "{[":
+            key = top["key"] if top["kind"] == "{" else None
+            watched = char == "[" and len(self._stack) == 1 and key in self._array_keys
+            if watched:
+                self.items.setdefault(key, [])
+            self._stack.append(
+                {
+                    "kind": char,
+                    "expect_key": char == "{",
+                    "key": None,
+                    "watched": key if watched else None,
+                }
+            )
+        elif char in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self._done = True
+        elif char == ":":
+            top["expect_key"] = False
+        elif char == ",":
+            if top["kind"] == "{":
+                top["expect_key"] = True
+                top["key"] = None
+        elif not char.isspace():
+            self._scalar = [char]
+
+    def _close_string(self, emitted):
+        raw = "".join(self._chars)
+        try:
+            value = json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            value = raw
+        top = self._stack[-1]
+        if top["kind"] == "{" and top["expect_key"]:
+            top["key"] = value
+        elif top.get("watched"):
+            self.items[top["watched"]].append(value)
+            emitted.append(value)
+        elif len(self._stack) == 1:
+            self.values[top["key"]] = value
+
+    def _close_scalar(self):
+        raw = "".join(self._scalar)
+        self._scalar = None
+        if len(self._stack) != 1:
+            return
+        try:
+            self.values[self._stack[0]["key"]] = json.loads(raw)
+        except json.JSONDecodeError:
+            pass
+
+    def snapshot(self) -> dict:
+        # Completed top-level values and array items, plus the top-level string still
+        # streaming, so partial output can be shown as valid JSON.
+        state = {**self.values, **{key: list(items) for key, items in self.items.items()}}
+        if self._in_string and self._stack:
+            top = self._stack[-1]
+            text = _decode_partial("".join(self._chars))
+            if len(self._stack) == 1 and not top["expect_key"] and top["key"] is not None:
+                state[top["key"]] = text
+            elif top.get("watched") and text:
+                state[top["watched"]] = state[top["watched"]] + [text]
+        return state
+
+    def result(self):
+        parsed = parse_json_content("".join(self._raw))
+        if isinstance(parsed, dict):
+            return parsed
+        # Truncated or malformed output: keep whatever completed before the cut.
+        if self._scalar is not None and not self._in_string:
+            self._close_scalar()
+        if not self.values and not self.items:
+            return None
+        return {**self.values, **{key: list(items) for key, items in self.items.items()}}
+
+
+def _decode_partial(raw: str) -> str:
+    for candidate in (raw, _PARTIAL_ESCAPE.sub("", raw)):
+        try:
+            return json.loads(f'"{candidate}"')
+        except json.JSONDecodeError:
+            continue
+    return raw
@@ -0,0 +1,37 @@
+import json
+
+from backfill import BackfillJob, _chunk_texts
+from local_firestore import LocalFirestore
+
+
+def test_chunk_texts_respects_message_and_char_limits():
+    assert list(_chunk_texts(["a", "b", "c"], 2, 100)) == [["a", "b"], ["c"]]
+    assert list(_chunk_texts(["aaaa", "bbbb", "c"], 10, 6)) == [["aaaa"], ["bbbb", "c"]]
+
+
+def test_process_car_merges_chunks_with_dedup_and_confidence():
+    db = LocalFirestore(
+        {"cars/car1": {"Replacements": ["Alternator"], "vinDecodedFields": ["fuelType"]}}
+    )
+    responses = [
+        {"has_update": True, "confidence": 0.9, "updates": {"engine_type": "2.0L I4"},
+         "replacements": ["alternator", "Water pump"]},
+        {"has_update": True, "confidence": 0.4, "updates": {"drivetrain": "AWD"},
+         "replacements": ["Brakes"]},
+        {"has_update": True, "confidence": 0.95, "updates": {}, "replacements": ["water pump", "Battery"]},
+    ]
+    prompts = []
+
+    def call_llm(messages, response_format):
+        prompts.append(messages[1]["content"])
+        assert "fuel_type" not in response_format["json_schema"]["schema"]["properties"]["updates"]["properties"]
+        return json.dumps(responses[len(prompts) - 1])
+
+    job = BackfillJob(db, call_llm, "job1", now_ms=lambda: 1, messages_per_call=1)
+    assert job._process_car("car1", ["one", "two", "three"]) is True
+    car = db.docs["cars/car1"]
+    assert car["engineType"] == "2.0L I4"
+    assert "drivetrain" not in car
+    assert car["Replacements"] == ["Alternator", "Water pump", "Battery"]
+    assert "Water pump" in prompts[2]
+    assert job._llm_calls == 3
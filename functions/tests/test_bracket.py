@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from bracket import plan_groups, run_bracket
+
+
+def _candidates(count):
+    return [{"id": f"run{index}", "model": f"m/{index}"} for index in range(count)]
+
+
+def _last_wins(group):
+    return group[-1], {"diagnosis": group[-1]["model"]}
+
+
+def test_groups_are_balanced():
+    sizes = [len(group) for group in plan_groups(_candidates(9), 4)]
+    assert sizes == [3, 3, 3]
+    assert [len(group) for group in plan_groups(_candidates(5), 4)] == [3, 2]
+
+
+def test_small_fanout_skips_the_bracket():
+    with ThreadPoolExecutor(2) as executor:
+        finalists, rounds = run_bracket(_candidates(4), 4, _last_wins, executor)
+    assert [c["id"] for c in finalists] == ["run0", "run1", "run2", "run3"]
+    assert rounds == []
+
+
+def test_rounds_until_finalists_fit_one_group():
+    with ThreadPoolExecutor(4) as executor:
+        finalists, rounds = run_bracket(_candidates(12), 3, _last_wins, executor)
+    assert [c["id"] for c in finalists] == ["run5", "run11"]
+    assert [r["round"] for r in rounds] == [1, 2]
+    first = rounds[0]["matches"][0]
+    assert first == {
+        "runIds": ["run0", "run1", "run2"],
+        "winnerRunId": "run2",
+        "winnerModel": "m/2",
+        "diagnosis": "m/2",
+    }
+    # Firestore rejects arrays nested directly in arrays.
+    for match in (m for r in rounds for m in r["matches"]):
+        assert all(not isinstance(value, list) for value in match["runIds"])
+
+
+def test_lone_candidate_gets_a_bye():
+    calls = []
+
+    def judge(group):
+        calls.append(len(group))
+        return _last_wins(group)
+
+    with ThreadPoolExecutor(2) as executor:
+        finalists, rounds = run_bracket(_candidates(3), 2, judge, executor)
+    assert len(finalists) == 2
+    assert calls == [2]
+    assert {"bye": True}.items() <= rounds[0]["matches"][1].items()
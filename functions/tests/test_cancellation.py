@@ -0,0 +1,92 @@
+import inspect
+import threading
+import time
+
+import pytest
+from firebase_functions import https_fn
+
+import main
+from cancellation import Cancelled, cancellation_scope
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from providers import Endpoint, Router
+
+LONG_REPLY = " ".join(["word"] * 2000)
+
+
+def _request(data, uid="u1"):
+    return https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid=uid, token={}))
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "local")
+    monkeypatch.setattr(main, "_cassette", lambda: None)
+    with LocalInferenceServer(LONG_REPLY, gap_ms=5) as server:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        monkeypatch.setattr(main, "_provider_router", lambda: router)
+        yield server
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        time.sleep(0.01)
+
+
+def test_cancel_stops_a_streaming_chat_reply(monkeypatch, stand_in):
+    db = LocalFirestore(
+        {
+            "chats/c1": {"userId": "u1", "awaitingResponse": True, "latestMessageId": "m1"},
+            "chats/c1/messages/m1": {"role": "user", "content": "Why the misfire?", "createdAt": 1},
+        }
+    )
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    result = {}
+    worker = threading.Thread(
+        target=lambda: result.update(inspect.unwrap(main.chat_reply)(_request({"chatId": "c1", "messageId": "m1"})))
+    )
+    worker.start()
+    _wait_for(lambda: stand_in.requests)
+    time.sleep(0.1)
+
+    cancelled_at = time.perf_counter()
+    assert inspect.unwrap(main.cancel_generation)(_request({"chatId": "c1"})) == {"status": "cancelling"}
+    worker.join(timeout=5)
+
+    assert time.perf_counter() - cancelled_at < 1.0
+    assert result == {"status": "cancelled"}
+    chat = db.document("chats/c1").get().to_dict()
+    assert chat["awaitingResponse"] is False
+    assert chat["cancelledMessageId"] == "m1"
+    # The partial reply is discarded rather than left streaming.
+    assert [doc.id for doc in db.collection("chats/c1/messages").stream()] == ["m1"]
+
+
+def test_cancel_from_another_instance_is_polled_and_interrupts_the_wait(stand_in):
+    stand_in.ttft_ms = 10_000
+    db = LocalFirestore({"chats/c1": {"userId": "u1"}})
+    chat_ref = db.document("chats/c1")
+    started = time.perf_counter()
+    with cancellation_scope("c1", chat_ref, "m1", poll_interval=0.05) as cancellation:
+        threading.Timer(0.2, lambda: chat_ref.update({"cancelledMessageId": "m1", "cancelRequestedAt": 1})).start()
+        with pytest.raises(Cancelled):
+            main._call_openrouter_stream("local", "a/model", [], cancellation=cancellation)
+    assert time.perf_counter() - started < 1.0
+    assert cancellation.requested_ms == 1
+
+
+def test_stamps_for_other_messages_are_ignored():
+    db = LocalFirestore({"chats/c1": {"userId": "u1", "cancelledMessageId": "older"}})
+    with cancellation_scope("c1", db.document("chats/c1"), "m2", poll_interval=0.01) as cancellation:
+        time.sleep(0.05)
+        assert not cancellation.cancelled
+
+
+def test_only_the_owner_can_cancel(monkeypatch):
+    db = LocalFirestore({"chats/c1": {"userId": "u1", "latestMessageId": "m1"}})
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    with pytest.raises(https_fn.HttpsError):
+        inspect.unwrap(main.cancel_generation)(_request({"chatId": "c1"}, uid="u2"))
+    assert "cancelledMessageId" not in db.document("chats/c1").get().to_dict()
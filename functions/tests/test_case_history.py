@@ -0,0 +1,73 @@
+import json
+import time
+
+import main
+from case_history import MAX_CASES, apply_case, case_record, format_cases, search
+from local_firestore import LocalFirestore
+
+
+def _case(chat_id, diagnosis, symptoms=(), codes=(), created_at=1):
+    aggregation = {"combinedOutput": json.dumps({"diagnostic_answer": diagnosis}), "createdAt": created_at}
+    return case_record(chat_id, f"d-{chat_id}", aggregation, {"symptoms": list(symptoms), "dtcCodes": list(codes)})
+
+
+def test_incremental_index_keeps_frequencies_consistent():
+    index = None
+    for number in range(MAX_CASES + 5):
+        index = apply_case(index, _case(f"c{number}", f"Failed part {number}", ["misfire"], created_at=number))
+    assert len(index["cases"]) == MAX_CASES and "c0" not in index["cases"]
+    assert index["df"]["misfire"] == MAX_CASES
+    assert index["totalLength"] == sum(case["length"] for case in index["cases"].values())
+
+    # A newer aggregation in the same chat replaces its case; redelivery changes nothing.
+    replaced = apply_case(index, _case("c10", "Leaking water pump", ["overheating"], created_at=99))
+    assert replaced["cases"]["c10"]["diagnosis"] == "Leaking water pump"
+    assert replaced["df"]["misfire"] == MAX_CASES - 1 and replaced["df"]["overheating"] == 1
+    assert apply_case(replaced, _case("c10", "Leaking water pump", ["overheating"], created_at=99)) is None
+
+
+def test_search_ranks_relevant_cases_and_replacements():
+    index = None
+    index = apply_case(index, _case("c1", "Failed cylinder 2 ignition coil", ["misfire"], ["P0302"], 1000))
+    index = apply_case(index, _case("c2", "Worn front brake pads", ["brake noise"], created_at=2000))
+    index = apply_case(index, _case("c3", "Leaking water pump", ["overheating", "fluid leak"], created_at=3000))
+
+    query = "Misfire again with P0302 despite the new coil"
+    hits = search(index, query, 2, replacements=["Spark plugs", "Ignition coil"])
+    assert hits[0]["chatId"] == "c1" and hits[1] == {"replacement": "Ignition coil", "score": hits[1]["score"]}
+    assert "terms" not in hits[0]
+    assert [hit["chatId"] for hit in search(index, "brake noise", 3, exclude=("c2",))] == []
+    assert format_cases(hits[:1]) == "- 1970-01-01: Failed cylinder 2 ignition coil (symptoms: misfire; codes: P0302)"
+
+
+def test_aggregations_feed_later_prompts(monkeypatch):
+    db = LocalFirestore(
+        {
+            "cars/car1": {"userId": "u1", "year": 2014, "make": "Honda", "model": "Civic"},
+            "chats/old": {"userId": "u1", "carId": "car1", "diagnosticId": "d1"},
+            "diagnostics/d1": {"userId": "u1", "carId": "car1", "symptoms": ["misfire"], "dtcCodes": ["P0302"]},
+        }
+    )
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    aggregation = {"combinedOutput": json.dumps({"diagnostic_answer": "Failed ignition coil"}), "createdAt": 5}
+    assert main._index_case("old", aggregation) is True
+    assert main._index_case("old", aggregation) is False
+    assert db.document("case_index/car1").get().to_dict()["userId"] == "u1"
+
+    car_data = db.document("cars/car1").get().to_dict()
+    hits = main._prior_cases("car1", car_data, "Misfire P0302 is back", "new")
+    assert [hit["chatId"] for hit in hits] == ["old"]
+    assert main._prior_cases("car1", car_data, "Misfire P0302 is back", "old") == []
+    text = main._intake_text(car_data, {"initial": "Misfire", "questions": [], "answers": []}, hits)
+    assert "Prior cases for this vehicle" in text and "Failed ignition coil" in text
+
+
+def test_slow_lookups_are_dropped(monkeypatch):
+    class SlowDb:
+        def collection(self, name):
+            time.sleep(0.2)
+            raise AssertionError("too late to matter")
+
+    monkeypatch.setattr(main, "_get_db", lambda: SlowDb())
+    monkeypatch.setattr(main, "CASE_RETRIEVAL_BUDGET_MS", 20)
+    assert main._prior_cases("car1", {}, "misfire", "chat1") == []
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import main
+from cassettes import Cassette, CassetteMiss
+
+
+class _Streamed:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, pieces):
+        self._pieces = pieces
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        for piece in self._pieces:
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": piece}}]})
+        yield "data: [DONE]"
+
+
+def _payload(model, text):
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": text}],
+        "temperature": 0.3,
+        "stream": True,
+    }
+
+
+def _record(path, payload, pieces):
+    recorder = Cassette(str(path), "record")
+    response = recorder.record(payload, _Streamed(pieces), started=0.0)
+    for line in response.iter_lines(decode_unicode=True):
+        if line.endswith("[DONE]"):
+            break
+
+
+def test_replayed_stream_feeds_the_real_parser(tmp_path, monkeypatch):
+    path = tmp_path / "cassette.jsonl"
+    _record(path, _payload("a/model", "hi"), ["Hello", " there"])
+    cassette = Cassette(str(path), "replay", speed=0)
+    monkeypatch.setattr(main, "_cassette", lambda: cassette)
+
+    content, _ = main._call_openrouter_stream("key", "a/model", [{"role": "user", "content": "hi"}])
+
+    assert content == "Hello there"
+    assert cassette.stats == {"recorded": 0, "exact": 1, "loose": 0}
+
+
+def test_changed_prompts_fall_back_to_model_recordings_in_order(tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    _record(path, _payload("a/model", "first"), ["one"])
+    _record(path, _payload("a/model", "second"), ["two"])
+    cassette = Cassette(str(path), "replay", speed=0)
+
+    replies = [
+        list(cassette.replay(_payload("a/model", f"edited {index}"), stream=True).iter_lines())
+        for index in range(3)
+    ]
+
+    assert ["one" in lines[0] for lines in replies] == [True, False, True]
+    assert cassette.stats["loose"] == 3
+    with pytest.raises(CassetteMiss):
+        cassette.replay(_payload("b/model", "first"), stream=True)
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+from google.api_core import exceptions
+
+import catalog_import
+from catalog_import import CatalogImport, node_path, read_rows, row_path, slugify
+from local_firestore import LocalFirestore, LocalWriteBatch
+
+ROOT = "vehicle_catalog/root/years"
+
+
+def test_rows_become_slugged_paths(tmp_path):
+    assert slugify("Mercedes-Benz") == "mercedes-benz"
+    assert slugify(" 3.5L V6 EcoBoost ") == "3-5l-v6-ecoboost"
+    assert row_path({"year": "2019", "make": "Ford", "model": "F-150", "trim": "XLT", "engine": ""}) == [
+        ("2019", "2019"),
+        ("ford", "Ford"),
+        ("f-150", "F-150"),
+        ("xlt", "XLT"),
+    ]
+    assert row_path({"year": "n/a", "make": "Ford"}) is None
+
+    dump = tmp_path / "catalog.csv"
+    dump.write_text("year,make,model\n2019,Ford,F-150\n2020,Kia,Rio\n")
+    assert [row["model"] for row in read_rows(str(dump))] == ["F-150", "Rio"]
+    lines = tmp_path / "catalog.jsonl"
+    lines.write_text(json.dumps({"year": 2019, "make": "Ford"}) + "\n\n")
+    assert list(read_rows(str(lines))) == [{"year": 2019, "make": "Ford"}]
+
+
+def test_import_writes_only_changes_and_recomputes_counts():
+    db = LocalFirestore(
+        {
+            f"{ROOT}/2019": {"year": 2019, "label": "2019", "sortOrder": 2019, "makesCount": 1},
+            f"{ROOT}/2019/makes/honda": {"makeId": "honda", "name": "Honda", "sortOrder": 1, "createdAt": 1},
+        }
+    )
+    rows = [
+        {"year": "2019", "make": "Ford", "model": "F-150", "submodel": "XLT", "engine": "3.5L V6 EcoBoost",
+         "displacementLiters": "3.5", "cylinders": "6", "fuelType": "Gasoline"},
+        {"year": "2019", "make": "Ford", "model": "F-150", "submodel": "XLT", "engine": "5.0L V8"},
+        {"year": "2019", "make": "Ford", "model": "Ranger"},
+        {"year": "", "make": "Ford"},
+    ]
+    stats = CatalogImport(db, now_ms=lambda: 50).run(iter(rows))
+    assert (stats["rows"], stats["skippedRows"], stats["nodes"]) == (4, 1, 8)
+    assert (stats["created"], stats["updated"], stats["unchanged"]) == (6, 2, 0)
+
+    assert db.docs[f"{ROOT}/2019"]["makesCount"] == 2
+    ford = db.docs[f"{ROOT}/2019/makes/ford"]
+    assert (ford["sortOrder"], ford["modelsCount"], ford["createdAt"]) == (1, 2, 50)
+    honda = db.docs[f"{ROOT}/2019/makes/honda"]
+    assert (honda["sortOrder"], honda["modelsCount"], honda["createdAt"]) == (2, 0, 1)
+    engine = db.docs[node_path(("2019", "ford", "f-150", "xlt", "3-5l-v6-ecoboost"))]
+    assert engine == {
+        "engineId": "3-5l-v6-ecoboost",
+        "name": "3.5L V6 EcoBoost",
+        "sortOrder": 1,
+        "displacementLiters": 3.5,
+        "cylinders": 6,
+        "fuelType": "gasoline",
+        "createdAt": 50,
+        "updatedAt": 50,
+    }
+
+    writes = db.ops["writes"]
+    again = CatalogImport(db, now_ms=lambda: 60).run(iter(rows))
+    assert (again["created"], again["updated"], again["unchanged"]) == (0, 0, 8)
+    assert db.ops["writes"] == writes
+
+    pruned = CatalogImport(db, now_ms=lambda: 70, prune=True).run(iter(rows[2:3]))
+    assert (pruned["deleted"], pruned["updated"]) == (5, 3)
+    assert sorted(path for path in db.docs) == [
+        f"{ROOT}/2019",
+        f"{ROOT}/2019/makes/ford",
+        f"{ROOT}/2019/makes/ford/models/ranger",
+    ]
+    assert db.docs[f"{ROOT}/2019/makes/ford"]["modelsCount"] == 1
+
+
+def test_import_retries_transient_commit_failures(monkeypatch):
+    db = LocalFirestore()
+    failures = iter([exceptions.ServiceUnavailable("busy"), exceptions.Aborted("contention")])
+    commit = LocalWriteBatch.commit
+
+    def flaky_commit(batch):
+        failure = next(failures, None)
+        if failure is not None:
+            raise failure
+        return commit(batch)
+
+    monkeypatch.setattr(LocalWriteBatch, "commit", flaky_commit)
+    monkeypatch.setattr(catalog_import, "BACKOFF_SECONDS", 0)
+    rows = [{"year": str(year), "make": "Ford", "model": "F-150"} for year in range(2000, 2020)]
+    stats = CatalogImport(db, now_ms=lambda: 1, batch_size=7, concurrency=1).run(rows)
+    assert (stats["nodes"], stats["batches"], stats["retries"]) == (60, 9, 2)
+    assert len(db.docs) == 60
+
+    def failing_commit(batch):
+        raise exceptions.DeadlineExceeded("slow")
+
+    monkeypatch.setattr(LocalWriteBatch, "commit", failing_commit)
+    with pytest.raises(exceptions.DeadlineExceeded):
+        CatalogImport(db, now_ms=lambda: 2, prune=True, max_attempts=2).run(rows[:1])
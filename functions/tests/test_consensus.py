@@ -0,0 +1,81 @@
+from consensus import build_judgement, diagnosis_tokens, extract_primary_diagnosis, find_consensus
+
+
+def _results(*outputs):
+    return [
+        {"model": f"model-{index}", "output": output, "id": f"run{index}"}
+        for index, output in enumerate(outputs)
+    ]
+
+
+def test_extract_primary_diagnosis_requires_marker():
+    assert extract_primary_diagnosis("**Primary diagnosis:** Bad MAF sensor\n\nMore") == "Bad MAF sensor"
+    assert extract_primary_diagnosis("Based on the symptoms, check the MAF.") == ""
+
+
+def test_synonyms_collapse_part_names():
+    assert diagnosis_tokens("Dirty mass air flow sensor") == diagnosis_tokens("MAF sensors")
+    assert diagnosis_tokens("Bad coil pack (cyl 3)") == diagnosis_tokens("Failed ignition coil cylinder 3")
+    assert "leak" in diagnosis_tokens("Leaking valve cover gasket")
+    assert "rear" not in diagnosis_tokens("Rear main seal")
+
+
+def test_supermajority_builds_local_judgement():
+    results = _results(
+        "Primary diagnosis: Thermostat stuck open\n\nGauge stays low.\n\n- Heater is lukewarm",
+        "Primary diagnosis: Stuck open thermostat\n\nReplace it.",
+        "Primary diagnosis: Low coolant\n\nTop off coolant.",
+    )
+    consensus = find_consensus(results)
+    assert consensus["votes"] == 2 and consensus["total"] == 3
+    judgement = build_judgement(consensus)
+    assert judgement["model_name"] == "model-0"
+    assert judgement["diagnostic_answer"] == "Thermostat stuck open"
+    assert judgement["justifacation"][0] == "Heater is lukewarm"
+    assert judgement["explanation"] == "Gauge stays low."
+
+
+def test_no_consensus_when_candidates_split_or_fail():
+    assert find_consensus(_results("Primary diagnosis: Weak battery", "", "")) is None
+    assert (
+        find_consensus(
+            _results(
+                "Primary diagnosis: Weak battery",
+                "Primary diagnosis: Failing alternator",
+                "Primary diagnosis: Bad starter",
+            )
+        )
+        is None
+    )
+
+
+def test_different_parts_in_the_same_place_do_not_agree():
+    for first, second in (
+        ("Misfire from failed ignition coil on cylinder 3", "Worn spark plug on cylinder 3"),
+        ("Rear main seal", "Rear main bearing"),
+        ("Coolant leak at the water pump", "Vacuum leak at the intake"),
+        ("Oil leak from the valve cover gasket", "Oil leak from the oil pan gasket"),
+        ("Clogged catalytic converter", "Bank 1 upstream O2 sensor"),
+    ):
+        results = _results(f"Primary diagnosis: {first}", f"Primary diagnosis: {second}")
+        assert find_consensus(results) is None, (first, second)
+    same = _results(
+        "Primary diagnosis: Failed ignition coil on cylinder 3",
+        "Primary diagnosis: Bad coil pack (cyl 3)",
+        "Primary diagnosis: Worn spark plugs",
+    )
+    assert find_consensus(same)["votes"] == 2
+
+
+def test_structured_answers_vote_and_supply_the_judgement():
+    structured = (
+        '{"primary_diagnosis": "Stuck open thermostat", "root_causes": ["Thermostat", "Sensor"], '
+        '"next_checks": ["Check gauge"], "confidence": 0.8, "explanation": "Warms up slowly."}'
+    )
+    results = _results(structured, "Primary diagnosis: Thermostat stuck open", "Primary diagnosis: Low coolant")
+    consensus = find_consensus(results)
+    judgement = build_judgement(consensus)
+    assert consensus["votes"] == 2
+    assert judgement["diagnostic_answer"] == "Stuck open thermostat"
+    assert judgement["justifacation"][:2] == ["Thermostat", "Sensor"]
+    assert judgement["explanation"] == "Warms up slowly."
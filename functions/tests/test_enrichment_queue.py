@@ -0,0 +1,83 @@
+from enrichment_queue import LEADER_LEASE_MS, EnrichmentQueue, apply_car_enrichment
+from local_firestore import LocalFirestore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000
+
+    def now_ms(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += int(seconds * 1000)
+
+
+def test_burst_is_coalesced_into_one_batch():
+    db = LocalFirestore()
+    clock = _Clock()
+    queue = EnrichmentQueue(db, clock.now_ms, window_ms=5000, max_wait_ms=20000, sleep=clock.sleep)
+    assert queue.enqueue("car1", "m1", {"text": "report", "createdAt": 1}) is True
+    clock.now += 3000
+    assert queue.enqueue("car1", "m2", {"text": "answers", "createdAt": 2}) is False
+
+    batches = []
+    assert queue.drain("car1", "m1", batches.append) == 1
+    assert [[entry["text"] for entry in batch] for batch in batches] == [["report", "answers"]]
+    # The window slid to the second message before the batch ran.
+    assert clock.now >= 1_000_000 + 3000 + 5000
+    state = db.docs["enrichment_queue/car1"]
+    assert state["pending"] == {} and state["leader"] is None
+    # The next burst elects a new leader.
+    assert queue.enqueue("car1", "m3", {"text": "later", "createdAt": 3}) is True
+
+
+def test_batch_survives_a_leader_that_dies_mid_batch():
+    db = LocalFirestore()
+    clock = _Clock()
+    queue = EnrichmentQueue(db, clock.now_ms, window_ms=5000, max_wait_ms=20000, sleep=clock.sleep)
+    queue.enqueue("car1", "m1", {"text": "report", "createdAt": 1})
+
+    def crash(entries):
+        queue.enqueue("car1", "m2", {"text": "answers", "createdAt": 2})
+        raise SystemExit
+
+    try:
+        queue.drain("car1", "m1", crash)
+    except SystemExit:
+        pass
+    assert sorted(db.docs["enrichment_queue/car1"]["pending"]) == ["m1", "m2"]
+
+    # Once the lease runs out the next message leads and picks up the whole backlog.
+    clock.now += LEADER_LEASE_MS + 1
+    assert queue.enqueue("car1", "m3", {"text": "later", "createdAt": 3}) is True
+    batches = []
+    assert queue.drain("car1", "m3", batches.append) == 1
+    assert [[entry["text"] for entry in batch] for batch in batches] == [["report", "answers", "later"]]
+    assert db.docs["enrichment_queue/car1"]["pending"] == {}
+
+
+def test_entries_queued_during_a_batch_run_next():
+    db = LocalFirestore()
+    clock = _Clock()
+    queue = EnrichmentQueue(db, clock.now_ms, window_ms=5000, max_wait_ms=20000, sleep=clock.sleep)
+    queue.enqueue("car1", "m1", {"text": "report", "createdAt": 1})
+    batches = []
+
+    def process(entries):
+        batches.append([entry["text"] for entry in entries])
+        if len(batches) == 1:
+            queue.enqueue("car1", "m2", {"text": "answers", "createdAt": 2})
+
+    assert queue.drain("car1", "m1", process) == 2
+    assert batches == [["report"], ["answers"]]
+
+
+def test_concurrent_enrichments_keep_both_additions():
+    db = LocalFirestore({"cars/car1": {"Replacements": ["Battery"]}})
+    car_ref = db.collection("cars").document("car1")
+    first = {"has_update": True, "confidence": 0.9, "updates": {}, "replacements": ["Starter"]}
+    second = {"has_update": True, "confidence": 0.9, "updates": {}, "replacements": ["starter", "Alternator"]}
+    apply_car_enrichment(db, car_ref, first, (), lambda: 5)
+    apply_car_enrichment(db, car_ref, second, (), lambda: 6)
+    assert db.docs["cars/car1"]["Replacements"] == ["Battery", "Starter", "Alternator"]
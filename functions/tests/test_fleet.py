@@ -0,0 +1,138 @@
+import inspect
+import json
+import time
+
+import pytest
+from firebase_functions import https_fn
+
+import main
+from fleet import normalize_items, prefix_order
+from local_firestore import LocalFirestore
+from local_inference import LocalInferenceServer
+from providers import Endpoint, Router
+
+
+def _reply(payload) -> str:
+    schema = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name")
+    if schema == "diagnosis_sufficiency":
+        insufficient = "noise" in payload["messages"][-1]["content"]
+        return json.dumps(
+            {
+                "is_sufficient": not insufficient,
+                "confidence": 0.3 if insufficient else 0.97,
+                "followup_questions": ["When does the noise happen?"] if insufficient else [],
+            }
+        )
+    if schema == "diagnosis_judgement":
+        return json.dumps(
+            {
+                "model_name": "a/model",
+                "diagnostic_answer": "Failed cylinder 2 ignition coil",
+                "justifacation": ["P0302"],
+                "explanation": "Swap coils.",
+            }
+        )
+    return json.dumps(
+        {
+            "primary_diagnosis": "Failed cylinder 2 ignition coil",
+            "root_causes": ["coil"],
+            "next_checks": ["swap coils"],
+            "confidence": 0.7,
+            "explanation": "Misfire.",
+        }
+    )
+
+
+def _request(data, uid="u1"):
+    return https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid=uid, token={}))
+
+
+@pytest.fixture
+def fleet_db(monkeypatch):
+    db = LocalFirestore(
+        {
+            "cars/civic1": {"userId": "u1", "year": 2014, "make": "Honda", "model": "Civic"},
+            "cars/f150": {"userId": "u1", "year": 2018, "make": "Ford", "model": "F-150"},
+            "cars/civic2": {"userId": "u1", "year": 2014, "make": "Honda", "model": "Civic"},
+            "cars/other": {"userId": "u2", "year": 2020, "make": "Kia", "model": "Rio"},
+        }
+    )
+    monkeypatch.setenv("OPENROUTER_API_KEY", "local")
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    monkeypatch.setattr(main, "_cassette", lambda: None)
+    monkeypatch.setattr(main, "FANOUT_MODELS", ["a/model", "b/model"])
+    with LocalInferenceServer(_reply) as server:
+        router = Router({"local": Endpoint("local", server.url)}, {"*": ["local"]})
+        monkeypatch.setattr(main, "_provider_router", lambda: router)
+        yield db
+
+
+def test_items_are_validated():
+    with pytest.raises(ValueError, match="non-empty"):
+        normalize_items([], 5)
+    with pytest.raises(ValueError, match="At most 1"):
+        normalize_items([{"carId": "a", "report": "x"}] * 2, 1)
+    with pytest.raises(ValueError, match="Item 0 is missing report"):
+        normalize_items([{"carId": "a", "report": "  "}], 5)
+    with pytest.raises(ValueError, match="must be lists"):
+        normalize_items([{"carId": "a", "report": "x", "answers": "yes"}], 5)
+
+
+def test_same_vehicle_items_run_back_to_back():
+    cars = {
+        "a": {"year": 2014, "make": "Honda", "model": "Civic"},
+        "b": {"year": 2018, "make": "Ford", "model": "F-150"},
+        "c": {"year": 2014, "make": "honda", "model": "Civic"},
+    }
+    records = [{"index": index, "carId": car_id} for index, car_id in enumerate("abca")]
+    assert [record["index"] for record in prefix_order(records, cars)] == [0, 2, 3, 1]
+
+
+def test_batch_diagnoses_every_item_and_streams_progress(fleet_db):
+    items = [
+        {"carId": "civic1", "report": "Misfire P0302 after a car wash", "answers": ["A week ago"]},
+        {"carId": "f150", "report": "Strange noise from the front"},
+        {"carId": "civic2", "report": "Flashing check engine light, P0302"},
+    ]
+    result = inspect.unwrap(main.batch_diagnose)(_request({"items": items}))
+
+    assert [(item["index"], item["status"]) for item in result["results"]] == [
+        (0, "diagnosed"),
+        (1, "needs_more_info"),
+        (2, "diagnosed"),
+    ]
+    assert result["results"][0]["diagnosis"] == "Failed cylinder 2 ignition coil"
+    batch = fleet_db.document(f"diagnosis_batches/{result['batchId']}").get().to_dict()
+    assert (batch["status"], batch["total"], batch["completed"]) == ("done", 3, 3)
+    assert (batch["diagnosed"], batch["needsMoreInfo"], batch["failed"]) == (2, 1, 0)
+    item = fleet_db.document(f"diagnosis_batches/{result['batchId']}/items/0000").get().to_dict()
+    assert item["status"] == "diagnosed" and item["winnerModel"] == "a/model"
+
+    chat = fleet_db.document(f"chats/{item['chatId']}").get().to_dict()
+    assert chat["awaitingResponse"] is False and chat["batchId"] == result["batchId"]
+    assert fleet_db.document(f"diagnostics/{chat['diagnosticId']}").get().to_dict()["carId"] == "civic1"
+    assert list(fleet_db.collection(f"chats/{item['chatId']}/aggregations").stream())
+
+
+def test_batch_rejects_cars_owned_by_someone_else(fleet_db):
+    with pytest.raises(https_fn.HttpsError) as excinfo:
+        inspect.unwrap(main.batch_diagnose)(_request({"items": [{"carId": "other", "report": "Noise"}]}))
+    assert excinfo.value.message == "Car other not found"
+    assert not list(fleet_db.collection("diagnosis_batches").stream())
+
+
+def test_items_past_the_time_budget_time_out(fleet_db, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_TIME_BUDGET_SECONDS", 0.3)
+    monkeypatch.setattr(main, "CANCEL_POLL_SECONDS", 0.05)
+    items = [{"carId": "civic1", "report": f"Misfire {number}"} for number in range(3)]
+    with LocalInferenceServer(_reply, ttft_ms=3000) as slow:
+        router = Router({"slow": Endpoint("slow", slow.url)}, {"*": ["slow"]})
+        monkeypatch.setattr(main, "_provider_router", lambda: router)
+        started = time.perf_counter()
+        result = inspect.unwrap(main.batch_diagnose)(_request({"items": items}))
+    assert time.perf_counter() - started < 2
+    assert [item["status"] for item in result["results"]] == ["timed_out"] * 3
+    batch = fleet_db.document(f"diagnosis_batches/{result['batchId']}").get().to_dict()
+    assert (batch["status"], batch["completed"], batch["timedOut"]) == ("partial", 3, 3)
+    for item in result["results"]:
+        assert fleet_db.document(f"chats/{item['chatId']}").get().to_dict()["awaitingResponse"] is False
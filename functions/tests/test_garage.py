@@ -0,0 +1,104 @@
+import inspect
+
+import pytest
+from firebase_functions import https_fn
+
+import main
+from garage import decode_cursor, encode_cursor
+from local_firestore import LocalFirestore
+
+
+def _request(data, uid="u1"):
+    return https_fn.CallableRequest(data=data, raw_request=None, auth=https_fn.AuthData(uid=uid, token={}))
+
+
+@pytest.fixture
+def garage_db(monkeypatch):
+    docs = {"cars/other": {"userId": "u2", "make": "Kia", "model": "Rio", "createdAt": 50}}
+    for number in range(5):
+        docs[f"cars/car{number}"] = {
+            "userId": "u1",
+            "name": f"Car {number}",
+            "year": 2010 + number,
+            "make": "Honda",
+            "model": "Civic",
+            # Two cars share a timestamp, so the cursor must break the tie on the id.
+            "createdAt": 100 + min(number, 3),
+            "Replacements": ["Battery"],
+        }
+    for number in range(4):
+        docs[f"diagnostics/d{number}"] = {
+            "userId": "u1",
+            "carId": "car4" if number < 3 else "car1",
+            "title": f"Diagnostic {number}",
+            "summary": "x" * 500,
+            "status": "open",
+            "intakeAnswers": {"initial": "Long intake"},
+            "createdAt": number,
+        }
+        docs[f"chats/chat{number}"] = {
+            "userId": "u1",
+            "diagnosticId": f"d{number}",
+            "status": "open",
+            "phase": "normal",
+            "awaitingResponse": number == 0,
+            "summary": "Long rolling summary",
+            "updatedAt": number,
+        }
+    db = LocalFirestore(docs)
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    main._garage_cache.clear()
+    yield db
+    main._garage_cache.clear()
+
+
+def test_garage_pages_cars_with_latest_diagnostics_and_chat_status(garage_db):
+    list_garage = inspect.unwrap(main.list_garage)
+    first = list_garage(_request({"limit": 2, "diagnosticsPerCar": 2}))
+    assert [car["id"] for car in first["cars"]] == ["car4", "car3"]
+    latest = first["cars"][0]["diagnostics"]
+    assert [diagnostic["id"] for diagnostic in latest] == ["d2", "d1"]
+    assert latest[0]["chat"] == {
+        "id": "chat2",
+        "status": "open",
+        "phase": "normal",
+        "awaitingResponse": False,
+        "updatedAt": 2,
+    }
+    assert len(latest[0]["summary"]) == 200 and "intakeAnswers" not in latest[0]
+    assert "Replacements" not in first["cars"][0] and "userId" not in first["cars"][0]
+
+    second = list_garage(_request({"limit": 2, "diagnosticsPerCar": 2, "cursor": first["nextCursor"]}))
+    third = list_garage(_request({"limit": 2, "diagnosticsPerCar": 2, "cursor": second["nextCursor"]}))
+    assert [car["id"] for car in second["cars"] + third["cars"]] == ["car2", "car1", "car0"]
+    assert third["nextCursor"] is None
+    assert second["cars"][1]["diagnostics"][0]["chat"]["id"] == "chat3"
+
+
+def test_garage_serves_repeat_pages_from_cache(garage_db):
+    list_garage = inspect.unwrap(main.list_garage)
+    first = list_garage(_request({"limit": 2}))
+    second = list_garage(_request({"limit": 2, "cursor": first["nextCursor"]}))
+    reads = garage_db.ops["reads"]
+    assert list_garage(_request({"limit": 2, "cursor": first["nextCursor"]})) == second
+    assert list_garage(_request({"limit": 2, "fresh": False})) == first
+    assert garage_db.ops["reads"] == reads
+    list_garage(_request({"limit": 2, "cursor": first["nextCursor"], "fresh": True}))
+    assert garage_db.ops["reads"] > reads
+    assert list_garage(_request({}, uid="u2"))["cars"][0]["id"] == "other"
+
+
+def test_first_page_shows_cars_added_by_the_app(garage_db):
+    list_garage = inspect.unwrap(main.list_garage)
+    before = list_garage(_request({}))
+    garage_db.docs["cars/new"] = {"userId": "u1", "name": "New", "createdAt": 10**15}
+    assert list_garage(_request({}))["cars"][0]["id"] == "new"
+    assert len(list_garage(_request({}))["cars"]) == len(before["cars"]) + 1
+
+
+def test_garage_rejects_bad_arguments(garage_db):
+    list_garage = inspect.unwrap(main.list_garage)
+    assert decode_cursor(encode_cursor({"id": "car1", "createdAt": 5})) == (5, "car1")
+    for data in ({"cursor": "not-a-cursor"}, {"limit": 0}, {"limit": True}, {"diagnosticsPerCar": 99}):
+        with pytest.raises(https_fn.HttpsError):
+            list_garage(_request(data))
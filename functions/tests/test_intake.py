@@ -0,0 +1,104 @@
+import inspect
+import json
+import random
+
+from firebase_functions import firestore_fn
+
+import main
+from intake import apply_intake_entry, extract_dtc_codes, extract_symptoms, intake_entry
+from local_firestore import LocalFirestore
+from server import _event
+from transcripts import compact_chat
+
+
+def _transcript(rng):
+    messages = [
+        {"role": "user", "promptType": "intake", "content": "Rough idle and check engine light, code P0301",
+         "metadata": {"intakeStage": rng.choice(["initial", None])}},
+        {"role": "assistant", "promptType": "intake",
+         "content": rng.choice([json.dumps({"questions": ["When did it start?", " ", "Any smoke?"]}),
+                                "When did it start?"]),
+         "metadata": {"intakeStage": "followup_questions"}},
+        {"role": "user", "promptType": "intake",
+         "content": rng.choice([json.dumps({"answers": ["Last week", "", "No smoke"]}), "Last week"]),
+         "metadata": {"intakeStage": "followup_answer"}},
+        {"role": "user", "promptType": "intake", "content": rng.choice(["It stalls at lights", "  "])},
+        {"role": "user", "promptType": "normal", "content": "Unrelated chat"},
+        {"role": "assistant", "promptType": "aggregate", "content": "Diagnosis"},
+    ]
+    if rng.random() < 0.5:
+        messages.insert(0, {"role": "user", "promptType": "intake", "content": "Earlier note"})
+    created_at = 1000
+    for index, message in enumerate(messages):
+        # Equal timestamps happen; Firestore then orders by document id.
+        created_at += rng.choice([0, 1, 10])
+        message["id"] = f"m{index}"
+        message["createdAt"] = created_at
+    return messages
+
+
+def test_incremental_state_matches_transcript_extraction():
+    rng = random.Random(5)
+    for _ in range(200):
+        messages = _transcript(rng)
+        state = None
+        # Triggers can be delivered out of order and more than once.
+        deliveries = messages + rng.sample(messages, 2)
+        rng.shuffle(deliveries)
+        for message in deliveries:
+            updated = apply_intake_entry(state, message["id"], intake_entry(message))
+            state = updated if updated is not None else state
+        expected = main._extract_intake_context(messages)
+        assert {key: state[key] for key in expected} == expected
+
+
+def test_removed_message_drops_its_entry():
+    first = {"role": "user", "promptType": "intake", "content": "Overheating", "createdAt": 1,
+             "metadata": {"intakeStage": "initial"}}
+    state = apply_intake_entry(None, "m1", intake_entry(first))
+    assert state["initial"] == "Overheating"
+    assert apply_intake_entry(state, "m1", intake_entry(first)) is None
+    assert apply_intake_entry(state, "m1", None)["initial"] == ""
+
+
+def test_symptom_and_code_extraction():
+    texts = ["Check engine light with P0420 and p0171", "It won't start when cold, smells like gas"]
+    assert extract_dtc_codes(texts) == ["P0420", "P0171"]
+    assert extract_symptoms(texts) == ["check engine light", "no start", "fuel smell"]
+
+
+def test_compaction_keeps_messages_and_intake_state(monkeypatch):
+    messages = {
+        "m1": {"role": "user", "promptType": "intake", "content": "Overheating on the highway", "createdAt": 1,
+               "metadata": {"intakeStage": "initial"}},
+        "m2": {"role": "assistant", "promptType": "intake", "content": json.dumps({"questions": ["Coolant low?"]}),
+               "createdAt": 2, "metadata": {"intakeStage": "followup_questions"}},
+        "m3": {"role": "user", "promptType": "intake", "content": json.dumps({"answers": ["Yes, very"]}),
+               "createdAt": 3, "metadata": {"intakeStage": "followup_answer"}},
+    }
+    db = LocalFirestore(
+        {
+            "chats/c1": {"userId": "u1", "diagnosticId": "d1", "status": "closed"},
+            "diagnostics/d1": {"userId": "u1"},
+            **{f"chats/c1/messages/{message_id}": message for message_id, message in messages.items()},
+            "chats/c1/aggregations/a1": {"combinedOutput": "{}", "createdAt": 4},
+        }
+    )
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    trigger = inspect.unwrap(main.maintain_intake_state)
+    originals = [db.document(f"chats/c1/messages/{message_id}").get() for message_id in messages]
+    for snapshot in originals:
+        trigger(_event(snapshot, firestore_fn.Change(before=None, after=snapshot)))
+    state = db.docs["diagnostics/d1"]
+    assert state["intakeAnswers"]["answers"] == ["Yes, very"]
+
+    chat_ref = db.document("chats/c1")
+    compact_chat(db, chat_ref, chat_ref.get().to_dict(), now_ms=lambda: 10)
+    # The app renders history from messages, so compaction keeps them.
+    assert db.document("chats/c1/messages/m1").get().exists
+    assert not db.document("chats/c1/aggregations/a1").get().exists
+    assert db.docs["chats/c1"]["compaction"]["kinds"] == {"aggregations": {"count": 1, "chunks": 1}}
+    for snapshot in originals:
+        snapshot.reference.delete()
+        trigger(_event(snapshot, firestore_fn.Change(before=snapshot, after=None)))
+    assert db.docs["diagnostics/d1"] == state
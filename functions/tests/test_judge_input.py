@@ -0,0 +1,35 @@
+from judge_input import build_judge_prompt, compact_candidate, estimate_tokens
+
+
+def _record(causes=5, checks=3, words=12):
+    filler = " ".join(["word"] * words)
+    return {
+        "primary_diagnosis": "Failed cylinder 2 coil",
+        "root_causes": [f"cause {rank} {filler}" for rank in range(1, causes + 1)],
+        "next_checks": [f"check {rank} {filler}" for rank in range(1, checks + 1)],
+        "confidence": 0.7,
+        "explanation": "Long prose the judge never sees.",
+    }
+
+
+def test_cap_drops_lowest_ranked_checks_then_causes():
+    text = compact_candidate("a/model", _record(), max_tokens=60)
+    assert estimate_tokens(text) <= 60
+    assert "1. cause 1" in text and "- check 1" in text
+    assert "check 3" not in text and "cause 5" not in text
+    assert "Confidence: 0.70" in text
+    assert "Long prose" not in text
+
+
+def test_cap_truncates_when_top_items_alone_overflow():
+    text = compact_candidate("a/model", _record(causes=1, checks=1, words=200), max_tokens=40)
+    assert estimate_tokens(text) <= 41
+    assert text.endswith("…")
+
+
+def test_prompt_lists_failed_candidates_without_their_text():
+    prompt = build_judge_prompt(
+        "Intake", [{"model": "a/model", "record": _record()}, {"model": "b/model", "record": None}]
+    )
+    assert prompt.startswith("Intake\n\nCandidate diagnoses:\n\nModel: a/model")
+    assert prompt.endswith("Model: b/model\nNo usable response.")
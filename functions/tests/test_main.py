@@ -1,10 +1,191 @@
+import inspect
+
 from flask import Flask, request
 
-from functions.main import hello
+import main
 
 
 def test_hello_returns_message():
     app = Flask(__name__)
     with app.test_request_context("/"):
-        response = hello(request)
+        response = main.hello(request)
     assert response.get_data(as_text=True) == "CARLLM Functions online."
+
+
+class _FakeDocRef:
+    def __init__(self, store, doc_id):
+        self._store = store
+        self.id = doc_id
+
+    def set(self, data):
+        self._store[self.id] = dict(data)
+
+    def update(self, data):
+        self._store[self.id].update(data)
+
+    def delete(self):
+        self._store.pop(self.id, None)
+
+
+class _FakeCollection:
+    def __init__(self, store):
+        self._store = store
+        self._next_id = 0
+
+    def document(self, doc_id=None):
+        if doc_id is None:
+            self._next_id += 1
+            doc_id = f"doc{self._next_id}"
+        return _FakeDocRef(self._store, doc_id)
+
+
+class _FakeChatRef:
+    def __init__(self):
+        self.messages = {}
+        self._collection = _FakeCollection(self.messages)
+
+    def collection(self, name):
+        return self._collection
+
+
+def test_sufficiency_decision_escalates_only_inside_band():
+    assert main._sufficiency_decision({"is_sufficient": False, "confidence": 0.3}, final=False) == "insufficient"
+    assert main._sufficiency_decision({"is_sufficient": True, "confidence": 0.99}, final=False) == "sufficient"
+    assert main._sufficiency_decision({"is_sufficient": True, "confidence": 0.8}, final=False) == "escalate"
+    assert main._sufficiency_decision({"is_sufficient": True, "confidence": 0.5}, final=False) == "escalate"
+    assert main._sufficiency_decision({"is_sufficient": True, "confidence": 0.8}) == "insufficient"
+
+
+def test_sufficiency_gate_escalates_borderline_fast_verdicts(monkeypatch):
+
+    calls = []
+    responses = {
+        main.FOLLOWUP_MODEL: '{"is_sufficient": true, "confidence": 0.82, "followup_questions": []}',
+        main.AGGREGATOR_MODEL: '{"is_sufficient": false, "confidence": 0.6, "followup_questions": ["When?"]}',
+    }
+
+    def fake_stream(api_key, model, messages, on_delta=None, **kwargs):
+        calls.append(model)
+        content = responses[model]
+        on_delta(content)
+        return content, None
+
+    monkeypatch.setattr(main, "_call_openrouter_stream", fake_stream)
+    chat_ref = _FakeChatRef()
+    decision, verdict, writer = main._run_sufficiency_gate("key", chat_ref, "intake", None)
+    assert calls == [main.FOLLOWUP_MODEL, main.AGGREGATOR_MODEL]
+    assert decision == "insufficient"
+    assert verdict["followup_questions"] == ["When?"]
+    assert chat_ref.messages[writer.id]["status"] == "streaming"
+    assert len(chat_ref.messages) == 1
+
+
+def test_streaming_writer_keeps_to_its_budget_and_finalizes_with_the_chat(monkeypatch):
+    from local_firestore import LocalFirestore
+
+    db = LocalFirestore({"chats/c1": {"awaitingResponse": True}})
+    monkeypatch.setattr(main, "_get_db", lambda: db)
+    chat_ref = db.collection("chats").document("c1")
+    writer = main.StreamingMessageWriter(
+        chat_ref.collection("messages").document("m1"),
+        {"role": "assistant", "metadata": {"model": "a/model"}},
+        min_interval=0,
+        max_writes=2,
+    )
+    writer.start()
+    assert db.docs["chats/c1/messages/m1"]["status"] == "streaming"
+    for delta in ("Swap ", "coil ", "two ", "and ", "three."):
+        writer.append(delta)
+    assert db.docs["chats/c1/messages/m1"]["content"] == "Swap coil "
+
+    batch = db.batch()
+    writer.finalize("Swap coil two and three.", batch=batch, metadata={"aggregationId": "a1"})
+    batch.update(chat_ref, {"awaitingResponse": False, "latestMessageId": writer.id})
+    assert db.docs["chats/c1/messages/m1"]["status"] == "streaming"
+    batch.commit()
+    message = db.docs["chats/c1/messages/m1"]
+    assert message["status"] == "complete"
+    assert message["content"] == "Swap coil two and three."
+    assert message["metadata"] == {"model": "a/model", "aggregationId": "a1"}
+    assert db.docs["chats/c1"] == {"awaitingResponse": False, "latestMessageId": "m1"}
+    assert db.ops["writes"] == 5
+
+
+def test_streaming_writer_spaces_interim_writes_further_apart(monkeypatch):
+    from local_firestore import LocalFirestore
+
+    db = LocalFirestore()
+    clock = [100.0]
+    monkeypatch.setattr(main.time, "time", lambda: clock[0])
+    writer = main.StreamingMessageWriter(
+        db.collection("chats").document("c1").collection("messages").document("m1"),
+        {"role": "assistant"},
+        min_interval=1.0,
+        max_writes=10,
+        growth=2.0,
+    )
+    writes = []
+    for step in range(16):
+        clock[0] = 100.0 + step
+        before = db.ops["writes"]
+        writer.append(f"{step} ")
+        if db.ops["writes"] > before:
+            writes.append(step)
+    # Intervals of 1, 2, 4 and 8 seconds after the first write.
+    assert writes == [0, 1, 3, 7, 15]
+
+
+def test_default_app_exists_before_any_callable_runs():
+    # Callables verify ID tokens against the default app before the handler body.
+    from firebase_admin import get_app
+
+    assert get_app().name == "[DEFAULT]"
+
+
+def test_vin_prefill_fills_only_missing_fields(monkeypatch):
+    from local_firestore import LocalFirestore
+    from server import _event
+    from vin_decoder import VDS_TABLES, _decode_cached, register_vds_table
+
+    db = LocalFirestore(
+        {
+            "cars/tesla": {"userId": "u1", "vin": "5yj3e1ea0kf000316"},
+            "cars/typo": {"userId": "u1", "vin": "1HGCM82653A004352"},
+            "cars/honda": {"userId": "u1", "vin": "1HGCM82633A004352", "year": "2003", "make": "Honda",
+                           "engineType": "2.4L I4"},
+        }
+    )
+    monkeypatch.setattr(main, "_now_ms", lambda: 7)
+    trigger = inspect.unwrap(main.prefill_car_from_vin)
+
+    def created(car_id):
+        snapshot = db.document(f"cars/{car_id}").get()
+        trigger(_event(snapshot, snapshot))
+        return db.docs[f"cars/{car_id}"]
+
+    assert created("tesla") == {
+        "userId": "u1",
+        "vin": "5yj3e1ea0kf000316",
+        "fuelType": "electric",
+        "vinDecodedFields": ["fuelType"],
+        "year": 2019,
+        "make": "Tesla",
+        "updatedAt": 7,
+    }
+
+    writes = db.ops["writes"]
+    assert created("typo") == {"userId": "u1", "vin": "1HGCM82653A004352"}
+    assert db.ops["writes"] == writes
+
+    try:
+        register_vds_table(
+            "1HG",
+            [{"match": "CM8??", "fields": {"engineType": "3.0L V6", "drivetrain": "fwd"}}],
+        )
+        honda = created("honda")
+    finally:
+        VDS_TABLES.pop("1HG", None)
+        _decode_cached.cache_clear()
+    assert honda["engineType"] == "2.4L I4"
+    assert (honda["drivetrain"], honda["vinDecodedFields"]) == ("fwd", ["drivetrain"])
+    assert (honda["year"], honda["make"]) == ("2003", "Honda")
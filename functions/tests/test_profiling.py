@@ -0,0 +1,57 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_functions import https_fn
+
+import main
+from profiling import ProfileStore, SamplingProfiler, carry, run_profiled
+
+
+def _slow_worker():
+    time.sleep(0.1)
+    return "done"
+
+
+def _invocation(executor):
+    future = executor.submit(carry(_slow_worker))
+    time.sleep(0.05)
+    return future.result()
+
+
+def _request(data, admin=False):
+    return https_fn.CallableRequest(
+        data=data, raw_request=None, auth=https_fn.AuthData(uid="u1", token={"admin": admin})
+    )
+
+
+def test_profile_samples_fanout_workers_with_their_stage():
+    profile = SamplingProfiler("fanout_diagnosis", {"chatId": "c1"}, interval_ms=2)
+    with ThreadPoolExecutor(1, thread_name_prefix="fanout") as executor:
+        assert run_profiled(profile, _invocation, executor) == "done"
+
+    lines = profile.collapsed().splitlines()
+    worker = [line for line in lines if line.startswith("fanout_diagnosis;fanout_0;")]
+    # Blocked in sleep, the worker's innermost Python frame is the function itself.
+    assert any(line.rsplit(" ", 1)[0].endswith("test_profiling._slow_worker") for line in worker)
+    assert any("test_profiling._invocation" in line for line in lines if ";MainThread;" in line)
+    summary = profile.summary()
+    assert summary["chatId"] == "c1" and summary["samples"] > 10
+    assert summary["threadMs"]["fanout_0"] >= 90
+
+
+def test_carry_is_a_no_op_without_a_profile():
+    assert carry(_slow_worker) is _slow_worker
+
+
+def test_only_admins_can_ask_for_a_profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "_profile_store", lambda: ProfileStore(str(tmp_path)))
+    handler = main._profiled(lambda request: {"status": "ok"})
+
+    assert handler(_request({"chatId": "c/1", "profile": True})) == {"status": "ok"}
+    assert not any(tmp_path.iterdir())
+
+    assert handler(_request({"chatId": "c/1", "profile": True}, admin=True)) == {"status": "ok"}
+    (summary_path,) = tmp_path.glob("c_1/*/*.json")
+    assert json.loads(summary_path.read_text())["chatId"] == "c/1"
+    assert summary_path.with_suffix(".collapsed").exists()
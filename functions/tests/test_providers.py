@@ -0,0 +1,119 @@
+import socket
+
+import pytest
+import requests
+
+import main
+from local_inference import LocalInferenceServer
+from providers import OPENROUTER, Endpoint, Router
+
+
+def _router(endpoints, routes, **kwargs):
+    return Router({endpoint.name: endpoint for endpoint in endpoints}, routes, **kwargs)
+
+
+def _closed_port_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+@pytest.fixture
+def use_router(monkeypatch):
+    monkeypatch.setattr(main, "_cassette", lambda: None)
+
+    def install(router):
+        monkeypatch.setattr(main, "_provider_router", lambda: router)
+        return router
+
+    return install
+
+
+def test_routes_resolve_role_model_then_model_then_role():
+    openrouter = Endpoint(OPENROUTER, "https://example.invalid", uses_secret=True)
+    local = Endpoint("local", "http://127.0.0.1:1")
+    router = _router(
+        [openrouter, local],
+        {
+            "fanout:a/model": [{"endpoint": "local", "model": "small"}],
+            "fanout": [OPENROUTER, "local"],
+            "*": [OPENROUTER],
+        },
+    )
+
+    assert [(t.endpoint.name, t.model) for t in router.candidates("a/model", "fanout")] == [("local", "small")]
+    assert [t.endpoint.name for t in router.candidates("b/model", "fanout")] == [OPENROUTER, "local"]
+    assert [t.endpoint.name for t in router.candidates("b/model", "chat")] == [OPENROUTER]
+    assert local.headers("secret") == {"Content-Type": "application/json"}
+    assert openrouter.headers("secret")["Authorization"] == "Bearer secret"
+
+
+def test_faster_endpoints_lead_and_failed_ones_cool_down():
+    now = [0.0]
+    first, second = Endpoint("first", "http://a"), Endpoint("second", "http://b")
+    router = _router([first, second], {"*": ["first", "second"]}, cooldown_seconds=30, clock=lambda: now[0])
+
+    router.observe_ttft(first, 900)
+    router.observe_ttft(second, 200)
+    assert [t.endpoint.name for t in router.candidates("m")] == ["second", "first"]
+
+    router.mark_failed(second)
+    assert [t.endpoint.name for t in router.candidates("m")] == ["first", "second"]
+    now[0] = 31
+    assert [t.endpoint.name for t in router.candidates("m")] == ["second", "first"]
+
+
+def test_stream_fails_over_on_ttft_deadline(use_router):
+    with LocalInferenceServer("too late", ttft_ms=2000) as slow, LocalInferenceServer("on time") as fast:
+        router = use_router(
+            _router(
+                [Endpoint("slow", slow.url), Endpoint("fast", fast.url)],
+                {"*": ["slow", "fast"]},
+                ttft_deadline_ms=300,
+            )
+        )
+        deltas = []
+        content, _ = main._call_openrouter_stream("key", "a/model", [], on_delta=deltas.append)
+
+        assert content == "on time"
+        assert "".join(deltas) == "on time"
+        assert router.stats()["slow"]["coolingDown"] is True
+        assert [t.endpoint.name for t in router.candidates("a/model")] == ["fast", "slow"]
+
+
+def test_connect_errors_fail_over_but_client_errors_do_not(use_router):
+    with LocalInferenceServer("local answer") as local, LocalInferenceServer(status=400) as broken:
+        use_router(
+            _router(
+                [Endpoint("down", _closed_port_url()), Endpoint("local", local.url)],
+                {"*": ["down", {"endpoint": "local", "model": "tiny"}]},
+            )
+        )
+        assert main._call_openrouter("key", "a/model", []) == "local answer"
+        assert local.requests[-1]["model"] == "tiny"
+
+        use_router(_router([Endpoint("broken", broken.url), Endpoint("local", local.url)], {"*": ["broken", "local"]}))
+        with pytest.raises(requests.HTTPError):
+            main._call_openrouter_stream("key", "a/model", [])
+        assert len(local.requests) == 1
+
+
+def test_last_endpoint_and_gaps_after_first_delta_are_not_held_to_ttft_deadline(use_router):
+    with LocalInferenceServer("slow but sure", ttft_ms=500) as slow, LocalInferenceServer(
+        "long pauses here", gap_ms=400
+    ) as gappy:
+        use_router(_router([Endpoint("slow", slow.url)], {"*": ["slow"]}, ttft_deadline_ms=200))
+        content, _ = main._call_openrouter_stream("key", "a/model", [])
+        assert content == "slow but sure"
+
+        use_router(
+            _router(
+                [Endpoint("gappy", gappy.url), Endpoint("slow", slow.url)],
+                {"*": ["gappy", "slow"]},
+                ttft_deadline_ms=200,
+            )
+        )
+        content, _ = main._call_openrouter_stream("key", "a/model", [])
+        assert content == "long pauses here"
+        assert slow.requests == [slow.requests[0]]
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from response_formats import (
+    SUFFICIENCY_FORMAT,
+    VEHICLE_METADATA_FORMAT,
+    vehicle_metadata_response_format,
+)
+
+
+def test_formats_are_read_only_and_serializable():
+    with pytest.raises(TypeError):
+        SUFFICIENCY_FORMAT["json_schema"]["strict"] = False
+    decoded = json.loads(json.dumps(SUFFICIENCY_FORMAT))
+    assert decoded["json_schema"]["schema"]["required"] == [
+        "is_sufficient",
+        "confidence",
+        "followup_questions",
+    ]
+
+
+def test_metadata_format_is_cached_per_field_subset():
+    subset = vehicle_metadata_response_format(("transmission_type",))
+    assert subset is vehicle_metadata_response_format(("transmission_type",))
+    updates = subset["json_schema"]["schema"]["properties"]["updates"]
+    assert list(updates["properties"]) == ["transmission_type"]
+    assert vehicle_metadata_response_format() is VEHICLE_METADATA_FORMAT
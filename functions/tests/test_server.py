@@ -0,0 +1,45 @@
+import server
+
+
+def test_params_follow_trigger_path_names():
+    assert server._params("chats/c1/messages/m1") == {"chatId": "c1", "messageId": "m1"}
+    assert server._params("cars/car9") == {"carId": "car9"}
+    assert server._params("chats/c1/aggregations/a1") == {"chatId": "c1", "aggregationId": "a1"}
+
+
+def test_shutdown_drains_every_shared_executor(monkeypatch):
+    stopped = []
+
+    class _Pool:
+        def __init__(self, name):
+            self.name = name
+
+        def shutdown(self, wait):
+            stopped.append((self.name, wait))
+
+        def close(self):
+            stopped.append((self.name, None))
+
+    pools = [_Pool(name) for name in ("batch", "fanout", "garage", "retrieval")]
+    monkeypatch.setattr(server.main, "shared_executors", lambda: pools)
+    monkeypatch.setattr(server.main, "_http_session", lambda: _Pool("http"))
+    monkeypatch.setattr(server, "DRAIN", server._Drain())
+    server.shutdown_shared_resources(timeout=0.1)
+    assert stopped == [("batch", True), ("fanout", True), ("garage", True), ("retrieval", True), ("http", None)]
+    assert server.main._batch_executor in server.main._EXECUTORS
+    assert server.main._garage_executor in server.main._EXECUTORS
+
+
+def test_callables_share_metrics_and_refuse_while_draining(monkeypatch):
+    calls = []
+    monkeypatch.setattr(server.main, "chat_reply", lambda request: calls.append(request.path) or "done")
+    monkeypatch.setattr(server, "DRAIN", server._Drain())
+    client = server.create_app().test_client()
+
+    assert client.post("/chat_reply", json={"data": {}}).get_data(as_text=True) == "done"
+    assert calls == ["/chat_reply"]
+    assert "carllm_http_chat_reply_ms_count" in client.get("/metrics").get_data(as_text=True)
+
+    assert server.DRAIN.wait(timeout=0.1) is True
+    assert client.post("/chat_reply", json={"data": {}}).status_code == 503
+    assert client.get("/readyz").status_code == 503
@@ -0,0 +1,48 @@
+from stream_json import StreamingJsonArrayParser
+
+
+def _feed_in_chunks(parser, text, size=3):
+    emitted = []
+    for start in range(0, len(text), size):
+        emitted.append(parser.feed(text[start : start + size]))
+    return emitted
+
+
+def test_emits_each_question_when_its_quote_closes():
+    parser = StreamingJsonArrayParser(("questions",))
+    assert parser.feed('{"questions": ["What is the mile') == []
+    assert parser.feed('age?", "Any \\"codes\\"?"') == ["What is the mileage?", 'Any "codes"?']
+    assert parser.feed("]}") == []
+    assert parser.done
+    assert parser.result() == {"questions": ["What is the mileage?", 'Any "codes"?']}
+
+
+def test_tracks_top_level_scalars_before_the_array():
+    parser = StreamingJsonArrayParser()
+    text = '{"is_sufficient": false, "confidence": 0.4, "followup_questions": ["When?"]}'
+    emitted = [item for chunk in _feed_in_chunks(parser, text) for item in chunk]
+    assert emitted == ["When?"]
+    assert parser.values == {"is_sufficient": False, "confidence": 0.4}
+
+
+def test_recovers_from_code_fences_and_truncation():
+    parser = StreamingJsonArrayParser(("questions",))
+    parser.feed('```json\n{"questions": ["Does it stall?", "Is the check eng')
+    assert parser.result() == {"questions": ["Does it stall?"]}
+
+    fenced = StreamingJsonArrayParser(("questions",))
+    fenced.feed('```json\n{"questions": ["Cold start?"]}\n```')
+    assert fenced.result() == {"questions": ["Cold start?"]}
+    assert StreamingJsonArrayParser().result() is None
+
+
+def test_snapshot_is_valid_partial_json_including_open_strings():
+    parser = StreamingJsonArrayParser(("justifacation",))
+    parser.feed('{"diagnostic_answer": "Bad coil", "justifacation": ["P0302 set", "Worse when w')
+    assert parser.snapshot() == {
+        "diagnostic_answer": "Bad coil",
+        "justifacation": ["P0302 set", "Worse when w"],
+    }
+    parser.feed('et"], "explanation": "Caf\\u00')
+    assert parser.snapshot()["explanation"] == "Caf"
+    assert parser.snapshot()["justifacation"] == ["P0302 set", "Worse when wet"]
@@ -0,0 +1,70 @@
+import random
+
+from transcripts import decode_chunk, encode_records, merge_live_record, transcript_record
+
+
+def _records(count, size, seed=3):
+    rng = random.Random(seed)
+    return [
+        {"id": f"m{index}", "role": "user", "createdAt": index,
+         "content": "".join(rng.choice("abcdefgh ") for _ in range(size))}
+        for index in range(count)
+    ]
+
+
+def test_encode_records_round_trips_in_order():
+    records = _records(50, 200)
+    blobs = encode_records(records)
+    assert len(blobs) == 1
+    decoded = [record for _, blob in blobs for record in decode_chunk(blob)]
+    assert decoded == records
+
+
+def test_encode_records_splits_under_chunk_limit():
+    records = _records(40, 2000)
+    blobs = encode_records(records, max_bytes=8000, raw_bytes=20000)
+    assert len(blobs) > 1
+    assert all(len(blob) <= 8000 for _, blob in blobs)
+    assert sum(count for count, _ in blobs) == len(records)
+    decoded = [record for _, blob in blobs for record in decode_chunk(blob)]
+    assert [record["id"] for record in decoded] == [record["id"] for record in records]
+
+
+def _live(records_per_chunk):
+    head = {"chunks": len(records_per_chunk), "locations": {}}
+    chunks = {}
+    for index, records in enumerate(records_per_chunk):
+        chunks[index] = {"kind": "live", "index": index, "records": list(records)}
+        for record in records:
+            head["locations"][record["id"]] = index
+    return head, chunks
+
+
+def _message(message_id, created_at, content="hi"):
+    return transcript_record(
+        message_id,
+        {"role": "user", "promptType": "intake", "content": content, "createdAt": created_at,
+         "metadata": {"intakeStage": "initial"}},
+    )
+
+
+def test_merge_live_record_orders_and_ignores_redelivery():
+    head, chunks = _live([[_message("b", 20)]])
+    assert merge_live_record(head, chunks, "a", _message("a", 10)) is True
+    assert [record["id"] for record in chunks[0]["records"]] == ["a", "b"]
+    assert merge_live_record(head, chunks, "a", _message("a", 10)) is False
+    assert merge_live_record(head, chunks, "a", _message("a", 10, "edited")) is True
+    assert [record["content"] for record in chunks[0]["records"]] == ["edited", "hi"]
+    assert merge_live_record(head, chunks, "b", None) is True
+    assert "b" not in head["locations"]
+
+
+def test_merge_live_record_rolls_over_before_limit():
+    head, chunks = _live([[_message("a", 1, "x" * 300)]])
+    assert merge_live_record(head, chunks, "b", _message("b", 2, "y" * 300), max_bytes=500)
+    assert head["chunks"] == 2 and head["locations"]["b"] == 1
+    assert [record["id"] for record in chunks[1]["records"]] == ["b"]
+    # Updates go back to the chunk that already holds the message.
+    chunks = {0: chunks[0]}
+    assert merge_live_record(head, chunks, "a", _message("a", 1, "z"), max_bytes=500)
+    assert chunks[0]["records"][0]["content"] == "z"
@@ -0,0 +1,53 @@
+from vehicle_index import VehicleIndex, catalog_key_from_path
+
+
+def _build_index():
+    index = VehicleIndex()
+    index.upsert(("2019",), {"year": 2019, "label": "2019", "sortOrder": 2019})
+    index.upsert(("2019", "ford"), {"name": "Ford", "sortOrder": 1})
+    index.upsert(("2019", "honda"), {"name": "Honda", "sortOrder": 2})
+    index.upsert(("2019", "ford", "f-150"), {"name": "F-150"})
+    index.upsert(("2019", "ford", "f-150", "xlt"), {"name": "XLT"})
+    index.upsert(
+        ("2019", "ford", "f-150", "xlt", "3-5l-v6-ecoboost"),
+        {"name": "3.5L V6 EcoBoost", "fuelType": "gasoline"},
+    )
+    index.upsert(
+        ("2019", "ford", "f-150", "xlt", "5-0l-v8"),
+        {"name": "5.0L V8", "fuelType": "gasoline"},
+    )
+    return index
+
+
+def test_catalog_key_from_path():
+    path = "vehicle_catalog/root/years/2019/makes/ford/models/f-150"
+    assert catalog_key_from_path(path) == ("2019", "ford", "f-150")
+    assert catalog_key_from_path("cars/abc") is None
+
+
+def test_options_return_next_level_in_sort_order():
+    index = _build_index()
+    level, options = index.options(("2019",))
+    assert level == "makes"
+    assert [option["id"] for option in options] == ["ford", "honda"]
+    assert index.options(("2020",)) == ("makes", [])
+
+
+def test_free_text_search_matches_across_levels():
+    index = _build_index()
+    matches = index.search("2019 f150 3.5")
+    assert len(matches) == 1
+    assert matches[0]["path"]["engine"] == "3-5l-v6-ecoboost"
+    assert matches[0]["label"] == "2019 Ford F-150 XLT 3.5L V6 EcoBoost"
+    assert matches[0]["fuelType"] == "gasoline"
+    assert index.search("2019 f150")[0]["level"] == "models"
+
+
+def test_incremental_rename_and_remove():
+    index = _build_index()
+    index.upsert(("2019", "ford", "f-150"), {"name": "F150 Pickup"})
+    assert index.search("pickup")[0]["path"]["model"] == "f-150"
+    index.remove(("2019", "ford", "f-150"))
+    assert index.search("ecoboost") == []
+    assert index.options(("2019", "ford")) == ("models", [])
+    assert len(index) == 3
@@ -0,0 +1,35 @@
+from vin_decoder import VDS_TABLES, decode_vin, decode_vins, register_vds_table
+
+
+def test_decode_valid_vin():
+    result = decode_vin("1hgcm82633a004352")
+    assert result["valid"] and result["checkDigitValid"]
+    assert result["manufacturer"] == "Honda"
+    assert result["modelYear"] == 2003
+
+
+def test_check_digit_and_charset_failures():
+    assert not decode_vin("1HGCM82653A004352")["checkDigitValid"]
+    assert not decode_vin("1HGCM8263OA004352")["valid"]
+    assert not decode_vin(None)["valid"]
+
+
+def test_model_year_hint_selects_cycle():
+    assert decode_vin("5YJ3E1EA0KF000316")["modelYear"] == 2019
+    assert decode_vin("5YJ3E1EA0KF000316", year_hint=1989)["modelYear"] == 1989
+    assert decode_vin("5YJ3E1EA0KF000316", year_hint=" 1989 ")["modelYear"] == 1989
+    for junk in ([1989], {"year": 1989}, "n/a", True):
+        assert decode_vin("5YJ3E1EA0KF000316", year_hint=junk)["modelYear"] == 2019
+
+
+def test_pluggable_vds_table_and_batch():
+    try:
+        register_vds_table(
+            "1HG",
+            [{"match": "CM8??", "years": [2003, 2007], "fields": {"engineType": "2.4L I4"}}],
+        )
+        results = decode_vins(["1HGCM82633A004352", "5YJ3E1EA0KF000316"])
+    finally:
+        VDS_TABLES.pop("1HG", None)
+    assert results[0]["fields"] == {"engineType": "2.4L I4"}
+    assert results[1]["fields"] == {"fuelType": "electric"}
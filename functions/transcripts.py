@@ -0,0 +1,372 @@
+import json
+import logging
+import time
+import zlib
+
+from firebase_admin import firestore
+
+logger = logging.getLogger("carllm")
+
+TRANSCRIPTS_COLLECTION = "transcripts"
+# Messages stay: the app renders history straight from the messages collection.
+COMPACTED_KINDS = ("llm_runs", "aggregations")
+COMPACTABLE_STATUSES = ("closed", "archived")
+ENCODING = "zlib+json"
+# Firestore caps documents at 1 MiB; leave room for the other chunk fields.
+MAX_CHUNK_BYTES = 900_000
+RAW_CHUNK_BYTES = 4_000_000
+BATCH_LIMIT = 400
+LIVE_KIND = "live"
+LIVE_HEAD_ID = "live-head"
+LIVE_CHUNK_BYTES = 800_000
+COMPACTION_JOB_PATH = ("maintenance_jobs", "chat_compaction")
+COMPACTION_GRACE_MS = 7 * 24 * 60 * 60 * 1000
+COMPACTION_PAGE_SIZE = 50
+
+
+def _json_default(value):
+    # References and timestamps are the only non-JSON types stored in chat docs.
+    path = getattr(value, "path", None)
+    if isinstance(path, str):
+        return path
+    isoformat = getattr(value, "isoformat", None)
+    if callable(isoformat):
+        return isoformat()
+    return str(value)
+
+
+def _dump(records) -> bytes:
+    return json.dumps(records, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def encode_records(records, max_bytes: int = MAX_CHUNK_BYTES, raw_bytes: int = RAW_CHUNK_BYTES):
+    # Greedy pack by raw size, then split any group whose compressed blob is still too big.
+    groups = []
+    group = []
+    size = 0
+    for record in records:
+        record_size = len(_dump(record))
+        if group and size + record_size > raw_bytes:
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(record)
+        size += record_size
+    if group:
+        groups.append(group)
+
+    blobs = []
+    pending = list(reversed(groups))
+    while pending:
+        group = pending.pop()
+        blob = zlib.compress(_dump(group), 6)
+        if len(blob) <= max_bytes:
+            blobs.append((len(group), blob))
+            continue
+        if len(group) == 1:
+            raise ValueError("A single record exceeds the transcript chunk limit")
+        middle = len(group) // 2
+        pending.extend([group[middle:], group[:middle]])
+    return blobs
+
+
+def decode_chunk(data) -> list:
+    return json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+
+
+def _read_collection(chat_ref, kind: str):
+    records = []
+    snapshots = []
+    for snap in chat_ref.collection(kind).order_by("createdAt").stream():
+        data = snap.to_dict() or {}
+        data["id"] = snap.id
+        records.append(data)
+        snapshots.append(snap)
+    return records, snapshots
+
+
+def load_compacted(chat_ref, kind: str) -> list:
+    records = []
+    # Chunk ids are zero-padded, so the default __name__ order is chunk order.
+    chunks = (
+        chat_ref.collection(TRANSCRIPTS_COLLECTION)
+        .where(filter=firestore.FieldFilter("kind", "==", kind))
+        .stream()
+    )
+    for snap in chunks:
+        data = snap.to_dict() or {}
+        if data.get("encoding") != ENCODING:
+            logger.warning("transcripts: unknown encoding %s", data.get("encoding"))
+            continue
+        records.extend(decode_chunk(data["data"]))
+    return records
+
+
+def compact_chat(db, chat_ref, chat_data, now_ms) -> dict:
+    # Chunks are written and the chat is marked before any original is deleted, so a
+    # crash mid-way leaves data readable and a re-run only finishes the deletes. Chats
+    # re-opened after compaction get their new records appended as extra chunks.
+    summary = dict((chat_data.get("compaction") or {}).get("kinds") or {})
+    stats = {"chatId": chat_ref.id, "records": 0, "chunks": 0, "rawBytes": 0, "storedBytes": 0}
+    snapshots = []
+    batch = db.batch()
+    pending = 0
+    for kind in COMPACTED_KINDS:
+        records, kind_snapshots = _read_collection(chat_ref, kind)
+        snapshots.extend(kind_snapshots)
+        previous = summary.get(kind) or {"count": 0, "chunks": 0}
+        if records and previous["chunks"]:
+            compacted_ids = {record.get("id") for record in load_compacted(chat_ref, kind)}
+            records = [record for record in records if record["id"] not in compacted_ids]
+        if not records:
+            continue
+        blobs = encode_records(records)
+        for offset, (count, blob) in enumerate(blobs):
+            index = previous["chunks"] + offset
+            batch.set(
+                chat_ref.collection(TRANSCRIPTS_COLLECTION).document(f"{kind}-{index:04d}"),
+                {
+                    "kind": kind,
+                    "index": index,
+                    "count": count,
+                    "encoding": ENCODING,
+                    "data": blob,
+                    "createdAt": now_ms(),
+                },
+            )
+            pending += 1
+            if pending >= BATCH_LIMIT:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+        summary[kind] = {
+            "count": previous["count"] + len(records),
+            "chunks": previous["chunks"] + len(blobs),
+        }
+        stats["records"] += len(records)
+        stats["chunks"] += len(blobs)
+        stats["rawBytes"] += len(_dump(records))
+        stats["storedBytes"] += sum(len(blob) for _, blob in blobs)
+
+    if stats["chunks"]:
+        batch.update(
+            chat_ref,
+            # updatedAt is left alone so the chat keeps its place in the user's list.
+            {"compaction": {"kinds": summary, "compactedAt": now_ms()}},
+        )
+        pending += 1
+    if pending:
+        batch.commit()
+        batch = db.batch()
+        pending = 0
+    for reference in [snap.reference for snap in snapshots]:
+        batch.delete(reference)
+        pending += 1
+        if pending >= BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    stats["deleted"] = len(snapshots)
+    return stats
+
+
+def run_compaction(db, now_ms, time_budget_seconds: float = None, grace_ms: int = COMPACTION_GRACE_MS):
+    # Walks closed/archived chats by updatedAt from the last checkpoint; chats that are
+    # re-opened and closed again move past the cursor and get compacted once more.
+    job_ref = db.collection(COMPACTION_JOB_PATH[0]).document(COMPACTION_JOB_PATH[1])
+    snapshot = job_ref.get()
+    state = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    cursor = state.get("cursor") or 0
+    cutoff = now_ms() - grace_ms
+    started = time.perf_counter()
+    totals = {"chats": 0, "records": 0, "chunks": 0, "rawBytes": 0, "storedBytes": 0, "deleted": 0}
+    while True:
+        elapsed = time.perf_counter() - started
+        if time_budget_seconds is not None and elapsed >= time_budget_seconds:
+            break
+        page = list(
+            db.collection("chats")
+            .where(filter=firestore.FieldFilter("status", "in", list(COMPACTABLE_STATUSES)))
+            .where(filter=firestore.FieldFilter("updatedAt", ">", cursor))
+            .where(filter=firestore.FieldFilter("updatedAt", "<=", cutoff))
+            .order_by("updatedAt")
+            .limit(COMPACTION_PAGE_SIZE)
+            .stream()
+        )
+        if not page:
+            break
+        for chat_snapshot in page:
+            stats = compact_chat(db, chat_snapshot.reference, chat_snapshot.to_dict() or {}, now_ms)
+            totals["chats"] += 1
+            for key in ("records", "chunks", "rawBytes", "storedBytes", "deleted"):
+                totals[key] += stats[key]
+        cursor = (page[-1].to_dict() or {}).get("updatedAt") or cursor
+        job_ref.set({"cursor": cursor, "updatedAt": now_ms()}, merge=True)
+    totals["cursor"] = cursor
+    if totals["storedBytes"]:
+        totals["compressionRatio"] = round(totals["rawBytes"] / totals["storedBytes"], 2)
+    logger.info("transcripts: compaction finished", extra=totals)
+    return totals
+
+
+def _live_chunk_id(index: int) -> str:
+    return f"{LIVE_KIND}-{index:04d}"
+
+
+def transcript_record(message_id: str, data) -> dict:
+    # Only what history consumers read; the full doc stays in messages.
+    return {
+        "id": message_id,
+        "role": data.get("role"),
+        "promptType": data.get("promptType"),
+        "content": data.get("content"),
+        "createdAt": data.get("createdAt") or 0,
+        "intakeStage": (data.get("metadata") or {}).get("intakeStage"),
+    }
+
+
+def _record_bytes(record) -> int:
+    return len(_dump(record))
+
+
+def _sort_key(record):
+    return (record.get("createdAt") or 0, record.get("id") or "")
+
+
+def _is_final(data) -> bool:
+    return data is not None and data.get("status") != "streaming"
+
+
+def _seed_live(transaction, chat_ref, message_id: str):
+    records = sorted(
+        (
+            transcript_record(snap.id, snap.to_dict() or {})
+            for snap in transaction.get(chat_ref.collection("messages"))
+            if snap.id != message_id and _is_final(snap.to_dict() or {})
+        ),
+        key=_sort_key,
+    )
+    chunks = [[]]
+    size = 0
+    locations = {}
+    for record in records:
+        if chunks[-1] and size + _record_bytes(record) > LIVE_CHUNK_BYTES:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(record)
+        size += _record_bytes(record)
+        locations[record["id"]] = len(chunks) - 1
+    head = {"kind": "live-head", "chunks": len(chunks), "locations": locations}
+    return head, {
+        index: {"kind": LIVE_KIND, "index": index, "records": chunk}
+        for index, chunk in enumerate(chunks)
+    }
+
+
+def live_target(head, message_id: str) -> int:
+    location = head["locations"].get(message_id)
+    return head["chunks"] - 1 if location is None else location
+
+
+def merge_live_record(head, chunks, message_id: str, record, max_bytes: int = LIVE_CHUNK_BYTES):
+    # Applies one upsert (record) or removal (None) to the head and the loaded chunks,
+    # which must include live_target(head, message_id). Returns False for no-ops so
+    # redelivered events and unchanged rewrites skip the write.
+    location = head["locations"].get(message_id)
+    if record is None and location is None:
+        return False
+    target = live_target(head, message_id)
+    previous = chunks[target]["records"]
+    records = [item for item in previous if item.get("id") != message_id]
+    if record is None:
+        head["locations"].pop(message_id, None)
+    elif location is not None and record in previous:
+        return False
+    elif location is None and records and (
+        sum(_record_bytes(item) for item in records) + _record_bytes(record) > max_bytes
+    ):
+        # Roll over before the 1 MiB limit; readers sort across chunks anyway.
+        target += 1
+        head["chunks"] = target + 1
+        chunks[target] = {"kind": LIVE_KIND, "index": target, "records": [record]}
+        head["locations"][message_id] = target
+        return True
+    else:
+        records.append(record)
+        records.sort(key=_sort_key)
+        head["locations"][message_id] = target
+    chunks[target]["records"] = records
+    return True
+
+
+def apply_message_write(db, chat_ref, message_id: str, data) -> bool:
+    # Runs in a transaction on the head doc, so concurrent triggers serialize instead of
+    # overwriting each other's appends.
+    transcripts = chat_ref.collection(TRANSCRIPTS_COLLECTION)
+    head_ref = transcripts.document(LIVE_HEAD_ID)
+    record = transcript_record(message_id, data) if _is_final(data) else None
+    if data is not None and record is None:
+        # Partial streaming updates land once the message is finalized.
+        return False
+
+    @firestore.transactional
+    def apply(transaction):
+        head_snapshot = head_ref.get(transaction=transaction)
+        if head_snapshot.exists:
+            head = head_snapshot.to_dict() or {}
+            head["locations"] = dict(head.get("locations") or {})
+            chunks = {}
+        elif record is None:
+            return False
+        else:
+            # First write for this chat: seed from the messages already stored.
+            head, chunks = _seed_live(transaction, chat_ref, message_id)
+        target = live_target(head, message_id)
+        if target not in chunks:
+            snapshot = transcripts.document(_live_chunk_id(target)).get(transaction=transaction)
+            chunks[target] = (
+                snapshot.to_dict()
+                if snapshot.exists
+                else {"kind": LIVE_KIND, "index": target, "records": []}
+            )
+        if not merge_live_record(head, chunks, message_id, record):
+            return False
+        for index, payload in chunks.items():
+            transaction.set(transcripts.document(_live_chunk_id(index)), payload)
+        transaction.set(head_ref, head)
+        return True
+
+    return apply(db.transaction())
+
+
+def load_transcript(chat_ref):
+    # One query returns compacted message chunks and live chunks; None means the chat
+    # has neither and callers should read the messages collection.
+    compacted = []
+    live = []
+    found = False
+    query = chat_ref.collection(TRANSCRIPTS_COLLECTION).where(
+        filter=firestore.FieldFilter("kind", "in", ["messages", LIVE_KIND])
+    )
+    for snap in query.stream():
+        found = True
+        data = snap.to_dict() or {}
+        if data.get("kind") == LIVE_KIND:
+            live.extend(data.get("records") or [])
+        elif data.get("encoding") == ENCODING:
+            compacted.extend(decode_chunk(data["data"]))
+    if not found:
+        return None
+    messages = {record["id"]: record for record in compacted}
+    for record in live:
+        messages[record["id"]] = {
+            "id": record["id"],
+            "role": record.get("role"),
+            "promptType": record.get("promptType"),
+            "content": record.get("content"),
+            "createdAt": record.get("createdAt"),
+            "metadata": {"intakeStage": record.get("intakeStage")},
+        }
+    return sorted(messages.values(), key=_sort_key)
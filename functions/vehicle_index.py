@@ -0,0 +1,227 @@
+import re
+from bisect import bisect_left
+from threading import Lock
+
+CATALOG_LEVELS = ("years", "makes", "models", "submodels", "engines")
+LEVEL_SELECTION_KEYS = ("year", "make", "model", "submodel", "engine")
+
+ENGINE_FIELDS = ("displacementLiters", "cylinders", "fuelType", "aspiration")
+
+_KEY_MAX = "\uffff"
+
+
+def _normalize_token(value: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", value.lower())
+
+
+def _tokenize(text: str):
+    # "F-150" indexes as "f150" plus its parts so both "f150" and "f 150" match.
+    tokens = []
+    for word in re.split(r"\s+", str(text or "").strip()):
+        joined = _normalize_token(word)
+        if not joined:
+            continue
+        tokens.append(joined)
+        parts = [_normalize_token(part) for part in re.split(r"[-/_]", word)]
+        parts = [part for part in parts if part and part != joined]
+        tokens.extend(parts)
+    return tokens
+
+
+def _query_tokens(text: str):
+    tokens = []
+    for word in re.split(r"\s+", str(text or "").strip()):
+        token = _normalize_token(word)
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def catalog_key_from_path(path: str):
+    segments = [segment for segment in path.split("/") if segment]
+    ids = {}
+    for index, segment in enumerate(segments[:-1]):
+        if segment in CATALOG_LEVELS:
+            ids[segment] = segments[index + 1]
+    key = []
+    for level in CATALOG_LEVELS:
+        if level not in ids:
+            break
+        key.append(ids[level])
+    if len(key) != len(ids):
+        return None
+    return tuple(key) or None
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+
+
+class PrefixTrie:
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def add(self, token: str, key):
+        node = self._root
+        for char in token:
+            node = node.children.setdefault(char, _TrieNode())
+        node.keys.add(key)
+
+    def remove(self, token: str, key):
+        path = [self._root]
+        for char in token:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].keys.discard(key)
+        # Prune empty branches so renames do not leave dead nodes behind.
+        for depth in range(len(token), 0, -1):
+            node = path[depth]
+            if node.keys or node.children:
+                break
+            del path[depth - 1].children[token[depth - 1]]
+
+    def search(self, prefix: str):
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        found = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            found.update(current.keys)
+            stack.extend(current.children.values())
+        return found
+
+
+class VehicleIndex:
+    def __init__(self):
+        self._lock = Lock()
+        self._nodes = {}
+        self._level_keys = [[] for _ in CATALOG_LEVELS]
+        self._tokens = {}
+        self._trie = PrefixTrie()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def upsert(self, key, data):
+        key = tuple(key)
+        if not key or len(key) > len(CATALOG_LEVELS):
+            return
+        data = data or {}
+        level = CATALOG_LEVELS[len(key) - 1]
+        name = str(data.get("name") or data.get("label") or data.get("year") or key[-1])
+        node = {
+            "id": key[-1],
+            "name": name,
+            "sortOrder": data.get("sortOrder"),
+        }
+        if level == "engines":
+            for field in ENGINE_FIELDS:
+                if data.get(field) is not None:
+                    node[field] = data[field]
+        tokens = set(_tokenize(name)) | set(_tokenize(key[-1]))
+        with self._lock:
+            keys = self._level_keys[len(key) - 1]
+            if key not in self._nodes:
+                keys.insert(bisect_left(keys, key), key)
+            for token in self._tokens.get(key, ()):
+                self._trie.remove(token, key)
+            for token in tokens:
+                self._trie.add(token, key)
+            self._tokens[key] = tokens
+            self._nodes[key] = node
+
+    def remove(self, key):
+        key = tuple(key)
+        with self._lock:
+            doomed = [key] if key in self._nodes else []
+            for depth in range(len(key), len(CATALOG_LEVELS)):
+                doomed.extend(self._range(depth, key))
+            for doomed_key in doomed:
+                keys = self._level_keys[len(doomed_key) - 1]
+                del keys[bisect_left(keys, doomed_key)]
+                for token in self._tokens.pop(doomed_key, ()):
+                    self._trie.remove(token, doomed_key)
+                del self._nodes[doomed_key]
+
+    def _range(self, depth: int, prefix):
+        keys = self._level_keys[depth]
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + (_KEY_MAX,))
+        return keys[start:end]
+
+    def _sorted_nodes(self, keys):
+        return sorted(
+            (self._nodes[key] for key in keys),
+            key=lambda node: (
+                node["sortOrder"] is None,
+                node["sortOrder"] if node["sortOrder"] is not None else 0,
+                node["name"].lower(),
+            ),
+        )
+
+    def options(self, selection):
+        prefix = tuple(selection or ())
+        depth = len(prefix)
+        if depth >= len(CATALOG_LEVELS):
+            return CATALOG_LEVELS[-1], []
+        with self._lock:
+            if depth and prefix not in self._nodes:
+                return CATALOG_LEVELS[depth], []
+            return CATALOG_LEVELS[depth], [
+                dict(node) for node in self._sorted_nodes(self._range(depth, prefix))
+            ]
+
+    def _describe(self, key):
+        path = {}
+        names = []
+        for depth in range(len(key)):
+            path[LEVEL_SELECTION_KEYS[depth]] = key[depth]
+            ancestor = self._nodes.get(key[: depth + 1])
+            names.append(ancestor["name"] if ancestor else key[depth])
+        node = self._nodes[key]
+        result = {
+            "level": CATALOG_LEVELS[len(key) - 1],
+            "path": path,
+            "label": " ".join(names),
+        }
+        for field in ENGINE_FIELDS:
+            if field in node:
+                result[field] = node[field]
+        return result
+
+    def search(self, text: str, limit: int = 20):
+        tokens = _query_tokens(text)
+        if not tokens:
+            return []
+        with self._lock:
+            matches = [self._trie.search(token) for token in tokens]
+            if not all(matches):
+                return []
+            # Expand from the most selective token, then require every other
+            # token to match the candidate or one of its ancestors.
+            order = sorted(range(len(tokens)), key=lambda i: len(matches[i]))
+            seeds = matches[order[0]]
+            rest = [matches[i] for i in order[1:]]
+            candidates = set()
+            for seed in seeds:
+                candidates.add(seed)
+                for depth in range(len(seed), len(CATALOG_LEVELS)):
+                    candidates.update(self._range(depth, seed))
+            results = []
+            for key in candidates:
+                prefixes = [key[: depth + 1] for depth in range(len(key))]
+                if all(any(prefix in matched for prefix in prefixes) for matched in rest):
+                    results.append(key)
+            # Shallowest complete match first so "2019 f150" lands on the model.
+            results.sort(key=lambda key: (len(key), key))
+            return [self._describe(key) for key in results[:limit]]
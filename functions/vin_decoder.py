@@ -0,0 +1,160 @@
+import re
+import time
+from functools import lru_cache
+from typing import Any
+
+DECODED_FIELDS = ("engineType", "fuelType", "drivetrain")
+
+_TRANSLITERATION = {
+    **{str(digit): digit for digit in range(10)},
+    "A": 1, "B": 2, "C": 3, "D": 4, "E": 5, "F": 6, "G": 7, "H": 8,
+    "J": 1, "K": 2, "L": 3, "M": 4, "N": 5, "P": 7, "R": 9,
+    "S": 2, "T": 3, "U": 4, "V": 5, "W": 6, "X": 7, "Y": 8, "Z": 9,
+}
+_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+_YEAR_CODES = "ABCDEFGHJKLMNPRSTVWXY123456789"
+_VIN_PATTERN = re.compile(r"^[A-HJ-NPR-Z0-9]{17}$")
+
+WMI_MANUFACTURERS = {
+    "1FA": "Ford", "1FM": "Ford", "1FT": "Ford", "1FD": "Ford", "2FM": "Ford",
+    "3FA": "Ford", "1LN": "Lincoln", "5LM": "Lincoln",
+    "1G1": "Chevrolet", "1GC": "Chevrolet", "1GN": "Chevrolet", "2G1": "Chevrolet",
+    "3GC": "Chevrolet", "3GN": "Chevrolet", "1GT": "GMC", "1GK": "GMC", "3GT": "GMC",
+    "1G6": "Cadillac", "1GY": "Cadillac", "1G4": "Buick", "5GA": "Buick",
+    "1C3": "Chrysler", "2C3": "Chrysler", "1C4": "Jeep", "1J4": "Jeep", "1J8": "Jeep",
+    "1C6": "Ram", "3C6": "Ram", "3C7": "Ram", "2C4": "Dodge", "1B3": "Dodge",
+    "1HG": "Honda", "2HG": "Honda", "5FN": "Honda", "5J6": "Honda", "JHM": "Honda",
+    "19U": "Acura", "JH4": "Acura",
+    "4T1": "Toyota", "4T3": "Toyota", "5TD": "Toyota", "5TF": "Toyota", "2T1": "Toyota",
+    "2T3": "Toyota", "JTD": "Toyota", "JTE": "Toyota", "JTM": "Toyota", "JTN": "Toyota",
+    "JTH": "Lexus", "2T2": "Lexus",
+    "1N4": "Nissan", "1N6": "Nissan", "3N1": "Nissan", "5N1": "Nissan", "JN1": "Nissan",
+    "JN8": "Nissan",
+    "JF1": "Subaru", "JF2": "Subaru", "4S3": "Subaru", "4S4": "Subaru",
+    "JM1": "Mazda", "JM3": "Mazda", "3MZ": "Mazda",
+    "KM8": "Hyundai", "KMH": "Hyundai", "5NP": "Hyundai", "5NM": "Hyundai",
+    "KNA": "Kia", "KND": "Kia", "5XX": "Kia", "5XY": "Kia",
+    "WBA": "BMW", "WBS": "BMW", "5UX": "BMW", "5YM": "BMW",
+    "WDD": "Mercedes-Benz", "WDB": "Mercedes-Benz", "WDC": "Mercedes-Benz",
+    "W1K": "Mercedes-Benz", "W1N": "Mercedes-Benz", "4JG": "Mercedes-Benz",
+    "WAU": "Audi", "WA1": "Audi", "WUA": "Audi",
+    "WVW": "Volkswagen", "WVG": "Volkswagen", "1VW": "Volkswagen", "3VW": "Volkswagen",
+    "WP0": "Porsche", "WP1": "Porsche",
+    "YV1": "Volvo", "YV4": "Volvo", "SAL": "Land Rover", "SAJ": "Jaguar",
+    "5YJ": "Tesla", "7SA": "Tesla", "LRW": "Tesla", "7FC": "Rivian", "50E": "Lucid",
+}
+
+# Pluggable VDS tables keyed by WMI. Each entry matches VIN positions 4-8 with
+# "?" wildcards and an optional inclusive model-year range; earlier entries win.
+# Only the fuel type of electric-only makes ships here; engineType and drivetrain are
+# prefilled once per-manufacturer tables are added with register_vds_table.
+VDS_TABLES = {
+    "5YJ": [{"match": "?????", "fields": {"fuelType": "electric"}}],
+    "7SA": [{"match": "?????", "fields": {"fuelType": "electric"}}],
+    "LRW": [{"match": "?????", "fields": {"fuelType": "electric"}}],
+    "7FC": [{"match": "?????", "fields": {"fuelType": "electric"}}],
+    "50E": [{"match": "?????", "fields": {"fuelType": "electric"}}],
+}
+
+
+def register_vds_table(wmi: str, entries) -> None:
+    table = VDS_TABLES.setdefault(wmi.upper(), [])
+    for entry in entries:
+        match = str(entry.get("match") or "?????").upper()
+        if len(match) != 5:
+            raise ValueError(f"VDS pattern must cover 5 characters: {match!r}")
+        fields = {
+            key: value
+            for key, value in (entry.get("fields") or {}).items()
+            if key in DECODED_FIELDS and value
+        }
+        table.append({"match": match, "years": entry.get("years"), "fields": fields})
+    _decode_cached.cache_clear()
+
+
+def normalize_vin(vin: Any) -> str:
+    if not isinstance(vin, str):
+        return ""
+    return re.sub(r"[\s-]", "", vin).upper()
+
+
+def compute_check_digit(vin: str) -> str:
+    total = sum(_TRANSLITERATION[char] * weight for char, weight in zip(vin, _WEIGHTS))
+    remainder = total % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def _year_hint(value):
+    # Car docs hold whatever the client wrote; anything but a year is no hint. Keeps
+    # _decode_cached keys hashable.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def _model_year(vin: str, year_hint=None):
+    code = vin[9]
+    if code not in _YEAR_CODES:
+        return None
+    offset = _YEAR_CODES.index(code)
+    candidates = [1980 + offset, 2010 + offset]
+    if year_hint is not None:
+        return min(candidates, key=lambda year: abs(year - year_hint))
+    # North American light vehicles use a letter in position 7 from 2010 on.
+    latest = time.gmtime().tm_year + 1
+    if vin[6].isalpha() and candidates[1] <= latest:
+        return candidates[1]
+    return candidates[0]
+
+
+def _match_vds(vin: str, model_year):
+    fields = {}
+    vds = vin[3:8]
+    for entry in VDS_TABLES.get(vin[:3], ()):
+        if any(p != "?" and p != c for p, c in zip(entry["match"], vds)):
+            continue
+        years = entry.get("years")
+        if years and (model_year is None or not years[0] <= model_year <= years[1]):
+            continue
+        for key, value in entry["fields"].items():
+            fields.setdefault(key, value)
+    return fields
+
+
+@lru_cache(maxsize=4096)
+def _decode_cached(vin: str, year_hint):
+    result = {
+        "vin": vin,
+        "valid": False,
+        "checkDigitValid": False,
+        "wmi": None,
+        "manufacturer": None,
+        "modelYear": None,
+        "fields": {},
+    }
+    if not _VIN_PATTERN.match(vin):
+        result["error"] = "VIN must be 17 characters and exclude I, O and Q"
+        return result
+    result["checkDigitValid"] = compute_check_digit(vin) == vin[8]
+    result["valid"] = True
+    result["wmi"] = vin[:3]
+    result["manufacturer"] = WMI_MANUFACTURERS.get(vin[:3])
+    result["modelYear"] = _model_year(vin, year_hint)
+    result["fields"] = _match_vds(vin, result["modelYear"])
+    return result
+
+
+def decode_vin(vin, year_hint=None) -> dict:
+    result = _decode_cached(normalize_vin(vin), _year_hint(year_hint))
+    return {**result, "fields": dict(result["fields"])}
+
+
+def decode_vins(vins, year_hints=None) -> list:
+    hints = list(year_hints) if year_hints is not None else [None] * len(vins)
+    if len(hints) != len(vins):
+        raise ValueError("year_hints must match vins length")
+    return [decode_vin(vin, hint) for vin, hint in zip(vins, hints)]